@@ -0,0 +1,36 @@
+"""conversation summary and message history index
+
+Revision ID: 3f1a9c2d7b10
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Tables are created by Base.metadata.create_all at startup, which may
+    # already have added these to a new database
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("conversations")}
+    if "summary" not in columns:
+        op.add_column("conversations", sa.Column("summary", sa.Text(), nullable=True))
+    if "summary_message_id" not in columns:
+        op.add_column("conversations", sa.Column("summary_message_id", sa.Integer(), nullable=True))
+    indexes = {index["name"] for index in inspector.get_indexes("messages")}
+    if "ix_messages_conversation_id_id" not in indexes:
+        op.create_index("ix_messages_conversation_id_id", "messages", ["conversation_id", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_conversation_id_id", table_name="messages")
+    op.drop_column("conversations", "summary_message_id")
+    op.drop_column("conversations", "summary")
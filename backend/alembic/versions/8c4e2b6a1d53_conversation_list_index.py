@@ -0,0 +1,31 @@
+"""conversation list index
+
+Revision ID: 8c4e2b6a1d53
+Revises: 3f1a9c2d7b10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2b6a1d53'
+down_revision = '3f1a9c2d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    indexes = {index["name"] for index in inspector.get_indexes("conversations")}
+    if "ix_conversations_user_id_updated_at_id" not in indexes:
+        op.create_index(
+            "ix_conversations_user_id_updated_at_id",
+            "conversations",
+            ["user_id", "updated_at", "id"]
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_conversations_user_id_updated_at_id", table_name="conversations")
@@ -0,0 +1,131 @@
+"""analytics tenant_id and hourly/daily rollups
+
+Revision ID: b2d8f4e6a917
+Revises: e5b7d1c94a26
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d8f4e6a917'
+down_revision = 'e5b7d1c94a26'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("analytics")}
+    if "tenant_id" not in columns:
+        op.add_column("analytics", sa.Column("tenant_id", sa.Integer(), nullable=True))
+    indexes = {index["name"] for index in inspector.get_indexes("analytics")}
+    for name, column in (("ix_analytics_user_id", "user_id"), ("ix_analytics_tenant_id", "tenant_id")):
+        if name not in indexes:
+            op.create_index(name, "analytics", [column])
+
+    if not inspector.has_table("analytics_rollups"):
+        op.create_table(
+            "analytics_rollups",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("period", sa.String(), nullable=False),
+            sa.Column("period_start", sa.DateTime(), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("tenant_id", sa.Integer()),
+            sa.Column("queries", sa.Integer()),
+            sa.Column("tokens_used", sa.Integer()),
+            sa.Column("cost", sa.Float()),
+            sa.Column("response_time_sum", sa.Float()),
+            sa.Column("response_time_count", sa.Integer()),
+            sa.UniqueConstraint("period", "user_id", "period_start", name="uq_analytics_rollups_period_user_start"),
+        )
+        op.create_index("ix_analytics_rollups_id", "analytics_rollups", ["id"])
+        op.create_index("ix_analytics_rollups_tenant_period_start", "analytics_rollups", ["tenant_id", "period", "period_start"])
+
+    _backfill_query_counts()
+
+
+def _backfill_query_counts() -> None:
+    """
+    Rollups for the queries made before the recorder existed, counted from
+    user messages as the old overview did (no timings or tokens were kept).
+    If the app already recorded events, only messages older than the first
+    of them are counted, and added to any rollup rows of the same period.
+    """
+    bind = op.get_bind()
+    rollups = sa.table(
+        "analytics_rollups",
+        sa.column("period", sa.String),
+        sa.column("period_start", sa.DateTime),
+        sa.column("user_id", sa.Integer),
+        sa.column("tenant_id", sa.Integer),
+        sa.column("queries", sa.Integer),
+        sa.column("tokens_used", sa.Integer),
+        sa.column("cost", sa.Float),
+        sa.column("response_time_sum", sa.Float),
+        sa.column("response_time_count", sa.Integer),
+    )
+    analytics = sa.table("analytics", sa.column("created_at", sa.DateTime))
+    messages = sa.table(
+        "messages",
+        sa.column("id", sa.Integer),
+        sa.column("conversation_id", sa.Integer),
+        sa.column("role", sa.String),
+        sa.column("created_at", sa.DateTime),
+    )
+    conversations = sa.table("conversations", sa.column("id"), sa.column("user_id"))
+    users = sa.table("users", sa.column("id"), sa.column("tenant_id"))
+
+    first_recorded = bind.execute(sa.select(sa.func.min(analytics.c.created_at))).scalar()
+
+    counts = {}
+    last_id = 0
+    while True:
+        query = (
+            sa.select(messages.c.id, messages.c.created_at, users.c.id, users.c.tenant_id)
+            .select_from(messages.join(conversations, conversations.c.id == messages.c.conversation_id)
+                         .join(users, users.c.id == conversations.c.user_id))
+            .where(messages.c.id > last_id, messages.c.role == "user")
+        )
+        if first_recorded is not None:
+            query = query.where(messages.c.created_at < first_recorded)
+        rows = bind.execute(query.order_by(messages.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        for _, created_at, user_id, tenant_id in rows:
+            if created_at is None:
+                continue
+            for period, start in (
+                ("hour", created_at.replace(minute=0, second=0, microsecond=0)),
+                ("day", created_at.replace(hour=0, minute=0, second=0, microsecond=0)),
+            ):
+                key = (period, start, user_id, tenant_id)
+                counts[key] = counts.get(key, 0) + 1
+        last_id = rows[-1][0]
+
+    values = [
+        {
+            "period": period, "period_start": start, "user_id": user_id, "tenant_id": tenant_id,
+            "queries": queries, "tokens_used": 0, "cost": 0.0, "response_time_sum": 0.0, "response_time_count": 0
+        }
+        for (period, start, user_id, tenant_id), queries in counts.items()
+    ]
+    dialect = postgresql if bind.dialect.name == "postgresql" else sqlite
+    for start in range(0, len(values), 1000):
+        statement = dialect.insert(rollups).values(values[start:start + 1000])
+        bind.execute(statement.on_conflict_do_update(
+            index_elements=["period", "user_id", "period_start"],
+            set_={"queries": rollups.c.queries + statement.excluded.queries}
+        ))
+
+
+def downgrade() -> None:
+    op.drop_table("analytics_rollups")
+    op.drop_index("ix_analytics_tenant_id", table_name="analytics")
+    op.drop_index("ix_analytics_user_id", table_name="analytics")
+    op.drop_column("analytics", "tenant_id")
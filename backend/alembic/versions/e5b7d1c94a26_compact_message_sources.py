@@ -0,0 +1,80 @@
+"""compact message sources to chunk references
+
+Revision ID: e5b7d1c94a26
+Revises: 8c4e2b6a1d53
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7d1c94a26'
+down_revision = '8c4e2b6a1d53'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+messages = sa.table(
+    "messages",
+    sa.column("id", sa.Integer),
+    sa.column("role", sa.String),
+    sa.column("sources", sa.JSON),
+)
+
+
+def _chunk_id(metadata):
+    # Same naming as app.core.source_refs.chunk_id_for, frozen for this migration
+    document_id = metadata.get("document_id")
+    if document_id is None:
+        return None
+    if metadata.get("content_hash"):
+        return f"doc_{document_id}_{metadata['content_hash']}_0"
+    if metadata.get("chunk_index") is not None:
+        return f"doc_{document_id}_chunk_{metadata['chunk_index']}"
+    return None
+
+
+def _compact(sources):
+    refs = []
+    for source in sources or []:
+        if not isinstance(source, dict) or "content" not in source:
+            refs.append(source)
+            continue
+        metadata = source.get("metadata") or {}
+        chunk_id = source.get("chunk_id") or _chunk_id(metadata)
+        if chunk_id is None:
+            refs.append(source)
+            continue
+        refs.append({"chunk_id": chunk_id, "document_id": metadata.get("document_id"), "score": source.get("score")})
+    return refs
+
+
+def upgrade() -> None:
+    # Rewrites assistant messages in id order, one batch at a time, so it can
+    # run on a large table without loading it. PostgreSQL only returns the
+    # space to the OS after VACUUM FULL messages (or pg_repack).
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(messages.c.id, messages.c.sources)
+            .where(messages.c.id > last_id, messages.c.role == "assistant")
+            .order_by(messages.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for message_id, sources in rows:
+            compacted = _compact(sources)
+            if compacted != (sources or []):
+                bind.execute(messages.update().where(messages.c.id == message_id).values(sources=compacted))
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    # The removed previews can't be restored, and the code before this
+    # revision shows reference-only sources without their text
+    pass
@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
 
-from app.db.database import get_db
-from app.db.models import User, Analytics, Message, Document
+from app.db.database import get_async_db
+from app.db.models import User, AnalyticsRollup, Document
 from app.api.v1.auth import get_current_user
 
 router = APIRouter()
@@ -26,68 +26,63 @@ class UsageStats(BaseModel):
 @router.get("/overview", response_model=AnalyticsResponse)
 async def get_analytics_overview(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get analytics overview for current user"""
     
-    # Total queries
-    total_queries = db.query(func.count(Message.id)).filter(
-        Message.conversation_id.in_(
-            db.query(Message.conversation_id).join(Message.conversation).filter(
-                Message.conversation.has(user_id=current_user.id)
-            )
-        ),
-        Message.role == "user"
-    ).scalar() or 0
+    # Daily rollups: one row per active day, however many queries were made
+    totals = (await db.execute(
+        select(
+            func.sum(AnalyticsRollup.queries).label("queries"),
+            func.sum(AnalyticsRollup.tokens_used).label("tokens"),
+            func.sum(AnalyticsRollup.cost).label("cost"),
+            func.sum(AnalyticsRollup.response_time_sum).label("response_time_sum"),
+            func.sum(AnalyticsRollup.response_time_count).label("response_time_count")
+        ).where(
+            AnalyticsRollup.period == "day",
+            AnalyticsRollup.user_id == current_user.id
+        )
+    )).one()
     
     # Total documents
-    total_documents = db.query(func.count(Document.id)).filter(
-        Document.user_id == current_user.id
-    ).scalar() or 0
-    
-    # Analytics data
-    analytics_data = db.query(
-        func.avg(Analytics.response_time).label("avg_response_time"),
-        func.sum(Analytics.tokens_used).label("total_tokens"),
-        func.sum(Analytics.cost).label("total_cost")
-    ).filter(
-        Analytics.user_id == current_user.id
-    ).first()
+    total_documents = await db.scalar(
+        select(func.count(Document.id)).where(Document.user_id == current_user.id)
+    ) or 0
     
     return {
-        "total_queries": total_queries,
+        "total_queries": totals.queries or 0,
         "total_documents": total_documents,
-        "avg_response_time": analytics_data.avg_response_time or 0.0,
-        "total_tokens_used": analytics_data.total_tokens or 0,
-        "total_cost": analytics_data.total_cost or 0.0
+        "avg_response_time": (totals.response_time_sum or 0.0) / totals.response_time_count
+            if totals.response_time_count else 0.0,
+        "total_tokens_used": totals.tokens or 0,
+        "total_cost": totals.cost or 0.0
     }
 
 @router.get("/usage", response_model=List[UsageStats])
 async def get_usage_stats(
     days: int = 7,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get usage statistics for the last N days"""
     
-    start_date = datetime.utcnow() - timedelta(days=days)
+    start_date = (datetime.utcnow() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
     
-    stats = db.query(
-        func.date(Analytics.created_at).label("date"),
-        func.count(Analytics.id).label("queries"),
-        func.sum(Analytics.tokens_used).label("tokens")
-    ).filter(
-        Analytics.user_id == current_user.id,
-        Analytics.created_at >= start_date
-    ).group_by(
-        func.date(Analytics.created_at)
-    ).all()
+    stats = (await db.execute(
+        select(AnalyticsRollup.period_start, AnalyticsRollup.queries, AnalyticsRollup.tokens_used)
+        .where(
+            AnalyticsRollup.period == "day",
+            AnalyticsRollup.user_id == current_user.id,
+            AnalyticsRollup.period_start >= start_date
+        )
+        .order_by(AnalyticsRollup.period_start)
+    )).all()
     
     return [
         {
-            "date": str(stat.date),
+            "date": stat.period_start.date().isoformat(),
             "queries": stat.queries,
-            "tokens": stat.tokens or 0
+            "tokens": stat.tokens_used or 0
         }
         for stat in stats
     ]
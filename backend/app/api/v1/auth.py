@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -9,7 +10,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-from app.db.database import get_db
+from app.db.database import AsyncSessionLocal, get_async_db
 from app.db.models import User, Tenant
 from app.core.config import settings
 
@@ -52,10 +53,7 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -72,27 +70,30 @@ async def get_current_user(
         logger.error(f"Token decode error: {e}")
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
+    # Own short session: a request-scoped one would keep its connection checked
+    # out until the response is sent, e.g. across a whole LLM call
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, user_id)
     if user is None:
         raise credentials_exception
     return user
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user exists
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create or get tenant
     tenant = None
     if user.tenant_name:
-        tenant = db.query(Tenant).filter(Tenant.name == user.tenant_name).first()
+        tenant = await db.scalar(select(Tenant).where(Tenant.name == user.tenant_name))
         if not tenant:
             tenant = Tenant(name=user.tenant_name)
             db.add(tenant)
-            db.commit()
-            db.refresh(tenant)
+            await db.commit()
+            await db.refresh(tenant)
     
     # Create user
     hashed_password = get_password_hash(user.password)
@@ -104,17 +105,17 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         tenant_id=tenant.id if tenant else None
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.username == form_data.username).first()
+    user = await db.scalar(select(User).where(User.username == form_data.username))
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,22 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
+import json
+import logging
+import time
 
-from app.db.database import get_db
+from app.db.database import AsyncSessionLocal, get_async_db
 from app.db.models import User, Conversation, Message
 from app.api.v1.auth import get_current_user
 from app.core.config import settings
+from app.core.analytics_recorder import analytics_recorder
+from app.core.history_manager import estimate_tokens, history_manager
+from app.core.metrics import RequestTrace, record_first_token, start_trace, track_stage
+from app.core.source_refs import compact_sources, resolve_sources
+from app.core.pagination import decode_cursor, encode_cursor, etag_matches, make_etag
+from app.core.model_registry import registry
 
-# Use local or cloud RAG based on configuration
-if getattr(settings, 'USE_LOCAL_MODELS', False):
-    from app.core.rag_orchestrator_local import RAG2OrchestratorLocal as RAG2Orchestrator
-else:
-    from app.core.rag_orchestrator import RAG2Orchestrator
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-rag_orchestrator = RAG2Orchestrator()
+
+def _create_rag_orchestrator():
+    # Imported here: the orchestrators pull in langchain and the model libraries,
+    # which would otherwise slow down every worker's startup
+    if getattr(settings, 'USE_LOCAL_MODELS', False):
+        from app.core.rag_orchestrator_local import RAG2OrchestratorLocal as RAG2Orchestrator
+    else:
+        from app.core.rag_orchestrator import RAG2Orchestrator
+    return RAG2Orchestrator()
+
+registry.register("rag_orchestrator", _create_rag_orchestrator)
+
+async def get_rag_orchestrator():
+    """Shared RAG orchestrator; waits for it if the models are still loading"""
+    try:
+        return await registry.get_async("rag_orchestrator")
+    except Exception as e:
+        logger.error(f"RAG pipeline unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="RAG pipeline is unavailable, please retry shortly")
 
 class MessageCreate(BaseModel):
     content: str
@@ -38,141 +63,470 @@ class ConversationResponse(BaseModel):
     title: str
     created_at: datetime
     updated_at: datetime
-    messages: List[MessageResponse] = []
+    messages: List[MessageResponse] = []  # latest page, oldest first
+    messages_cursor: Optional[str] = None  # for GET .../messages when older messages exist
+    sync_cursor: Optional[str] = None  # for GET .../messages/since to fetch newer messages
     
     class Config:
         from_attributes = True
 
+class ConversationSummary(BaseModel):
+    id: int
+    title: str
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+
+class ConversationPage(BaseModel):
+    items: List[ConversationSummary]
+    next_cursor: Optional[str] = None
+
+class MessagePage(BaseModel):
+    items: List[MessageResponse]  # oldest first
+    next_cursor: Optional[str] = None  # cursor for the page of older messages
+
+class MessageSync(BaseModel):
+    items: List[MessageResponse]  # oldest first
+    cursor: str  # pass back to get only messages after these
+    has_more: bool = False
+
 class ChatResponse(BaseModel):
     message: MessageResponse
     conversation_id: int
+    metadata: Optional[Dict[str, Any]] = None  # only with X-Debug-Timings: RAG metadata and stage timings
 
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     message: MessageCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    rag_orchestrator = Depends(get_rag_orchestrator),
+    debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings")
 ):
     """Send a message and get AI response"""
     
-    # Get or create conversation
-    if message.conversation_id:
-        conversation = db.query(Conversation).filter(
-            Conversation.id == message.conversation_id,
-            Conversation.user_id == current_user.id
-        ).first()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-    else:
-        conversation = Conversation(
-            user_id=current_user.id,
-            title=message.content[:50] + "..." if len(message.content) > 50 else message.content
-        )
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
-    
-    # Save user message
-    user_message = Message(
-        conversation_id=conversation.id,
-        role="user",
-        content=message.content
-    )
-    db.add(user_message)
-    db.commit()
-    
-    # Get conversation history
-    history = db.query(Message).filter(
-        Message.conversation_id == conversation.id
-    ).order_by(Message.created_at).all()
+    trace = _debug_trace(debug_timings)
     
-    conversation_history = [
-        {"role": msg.role, "content": msg.content}
-        for msg in history[:-1]  # Exclude current message
-    ]
+    # Two short transactions, before and after the RAG call, so no database
+    # connection is held while retrieval and generation run
+    with track_stage("chat", "prepare"):
+        conversation_id, conversation_history = await _prepare_conversation(message, current_user)
     
     # Process with RAG
     try:
-        # Temporarily override RAG mode if specified
-        original_mode = settings.RAG_MODE
-        if message.rag_mode:
-            settings.RAG_MODE = message.rag_mode
+        started = time.perf_counter()
+        with track_stage("chat", "query"):
+            rag_response = await rag_orchestrator.process_query(
+                query=message.content,
+                tenant_id=current_user.tenant_id or 0,
+                conversation_history=conversation_history,
+                conversation_id=conversation_id,
+                rag_mode=message.rag_mode
+            )
         
-        rag_response = await rag_orchestrator.process_query(
-            query=message.content,
-            tenant_id=current_user.tenant_id or 0,
-            conversation_history=conversation_history,
-            conversation_id=conversation.id
-        )
-        
-        # Restore original mode
-        settings.RAG_MODE = original_mode
+        _record_analytics(current_user, message, conversation_id, rag_response, time.perf_counter() - started)
         
         # Save assistant message
-        assistant_message = Message(
+        with track_stage("chat", "save"):
+            assistant_message = await _save_assistant_message(conversation_id, rag_response)
+        
+        return {
+            "message": {
+                "id": assistant_message.id,
+                "role": assistant_message.role,
+                "content": assistant_message.content,
+                "sources": rag_response["sources"],
+                "created_at": assistant_message.created_at
+            },
+            "conversation_id": conversation_id,
+            "metadata": _with_timings(rag_response.get("metadata", {}), trace) if trace else None
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+
+@router.post("/message/stream")
+async def stream_message(
+    message: MessageCreate,
+    current_user: User = Depends(get_current_user),
+    rag_orchestrator = Depends(get_rag_orchestrator),
+    debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings")
+):
+    """
+    Send a message and stream the AI response as Server-Sent Events.
+    
+    Events: "sources" (as soon as retrieval finishes), "token" (one per LLM chunk),
+    then "done" with the saved message id and metadata, or "error".
+    """
+    
+    # Time to first token is measured from here, history loading included
+    received = time.perf_counter()
+    trace = _debug_trace(debug_timings)
+    with track_stage("chat", "prepare"):
+        conversation_id, conversation_history = await _prepare_conversation(message, current_user)
+    tenant_id = current_user.tenant_id or 0
+    mode = message.rag_mode or settings.RAG_MODE
+    
+    async def event_stream():
+        final = None
+        first_token = True
+        started = time.perf_counter()
+        try:
+            with track_stage("chat", "stream"):
+                async for event in rag_orchestrator.stream_query(
+                    query=message.content,
+                    tenant_id=tenant_id,
+                    conversation_history=conversation_history,
+                    conversation_id=conversation_id,
+                    rag_mode=message.rag_mode
+                ):
+                    if event["event"] == "done":
+                        final = event["data"]
+                        continue
+                    if event["event"] == "sources":
+                        event["data"]["conversation_id"] = conversation_id
+                    elif event["event"] == "token" and first_token:
+                        record_first_token(mode, time.perf_counter() - received)
+                        first_token = False
+                    yield _sse(event["event"], event["data"])
+        except Exception as e:
+            logger.error(f"Error streaming message: {str(e)}")
+            yield _sse("error", {"detail": f"Error processing message: {str(e)}"})
+            return
+        
+        if final is None:
+            # The response has started already, so this is the only way to report it
+            logger.error(f"RAG stream for conversation {conversation_id} ended without a done event")
+            yield _sse("error", {"detail": "Error processing message: the answer was not completed"})
+            return
+        
+        _record_analytics(current_user, message, conversation_id, final, time.perf_counter() - started)
+        with track_stage("chat", "save"):
+            assistant_message = await _save_assistant_message(conversation_id, final)
+        
+        yield _sse("done", {
+            "message_id": assistant_message.id,
+            "conversation_id": conversation_id,
+            "confidence": final["confidence"],
+            "metadata": _with_timings(final["metadata"], trace) if trace else final["metadata"]
+        })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _debug_trace(header: Optional[str]) -> Optional[RequestTrace]:
+    """Collect this request's stage timings when the client sent X-Debug-Timings"""
+    if not settings.DEBUG_TIMINGS_ENABLED or not header or header.lower() in ("0", "false", "no"):
+        return None
+    return start_trace()
+
+def _with_timings(metadata: Dict[str, Any], trace: RequestTrace) -> Dict[str, Any]:
+    # A copy: the metadata may belong to an answer held in the answer cache
+    return {**metadata, "timings": trace.breakdown()}
+
+async def _prepare_conversation(
+    message: MessageCreate,
+    current_user: User
+) -> Tuple[int, List[Dict[str, str]]]:
+    """Get or create the conversation, save the user message and return the prior history"""
+    
+    async with AsyncSessionLocal() as db:
+        # Get or create conversation
+        if message.conversation_id:
+            conversation = await db.scalar(select(Conversation).where(
+                Conversation.id == message.conversation_id,
+                Conversation.user_id == current_user.id
+            ))
+            if not conversation:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            # Keeps recently active conversations at the top of the list
+            conversation.updated_at = datetime.utcnow()
+            
+            # Summary plus the latest turns, before the current message is added
+            conversation_history = await history_manager.load(db, conversation)
+        else:
+            conversation = Conversation(
+                user_id=current_user.id,
+                title=message.content[:50] + "..." if len(message.content) > 50 else message.content
+            )
+            db.add(conversation)
+            await db.flush()
+            conversation_history = []
+        
+        # Save user message
+        db.add(Message(
             conversation_id=conversation.id,
+            role="user",
+            content=message.content
+        ))
+        await db.commit()
+        return conversation.id, conversation_history
+
+def _record_analytics(
+    current_user: User,
+    message: MessageCreate,
+    conversation_id: int,
+    rag_response: Dict[str, Any],
+    response_time: float
+):
+    # Buffered in memory; AnalyticsRecorder writes it in the background.
+    # Local models report no usage, so tokens are estimated from the text.
+    analytics_recorder.record(
+        user_id=current_user.id,
+        tenant_id=current_user.tenant_id,
+        query=message.content,
+        response_time=response_time,
+        tokens_used=estimate_tokens(message.content) + estimate_tokens(rag_response["answer"]),
+        metadata={
+            "mode": rag_response.get("metadata", {}).get("mode") or message.rag_mode,
+            "conversation_id": conversation_id
+        }
+    )
+
+async def _save_assistant_message(conversation_id: int, rag_response: Dict[str, Any]) -> Message:
+    async with AsyncSessionLocal() as db:
+        assistant_message = Message(
+            conversation_id=conversation_id,
             role="assistant",
             content=rag_response["answer"],
-            sources=rag_response["sources"],
+            # References only; resolve_sources fills in the text when it is read
+            sources=compact_sources(rag_response["sources"]),
             message_metadata=rag_response["metadata"]
         )
         db.add(assistant_message)
-        db.commit()
-        db.refresh(assistant_message)
-        
-        return {
-            "message": assistant_message,
-            "conversation_id": conversation.id
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(updated_at=datetime.utcnow())
+        )
+        await db.commit()
+        await db.refresh(assistant_message)
+        return assistant_message
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def _get_own_conversation(db: AsyncSession, conversation_id: int, current_user: User) -> Conversation:
+    conversation = await db.scalar(select(Conversation).where(
+        Conversation.id == conversation_id,
+        Conversation.user_id == current_user.id
+    ))
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+def _set_etag(response: Response, etag: str):
+    # no-cache: clients may store the response but must revalidate it, which
+    # costs a 304 without a body while nothing has changed
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+async def _with_sources(messages: List[Message], tenant_id: int) -> List[Dict[str, Any]]:
+    """Messages for a response, with their stored source references resolved in one batch"""
+    sources = await resolve_sources([message.sources or [] for message in messages], tenant_id)
+    return [
+        {
+            "id": message.id,
+            "role": message.role,
+            "content": message.content,
+            "sources": message_sources,
+            "created_at": message.created_at
         }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+        for message, message_sources in zip(messages, sources)
+    ]
+
+async def _message_page(
+    db: AsyncSession,
+    conversation_id: int,
+    limit: int,
+    before_id: Optional[int] = None
+) -> Tuple[List[Message], Optional[str]]:
+    """Up to limit messages older than before_id (newest page by default), oldest first"""
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+    messages = list((await db.scalars(query.order_by(Message.id.desc()).limit(limit + 1))).all())
+    next_cursor = encode_cursor(messages[limit - 1].id) if len(messages) > limit else None
+    messages = messages[:limit]
+    messages.reverse()
+    return messages, next_cursor
 
-@router.get("/conversations", response_model=List[ConversationResponse])
+@router.get("/conversations", response_model=ConversationPage)
 async def get_conversations(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get all conversations for current user"""
-    conversations = db.query(Conversation).filter(
-        Conversation.user_id == current_user.id
-    ).order_by(Conversation.updated_at.desc()).all()
+    """
+    Page through the current user's conversations, most recently active first.
+    
+    Keyset pagination on (updated_at, id): pass next_cursor back as cursor for
+    the next page. Three queries per page however many conversations or
+    messages there are: the page, message counts, and last-message previews.
+    Every message touches its conversation's updated_at, so the latest
+    updated_at and the number of conversations make the ETag; a client whose
+    copy is current gets a 304 after that single aggregate query.
+    """
+    latest, total = (await db.execute(
+        select(func.max(Conversation.updated_at), func.count(Conversation.id))
+        .where(Conversation.user_id == current_user.id)
+    )).one()
+    etag = make_etag("conversations", current_user.id, latest, total, limit, cursor)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    _set_etag(response, etag)
     
-    return conversations
+    query = select(Conversation).where(Conversation.user_id == current_user.id)
+    if cursor is not None:
+        try:
+            updated_at, conversation_id = decode_cursor(cursor, 2)
+            updated_at, conversation_id = datetime.fromisoformat(updated_at), int(conversation_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(
+            tuple_(Conversation.updated_at, Conversation.id) < tuple_(updated_at, conversation_id)
+        )
+    conversations = list((await db.scalars(
+        query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1)
+    )).all())
+    next_cursor = None
+    if len(conversations) > limit:
+        last = conversations[limit - 1]
+        next_cursor = encode_cursor(last.updated_at.isoformat(), last.id)
+        conversations = conversations[:limit]
+    
+    ids = [conversation.id for conversation in conversations]
+    counts: Dict[int, Tuple[int, int]] = {}
+    previews: Dict[int, str] = {}
+    if ids:
+        rows = await db.execute(
+            select(Message.conversation_id, func.count(Message.id), func.max(Message.id))
+            .where(Message.conversation_id.in_(ids))
+            .group_by(Message.conversation_id)
+        )
+        counts = {conversation_id: (count, last_id) for conversation_id, count, last_id in rows}
+        rows = await db.execute(
+            select(Message.conversation_id, func.substr(Message.content, 1, settings.CONVERSATION_PREVIEW_CHARS))
+            .where(Message.id.in_([last_id for _, last_id in counts.values()]))
+        ) if counts else []
+        previews = {conversation_id: preview for conversation_id, preview in rows}
+    
+    return {
+        "items": [
+            {
+                "id": conversation.id,
+                "title": conversation.title,
+                "created_at": conversation.created_at,
+                "updated_at": conversation.updated_at,
+                "message_count": counts.get(conversation.id, (0, None))[0],
+                "last_message_preview": previews.get(conversation.id)
+            }
+            for conversation in conversations
+        ],
+        "next_cursor": next_cursor
+    }
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: int,
+    response: Response,
+    message_limit: int = Query(50, ge=1, le=200),
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get a specific conversation with messages"""
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    """Get a specific conversation with its latest messages"""
+    conversation = await _get_own_conversation(db, conversation_id, current_user)
+    # updated_at changes with every message, so it stands in for the messages
+    etag = make_etag("conversation", conversation.id, conversation.updated_at, conversation.title, message_limit)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    _set_etag(response, etag)
+    messages, messages_cursor = await _message_page(db, conversation.id, message_limit)
     
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    return conversation
+    return {
+        "id": conversation.id,
+        "title": conversation.title,
+        "created_at": conversation.created_at,
+        "updated_at": conversation.updated_at,
+        "messages": await _with_sources(messages, current_user.tenant_id or 0),
+        "messages_cursor": messages_cursor,
+        "sync_cursor": encode_cursor(messages[-1].id if messages else 0)
+    }
+
+@router.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def get_conversation_messages(
+    conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Older messages of a conversation, one page per cursor"""
+    conversation = await _get_own_conversation(db, conversation_id, current_user)
+    before_id = None
+    if cursor is not None:
+        try:
+            before_id = int(decode_cursor(cursor, 1)[0])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    messages, next_cursor = await _message_page(db, conversation.id, limit, before_id=before_id)
+    return {"items": await _with_sources(messages, current_user.tenant_id or 0), "next_cursor": next_cursor}
+
+@router.get("/conversations/{conversation_id}/messages/since", response_model=MessageSync)
+async def get_messages_since(
+    conversation_id: int,
+    cursor: str,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Messages added after the cursor (sync_cursor of the conversation, or the
+    cursor of the previous call). When nothing changed this is one indexed
+    query returning an empty list, so clients can poll it instead of
+    re-fetching the conversation.
+    """
+    try:
+        after_id = int(decode_cursor(cursor, 1)[0])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    conversation = await _get_own_conversation(db, conversation_id, current_user)
+    messages = list((await db.scalars(
+        select(Message)
+        .where(Message.conversation_id == conversation.id, Message.id > after_id)
+        .order_by(Message.id)
+        .limit(limit + 1)
+    )).all())
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    return {
+        "items": await _with_sources(messages, current_user.tenant_id or 0),
+        "cursor": encode_cursor(messages[-1].id) if messages else cursor,
+        "has_more": has_more
+    }
 
 @router.delete("/conversations/{conversation_id}")
 async def delete_conversation(
     conversation_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a conversation"""
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
-    
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    conversation = await _get_own_conversation(db, conversation_id, current_user)
     
-    db.delete(conversation)
-    db.commit()
+    # One statement for the messages instead of loading them for the ORM cascade
+    await db.execute(delete(Message).where(Message.conversation_id == conversation.id))
+    await db.delete(conversation)
+    await db.commit()
     
     return {"message": "Conversation deleted successfully"}
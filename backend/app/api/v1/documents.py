@@ -1,20 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from datetime import datetime
+import logging
 import os
 import shutil
 from pathlib import Path
 
 from app.db.database import get_db
-from app.db.models import User, Document
+from app.db.models import User, Document, IngestionJob
 from app.api.v1.auth import get_current_user
-from app.core.document_processor import DocumentProcessor
+from app.core.ingestion_queue import IngestionQueue
 from app.core.config import settings
+from app.core.model_registry import registry
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-document_processor = DocumentProcessor()
+
+def _create_document_processor():
+    # Imported here so listing and uploads work while the models are still loading
+    from app.core.document_processor import DocumentProcessor
+    return DocumentProcessor()
+
+registry.register("document_processor", _create_document_processor)
+
+async def get_document_processor():
+    return await registry.get_async("document_processor")
+
+ingestion_queue = IngestionQueue(get_document_processor)
 
 class DocumentResponse(BaseModel):
     id: int
@@ -28,14 +43,27 @@ class DocumentResponse(BaseModel):
     class Config:
         from_attributes = True
 
-@router.post("/upload", response_model=DocumentResponse)
-async def upload_document(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Upload and process a document"""
+class IngestionJobResponse(BaseModel):
+    id: int
+    status: str
+    attempts: int
+    max_attempts: int
+    last_error: Optional[str] = None
+    next_attempt_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
     
+    class Config:
+        from_attributes = True
+
+class DocumentStatusResponse(BaseModel):
+    document_id: int
+    status: str
+    chunk_count: int
+    job: Optional[IngestionJobResponse] = None
+
+def _save_upload(file: UploadFile, current_user: User):
+    """Validate an uploaded file and save it; returns (file_path, file_ext, file_size)"""
     # Validate file size
     file.file.seek(0, 2)
     file_size = file.file.tell()
@@ -60,7 +88,18 @@ async def upload_document(
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
-    # Create document record
+    return file_path, file_ext, file_size
+
+@router.post("/upload", response_model=DocumentResponse)
+async def upload_document(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload a document and queue it for processing"""
+    file_path, file_ext, file_size = _save_upload(file, current_user)
+    
+    # Create document record and its ingestion job in one transaction
     document = Document(
         user_id=current_user.id,
         tenant_id=current_user.tenant_id or 0,
@@ -71,32 +110,21 @@ async def upload_document(
         status="processing"
     )
     db.add(document)
+    db.flush()
+    ingestion_queue.enqueue(db, document, {
+        "file_path": str(file_path),
+        "file_type": file_ext,
+        "metadata": {
+            "filename": file.filename,
+            "user_id": current_user.id
+        }
+    })
     db.commit()
     db.refresh(document)
     
-    # Process document asynchronously
-    try:
-        result = await document_processor.process_document(
-            file_path=str(file_path),
-            file_type=file_ext,
-            tenant_id=current_user.tenant_id or 0,
-            document_id=document.id,
-            metadata={
-                "filename": file.filename,
-                "user_id": current_user.id
-            }
-        )
-        
-        # Update document status
-        document.status = "completed" if result["status"] == "success" else result["status"]
-        document.chunk_count = result.get("chunk_count", 0)
-        db.commit()
-        db.refresh(document)
-        
-    except Exception as e:
-        document.status = "failed"
-        db.commit()
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    # Extraction, chunking and embedding happen on the ingestion workers;
+    # poll GET /documents/{id}/status for progress.
+    ingestion_queue.notify()
     
     return document
 
@@ -129,6 +157,85 @@ async def get_document(
     
     return document
 
+@router.get("/{document_id}/status", response_model=DocumentStatusResponse)
+async def get_document_status(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get processing status of a document and its latest ingestion job"""
+    document = db.query(Document).filter(
+        Document.id == document_id,
+        Document.user_id == current_user.id
+    ).first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    job = db.query(IngestionJob).filter(
+        IngestionJob.document_id == document.id
+    ).order_by(IngestionJob.id.desc()).first()
+    
+    return {
+        "document_id": document.id,
+        "status": document.status,
+        "chunk_count": document.chunk_count or 0,
+        "job": job
+    }
+
+@router.put("/{document_id}", response_model=DocumentResponse)
+async def update_document(
+    document_id: int,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload a new version of a document and queue an incremental re-index"""
+    document = db.query(Document).filter(
+        Document.id == document_id,
+        Document.user_id == current_user.id
+    ).first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    in_progress = db.query(IngestionJob).filter(
+        IngestionJob.document_id == document.id,
+        IngestionJob.status.in_(["pending", "running"])
+    ).first()
+    if in_progress:
+        raise HTTPException(status_code=409, detail="Document is still being processed")
+    
+    file_path, file_ext, file_size = _save_upload(file, current_user)
+    old_file_path = document.file_path
+    
+    # Only chunks that changed are embedded and written; see DocumentProcessor.update_document
+    document.filename = file.filename
+    document.file_path = str(file_path)
+    document.file_type = file_ext
+    document.file_size = file_size
+    document.status = "processing"
+    ingestion_queue.enqueue(db, document, {
+        "action": "update",
+        "file_path": str(file_path),
+        "file_type": file_ext,
+        "metadata": {
+            "filename": file.filename,
+            "user_id": current_user.id
+        }
+    })
+    db.commit()
+    db.refresh(document)
+    ingestion_queue.notify()
+    
+    try:
+        if old_file_path != document.file_path and os.path.exists(old_file_path):
+            os.remove(old_file_path)
+    except Exception as e:
+        logger.warning(f"Error deleting file: {str(e)}")
+    
+    return document
+
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: int,
@@ -149,18 +256,20 @@ async def delete_document(
         if os.path.exists(document.file_path):
             os.remove(document.file_path)
     except Exception as e:
-        print(f"Error deleting file: {e}")
+        logger.warning(f"Error deleting file: {str(e)}")
     
     # Delete from vector database
     try:
+        document_processor = await get_document_processor()
         await document_processor.delete_document_chunks(
             tenant_id=current_user.tenant_id or 0,
             document_id=document.id
         )
     except Exception as e:
-        print(f"Error deleting chunks: {e}")
+        logger.warning(f"Error deleting chunks: {str(e)}")
     
     # Delete from database
+    db.query(IngestionJob).filter(IngestionJob.document_id == document.id).delete()
     db.delete(document)
     db.commit()
     
@@ -0,0 +1,189 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import logging
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal, async_engine
+from app.db.models import Analytics, AnalyticsRollup
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_PERIODS = ("hour", "day")
+
+def period_start(period: str, moment: datetime) -> datetime:
+    if period == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _rollup_rows(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Hourly and daily totals per user for a batch of events"""
+    rows: Dict[Tuple[str, datetime, int], Dict[str, Any]] = {}
+    for event in events:
+        for period in ROLLUP_PERIODS:
+            key = (period, period_start(period, event["created_at"]), event["user_id"])
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {
+                    "period": key[0],
+                    "period_start": key[1],
+                    "user_id": key[2],
+                    "tenant_id": event["tenant_id"],
+                    "queries": 0,
+                    "tokens_used": 0,
+                    "cost": 0.0,
+                    "response_time_sum": 0.0,
+                    "response_time_count": 0
+                }
+            row["queries"] += 1
+            row["tokens_used"] += event["tokens_used"] or 0
+            row["cost"] += event["cost"] or 0.0
+            if event["response_time"] is not None:
+                row["response_time_sum"] += event["response_time"]
+                row["response_time_count"] += 1
+    return list(rows.values())
+
+def _upsert_rollups(rows: List[Dict[str, Any]]):
+    """INSERT ... ON CONFLICT that adds the batch's totals to existing rollup rows"""
+    dialect = postgresql if async_engine.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(AnalyticsRollup).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=["period", "user_id", "period_start"],
+        set_={
+            column: getattr(AnalyticsRollup, column) + getattr(statement.excluded, column)
+            for column in ("queries", "tokens_used", "cost", "response_time_sum", "response_time_count")
+        }
+    )
+
+class AnalyticsRecorder:
+    """
+    Low-overhead analytics for chat requests.
+
+    record() only appends to an in-memory buffer; a background task writes the
+    buffer every ANALYTICS_FLUSH_INTERVAL_SECONDS, or as soon as it holds
+    ANALYTICS_FLUSH_SIZE events, with one bulk insert into analytics and one
+    upsert into the hourly and daily analytics_rollups rows, in a single
+    transaction. The analytics endpoints read the rollups, so dashboards cost
+    the same however many raw events there are. If a write fails the events
+    go back into the buffer, which drops its oldest events beyond
+    ANALYTICS_MAX_BUFFER.
+    """
+
+    def __init__(self):
+        self.enabled = settings.ANALYTICS_ENABLED
+        self._buffer: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    def record(
+        self,
+        user_id: int,
+        tenant_id: Optional[int],
+        query: str,
+        response_time: Optional[float],
+        tokens_used: int,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        """Buffer one chat request; never touches the database"""
+        if not self.enabled:
+            return
+        self._buffer.append({
+            "user_id": user_id,
+            "tenant_id": tenant_id,
+            "query": query,
+            "response_time": response_time,
+            "tokens_used": tokens_used,
+            "cost": tokens_used / 1000 * settings.ANALYTICS_COST_PER_1K_TOKENS,
+            "analytics_metadata": metadata or {},
+            "created_at": datetime.utcnow()
+        })
+        self.recorded += 1
+        self._trim()
+        if len(self._buffer) >= settings.ANALYTICS_FLUSH_SIZE and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _trim(self):
+        overflow = len(self._buffer) - settings.ANALYTICS_MAX_BUFFER
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background task and write what is still buffered"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.ANALYTICS_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write the buffered events and their rollups; returns how many were written"""
+        if not self._buffer:
+            return 0
+        events, self._buffer = self._buffer, []
+        started = time.perf_counter()
+        written = 0
+        try:
+            # Bounded statements even when a backlog built up during an outage
+            for start in range(0, len(events), settings.ANALYTICS_FLUSH_SIZE):
+                batch = events[start:start + settings.ANALYTICS_FLUSH_SIZE]
+                async with AsyncSessionLocal() as db:
+                    await db.execute(insert(Analytics), batch)
+                    await db.execute(_upsert_rollups(_rollup_rows(batch)))
+                    await db.commit()
+                written += len(batch)
+        except BaseException as e:
+            # Retried with the next flush (or the one at shutdown), ahead of newer events
+            self._buffer = events[written:] + self._buffer
+            self._trim()
+            if not isinstance(e, Exception):
+                raise
+            logger.error(f"Writing {len(events) - written} analytics events failed: {str(e)}")
+            self.failed_flushes += 1
+        self.written += written
+        if written:
+            self.flushes += 1
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 1)
+        }
+
+analytics_recorder = AnalyticsRecorder()
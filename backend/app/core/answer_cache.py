@@ -0,0 +1,157 @@
+from typing import Any, Dict, List, Optional, Tuple
+import copy
+import logging
+import threading
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.tenant_versions import get_tenant_version
+
+logger = logging.getLogger(__name__)
+
+class _Bucket:
+    """Cached answers for one (tenant, RAG mode), valid for one tenant version"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.vectors: List[np.ndarray] = []
+        self.entries: List[Dict[str, Any]] = []
+        self.matrix: Optional[np.ndarray] = None  # stacked vectors, rebuilt lazily
+
+    def remove(self, index: int):
+        del self.vectors[index]
+        del self.entries[index]
+        self.matrix = None
+
+class SemanticAnswerCache:
+    """
+    Final answers keyed by query-embedding similarity, scoped per tenant and RAG mode.
+
+    A lookup hits when a cached query's cosine similarity to the new query is at
+    least ANSWER_CACHE_SIMILARITY. Entries store the answer together with its
+    sources so cached answers still cite correctly, and a bucket is discarded as
+    soon as the tenant's document version changes (see tenant_versions).
+    """
+
+    def __init__(self):
+        self.enabled = settings.ANSWER_CACHE_ENABLED
+        self.threshold = settings.ANSWER_CACHE_SIMILARITY
+        self.max_entries = settings.ANSWER_CACHE_MAX_ENTRIES_PER_TENANT
+        self.ttl_seconds = settings.ANSWER_CACHE_TTL_SECONDS
+        self._buckets: Dict[Tuple[int, str], _Bucket] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(
+        self,
+        tenant_id: int,
+        mode: str,
+        query_embedding: List[float],
+        version: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached response for a similar enough query, if any"""
+        if not self.enabled:
+            return None
+        version = version if version is not None else get_tenant_version(tenant_id)
+        query = self._normalize(query_embedding)
+        now = time.time()
+
+        with self._lock:
+            bucket = self._current_bucket(tenant_id, mode, version)
+            if bucket is None or not bucket.entries:
+                self.misses += 1
+                return None
+            if bucket.matrix is None:
+                bucket.matrix = np.vstack(bucket.vectors)
+            similarities = bucket.matrix @ query
+            best = int(np.argmax(similarities))
+            entry = bucket.entries[best]
+            if now - entry["created_at"] > self.ttl_seconds:
+                bucket.remove(best)
+                self.misses += 1
+                return None
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry["last_used"] = now
+            self.hits += 1
+            response = copy.deepcopy(entry["response"])
+
+        response["metadata"] = {
+            **response.get("metadata", {}),
+            "cached": True,
+            "cache_similarity": round(float(similarities[best]), 4)
+        }
+        return response
+
+    def store(
+        self,
+        tenant_id: int,
+        mode: str,
+        query_embedding: List[float],
+        response: Dict[str, Any],
+        version: str
+    ):
+        """
+        Cache a response computed while the tenant was at `version`.
+        Skipped if the documents changed in the meantime, since the answer may be stale.
+        """
+        if not self.enabled or not response.get("sources"):
+            return
+        if get_tenant_version(tenant_id) != version:
+            return
+        now = time.time()
+        with self._lock:
+            bucket = self._current_bucket(tenant_id, mode, version)
+            if bucket is None:
+                bucket = self._buckets[(tenant_id, mode)] = _Bucket(version)
+            if len(bucket.entries) >= self.max_entries:
+                oldest = min(range(len(bucket.entries)), key=lambda i: bucket.entries[i]["last_used"])
+                bucket.remove(oldest)
+            bucket.vectors.append(self._normalize(query_embedding))
+            bucket.entries.append({
+                "response": copy.deepcopy(response),
+                "created_at": now,
+                "last_used": now
+            })
+            bucket.matrix = None
+
+    def invalidate_tenant(self, tenant_id: int):
+        with self._lock:
+            for key in [key for key in self._buckets if key[0] == tenant_id]:
+                del self._buckets[key]
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "buckets": len(self._buckets),
+                "entries": sum(len(bucket.entries) for bucket in self._buckets.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+    def _current_bucket(self, tenant_id: int, mode: str, version: str) -> Optional[_Bucket]:
+        bucket = self._buckets.get((tenant_id, mode))
+        if bucket is not None and bucket.version != version:
+            # Documents changed since these answers were generated
+            del self._buckets[(tenant_id, mode)]
+            self.invalidations += 1
+            return None
+        return bucket
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+answer_cache = SemanticAnswerCache()
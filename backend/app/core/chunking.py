@@ -0,0 +1,76 @@
+from typing import Iterator, List, Optional
+import hashlib
+import re
+
+# Paragraphs are the units chunks are built from
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+class ContentDefinedChunker:
+    """
+    Groups text into chunks whose boundaries depend only on nearby content.
+
+    Text is cut into paragraph units (over-long paragraphs are split further by
+    `splitter`). A chunk ends after a unit once it holds at least min_size
+    characters and the hash of that unit falls under a threshold proportional
+    to the unit's length, or when adding the next unit would exceed max_size.
+    Because a boundary is decided by the unit's own text rather than by its
+    offset, an edit only changes the chunks around it: boundaries further on
+    fall in the same places and produce identical chunks, as with
+    content-defined chunking in backup and sync tools.
+    """
+
+    def __init__(self, target_size: int, min_size: int, max_size: int, splitter=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        # Expected distance between hash boundaries once past min_size
+        self.spacing = max(target_size - min_size, 1)
+        self.splitter = splitter
+        self._units: List[str] = []
+        self._size = 0
+
+    def units(self, text: str) -> Iterator[str]:
+        for paragraph in _PARAGRAPH_BREAK.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if len(paragraph) > self.max_size and self.splitter is not None:
+                yield from self.splitter.split_text(paragraph)
+            else:
+                yield paragraph
+
+    @staticmethod
+    def split_complete(text: str):
+        """Split streamed text into (complete paragraphs, trailing partial paragraph)"""
+        last = None
+        for last in _PARAGRAPH_BREAK.finditer(text):
+            pass
+        if last is None:
+            return "", text
+        return text[:last.start()], text[last.end():]
+
+    def feed(self, unit: str) -> List[str]:
+        """Add one unit; returns the chunks it completed (usually none)"""
+        chunks = []
+        if self._units and self._size + len(unit) + 2 > self.max_size:
+            chunks.append(self._emit())
+        self._units.append(unit)
+        self._size += len(unit) + (2 if len(self._units) > 1 else 0)
+        if self._size >= self.min_size and self._is_boundary(unit):
+            chunks.append(self._emit())
+        return chunks
+
+    def flush(self) -> Optional[str]:
+        return self._emit() if self._units else None
+
+    def _is_boundary(self, unit: str) -> bool:
+        digest = int.from_bytes(hashlib.blake2b(unit.encode("utf-8"), digest_size=8).digest(), "big")
+        return digest / 2 ** 64 < min(len(unit) / self.spacing, 1.0)
+
+    def _emit(self) -> str:
+        chunk = "\n\n".join(self._units)
+        self._units = []
+        self._size = 0
+        return chunk
@@ -0,0 +1,116 @@
+from typing import Any, Dict, List, Optional
+import sys
+
+import numpy as np
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.tenant_versions import get_tenant_version
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    """Approximate memory held by a cached context"""
+    size = entry["query_vector"].nbytes
+    for chunk in entry["chunks"]:
+        size += sys.getsizeof(chunk["content"]) + sys.getsizeof(chunk.get("id"))
+        size += sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in (chunk.get("metadata") or {}).items())
+    return size
+
+class ConversationContextCache:
+    """
+    Retrieved chunks per (tenant, conversation), reused for follow-up questions.
+
+    A follow-up only reuses the cached chunks when its embedding is at least
+    CONTEXT_CACHE_SIMILARITY to the query that retrieved them, so an unrelated
+    question in the same conversation triggers a fresh search. Chunks keep their
+    id, score and metadata for citations, and entries recorded under an older tenant version
+    (see tenant_versions) are dropped on lookup.
+    """
+
+    def __init__(self):
+        self.threshold = settings.CONTEXT_CACHE_SIMILARITY
+        self._cache = TTLCache(
+            max_entries=settings.CONTEXT_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.CONTEXT_CACHE_TTL_SECONDS,
+            max_bytes=settings.CONTEXT_CACHE_MAX_MB * 1024 * 1024,
+            sizeof=_entry_size
+        )
+        self.hits = 0
+        self.misses = 0
+        self.dissimilar = 0
+        self.stale = 0
+
+    def get(
+        self,
+        tenant_id: int,
+        conversation_id: int,
+        query_embedding: List[float],
+        version: Optional[str] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Return the cached chunks ({id, content, metadata, score}) if they fit this query"""
+        key = (tenant_id, conversation_id)
+        entry = self._cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        version = version if version is not None else get_tenant_version(tenant_id)
+        if entry["version"] != version:
+            self._cache.delete(key)
+            self.misses += 1
+            self.stale += 1
+            return None
+        if float(entry["query_vector"] @ self._normalize(query_embedding)) < self.threshold:
+            self.misses += 1
+            self.dissimilar += 1
+            return None
+        self.hits += 1
+        return [self._copy(chunk) for chunk in entry["chunks"]]
+
+    def set(
+        self,
+        tenant_id: int,
+        conversation_id: int,
+        query_embedding: List[float],
+        chunks: List[Dict[str, Any]],
+        version: str
+    ):
+        if not chunks:
+            return
+        self._cache.set((tenant_id, conversation_id), {
+            "query_vector": self._normalize(query_embedding),
+            "chunks": [self._copy(chunk) for chunk in chunks],
+            "version": version
+        })
+
+    def invalidate_tenant(self, tenant_id: int) -> int:
+        return self._cache.delete_where(lambda key: key[0] == tenant_id)
+
+    def stats(self) -> Dict[str, Any]:
+        cache = self._cache.stats()
+        lookups = self.hits + self.misses
+        return {
+            "entries": cache["entries"],
+            "bytes": cache["bytes"],
+            "evictions": cache["evictions"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "dissimilar": self.dissimilar,
+            "stale": self.stale,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+    @staticmethod
+    def _copy(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": chunk.get("id"),
+            "content": chunk["content"],
+            "metadata": dict(chunk.get("metadata") or {}),
+            "score": chunk.get("score")
+        }
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+context_cache = ConversationContextCache()
@@ -1,60 +1,79 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator
 from pathlib import Path
+import asyncio
 import logging
+import threading
+import time
 try:
     from langchain.text_splitter import RecursiveCharacterTextSplitter
 except ImportError:
     from langchain_text_splitters import RecursiveCharacterTextSplitter
-try:
-    from langchain_openai import OpenAIEmbeddings
-except ImportError:
-    OpenAIEmbeddings = None
-
-try:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-except ImportError:
-    HuggingFaceEmbeddings = None
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-import PyPDF2
-from docx import Document as DocxDocument
-from pptx import Presentation
-import openpyxl
-from bs4 import BeautifulSoup
 
+from app.core.chunking import ContentDefinedChunker, content_hash
 from app.core.config import settings
+from app.core.embedding_service import get_embedding_service
+from app.core.executors import run_io
+from app.core.keyword_index import keyword_index
+from app.core.metrics import record_stage
+from app.core.tenant_versions import mark_tenant_changed
+from app.core.text_extraction import extraction_pool
+from app.core.vector_store import get_vector_store
 
 logger = logging.getLogger(__name__)
 
+class PipelineStats:
+    """
+    Per-stage item, character and time counters for the ingestion pipeline.
+    Each recorded batch is also observed in the "ingestion" stage latency metrics.
+    """
+    
+    STAGES = ("extract", "chunk", "embed", "store")
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {stage: {"items": 0, "chars": 0, "seconds": 0.0} for stage in self.STAGES}
+    
+    def record(self, stage: str, items: int, chars: int, seconds: float):
+        self._add(stage, items, chars, seconds)
+        record_stage("ingestion", stage, seconds)
+    
+    def merge(self, other: "PipelineStats"):
+        # Already observed when they were recorded on the per-document stats
+        for stage, counters in other.stages.items():
+            self._add(stage, counters["items"], counters["chars"], counters["seconds"])
+    
+    def _add(self, stage: str, items: int, chars: int, seconds: float):
+        with self._lock:
+            counters = self.stages[stage]
+            counters["items"] += items
+            counters["chars"] += chars
+            counters["seconds"] += seconds
+    
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {
+                    **counters,
+                    "items_per_second": counters["items"] / counters["seconds"] if counters["seconds"] else 0.0,
+                    "chars_per_second": counters["chars"] / counters["seconds"] if counters["seconds"] else 0.0
+                }
+                for stage, counters in self.stages.items()
+            }
+
 class DocumentProcessor:
     """Advanced document processing with semantic chunking"""
     
     def __init__(self):
-        # Use local embeddings if configured
-        if getattr(settings, 'USE_LOCAL_MODELS', False):
-            if HuggingFaceEmbeddings is None:
-                raise ImportError("Please install: pip install sentence-transformers")
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=settings.LOCAL_EMBEDDING_MODEL,
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
-        else:
-            if OpenAIEmbeddings is None:
-                raise ImportError("Please install: pip install langchain-openai")
-            self.embeddings = OpenAIEmbeddings(
-                model="text-embedding-3-small",
-                openai_api_key=settings.OPENAI_API_KEY
-            )
+        # Shared, micro-batched embedding model (also used by the chat orchestrator)
+        self.embedding_service = get_embedding_service()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=settings.CHUNK_SIZE,
             chunk_overlap=settings.CHUNK_OVERLAP,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
-        self.chroma_client = chromadb.PersistentClient(
-            path=settings.CHROMA_PERSIST_DIR,
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
+        self.vector_store = get_vector_store()
+        # Cumulative throughput across all processed documents
+        self.pipeline_stats = PipelineStats()
     
     async def process_document(
         self,
@@ -64,26 +83,28 @@ class DocumentProcessor:
         document_id: int,
         metadata: Dict[str, Any] = None
     ) -> Dict[str, Any]:
-        """Process document and store in vector database"""
+        """
+        Process document and store in vector database.
+        
+        Streams extract -> chunk -> embed -> store so peak memory depends on
+        EMBEDDING_BATCH_SIZE rather than on document size.
+        """
+        stats = PipelineStats()
         try:
-            # Extract text based on file type
-            text = await self.extract_text(file_path, file_type)
-            
-            # Smart chunking
-            chunks = await self.smart_chunking(text, metadata)
-            
-            # Generate embeddings and store
-            chunk_count = await self.store_chunks(
+            segments = self.iter_segments(file_path, file_type, stats)
+            chunks = self.iter_chunks(segments, metadata, stats)
+            chunk_count = await self._store_chunk_stream(
                 chunks,
                 tenant_id,
                 document_id,
-                metadata
+                stats
             )
             
             return {
                 "status": "success",
                 "chunk_count": chunk_count,
-                "text_length": len(text)
+                "text_length": stats.stages["extract"]["chars"],
+                "pipeline": stats.snapshot()
             }
             
         except Exception as e:
@@ -92,98 +113,114 @@ class DocumentProcessor:
                 "status": "failed",
                 "error": str(e)
             }
+        finally:
+            self.pipeline_stats.merge(stats)
     
-    async def extract_text(self, file_path: str, file_type: str) -> str:
-        """Extract text from various file formats"""
-        
-        if file_type == "pdf":
-            return await self._extract_pdf(file_path)
-        elif file_type in ["docx", "doc"]:
-            return await self._extract_docx(file_path)
-        elif file_type in ["pptx", "ppt"]:
-            return await self._extract_pptx(file_path)
-        elif file_type in ["xlsx", "xls"]:
-            return await self._extract_excel(file_path)
-        elif file_type == "html":
-            return await self._extract_html(file_path)
-        elif file_type == "txt":
-            return await self._extract_txt(file_path)
+    async def iter_segments(
+        self,
+        file_path: str,
+        file_type: str,
+        stats: Optional["PipelineStats"] = None
+    ) -> AsyncIterator[str]:
+        """Yield the document's pages, slides or sheets in order as they are extracted"""
+        if file_type == "txt":
+            source = self._iter_txt(file_path)
+        elif file_type in ["pdf", "docx", "doc", "pptx", "ppt", "xlsx", "xls", "html"]:
+            source = extraction_pool.iter_segments(file_path, file_type)
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
+        
+        started = time.perf_counter()
+        async for segment in source:
+            if stats is not None:
+                stats.record("extract", 1, len(segment), time.perf_counter() - started)
+            yield segment
+            started = time.perf_counter()
     
-    async def _extract_pdf(self, file_path: str) -> str:
-        """Extract text from PDF"""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n\n"
-        return text
-    
-    async def _extract_docx(self, file_path: str) -> str:
-        """Extract text from DOCX"""
-        doc = DocxDocument(file_path)
-        text = "\n\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text
-    
-    async def _extract_pptx(self, file_path: str) -> str:
-        """Extract text from PPTX"""
-        prs = Presentation(file_path)
-        text = ""
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-            text += "\n"
-        return text
-    
-    async def _extract_excel(self, file_path: str) -> str:
-        """Extract text from Excel"""
-        wb = openpyxl.load_workbook(file_path)
-        text = ""
-        for sheet in wb.worksheets:
-            text += f"Sheet: {sheet.title}\n"
-            for row in sheet.iter_rows(values_only=True):
-                text += " | ".join([str(cell) if cell else "" for cell in row]) + "\n"
-            text += "\n"
-        return text
-    
-    async def _extract_html(self, file_path: str) -> str:
-        """Extract text from HTML"""
+    async def _iter_txt(self, file_path: str) -> AsyncIterator[str]:
+        block_size = 1024 * 1024
+        carry = ""
         with open(file_path, 'r', encoding='utf-8') as file:
-            soup = BeautifulSoup(file.read(), 'html.parser')
-            text = soup.get_text(separator='\n')
-        return text
+            while True:
+                block = await run_io(file.read, block_size)
+                if not block:
+                    break
+                # Cut at paragraph breaks so segment joins don't invent new ones
+                complete, carry = ContentDefinedChunker.split_complete(carry + block)
+                if len(carry) > block_size:
+                    complete, carry = complete + carry, ""
+                if complete:
+                    yield complete
+        if carry:
+            yield carry
     
-    async def _extract_txt(self, file_path: str) -> str:
-        """Extract text from TXT"""
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+    def _new_chunker(self) -> ContentDefinedChunker:
+        return ContentDefinedChunker(
+            target_size=settings.CHUNK_SIZE,
+            min_size=settings.CHUNK_MIN_SIZE,
+            max_size=settings.CHUNK_SIZE,
+            splitter=self.text_splitter
+        )
     
-    async def smart_chunking(
+    async def iter_chunks(
         self,
-        text: str,
-        metadata: Dict[str, Any] = None
-    ) -> List[Dict[str, Any]]:
-        """Smart chunking with semantic boundaries"""
-        
-        # Split text into chunks
-        chunks = self.text_splitter.split_text(text)
-        
-        # Add metadata to each chunk
-        chunk_dicts = []
-        for i, chunk in enumerate(chunks):
-            chunk_dict = {
-                "content": chunk,
-                "metadata": {
-                    **(metadata or {}),
-                    "chunk_index": i,
-                    "total_chunks": len(chunks)
-                }
-            }
-            chunk_dicts.append(chunk_dict)
+        segments: AsyncIterator[str],
+        metadata: Dict[str, Any] = None,
+        stats: Optional["PipelineStats"] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Chunk a stream of segments at content-defined boundaries, so unchanged
+        sections of a re-uploaded document produce identical chunks. Only the
+        trailing, possibly incomplete paragraph carries over into the next segment.
+        Each chunk gets a "key" (content hash plus occurrence number) that is
+        stable across versions of the document. Its position is not stored, so
+        an edit near the top doesn't change the metadata of every chunk after it.
+        """
+        chunker = self._new_chunker()
+        occurrences: Dict[str, int] = {}
+        carry = ""
         
-        return chunk_dicts
+        def build(texts: List[str]) -> List[Dict[str, Any]]:
+            chunk_dicts = []
+            for text in texts:
+                digest = content_hash(text)
+                occurrence = occurrences.get(digest, 0)
+                occurrences[digest] = occurrence + 1
+                chunk_dicts.append({
+                    "content": text,
+                    "key": f"{digest}_{occurrence}",
+                    "metadata": {
+                        **(metadata or {}),
+                        "content_hash": digest
+                    }
+                })
+            return chunk_dicts
+        
+        def chunk_text(text: str, final: bool) -> List[Dict[str, Any]]:
+            started = time.perf_counter()
+            texts = []
+            for unit in chunker.units(text):
+                texts.extend(chunker.feed(unit))
+            if final:
+                last = chunker.flush()
+                if last is not None:
+                    texts.append(last)
+            chunk_dicts = build(texts)
+            if stats is not None:
+                stats.record("chunk", len(texts), sum(len(t) for t in texts), time.perf_counter() - started)
+            return chunk_dicts
+        
+        async for segment in segments:
+            text = f"{carry}\n\n{segment}" if carry else segment
+            complete, carry = chunker.split_complete(text)
+            if len(carry) > settings.CHUNK_SIZE * 8:
+                # No paragraph break in sight; don't buffer the whole document
+                complete, carry = text, ""
+            for chunk in chunk_text(complete, final=False):
+                yield chunk
+        
+        for chunk in chunk_text(carry, final=True):
+            yield chunk
     
     async def store_chunks(
         self,
@@ -194,49 +231,210 @@ class DocumentProcessor:
     ) -> int:
         """Store chunks in vector database"""
         
-        collection_name = f"tenant_{tenant_id}"
+        async def iterate():
+            for chunk in chunks:
+                yield {**chunk, "metadata": {**chunk["metadata"], **(metadata or {})}} if metadata else chunk
+        
+        return await self._store_chunk_stream(iterate(), tenant_id, document_id)
+    
+    async def _store_chunk_stream(
+        self,
+        chunks: AsyncIterator[Dict[str, Any]],
+        tenant_id: int,
+        document_id: int,
+        stats: Optional["PipelineStats"] = None
+    ) -> int:
+        """Embed chunks in fixed-size batches, writing each batch while the next one embeds"""
         
         try:
-            collection = self.chroma_client.get_or_create_collection(
-                name=collection_name,
-                metadata={"tenant_id": tenant_id}
-            )
+            collection = await run_io(self.vector_store.get_or_create_collection, tenant_id)
         except Exception as e:
             logger.error(f"Error creating collection: {str(e)}")
             raise
         
-        # Prepare data for ChromaDB
-        documents = [chunk["content"] for chunk in chunks]
-        metadatas = [
-            {
-                **chunk["metadata"],
-                "document_id": document_id,
-                **(metadata or {})
-            }
-            for chunk in chunks
-        ]
-        ids = [f"doc_{document_id}_chunk_{i}" for i in range(len(chunks))]
+        batch_size = settings.EMBEDDING_BATCH_SIZE
+        max_batch_size = self.vector_store.max_batch_size
+        if max_batch_size:
+            batch_size = min(batch_size, max_batch_size)
+        
+        stats = stats or PipelineStats()
+        pending_write = None
+        chunk_count = 0
+        batch = []
+        
+        async def flush(batch: List[Dict[str, Any]], first_index: int):
+            nonlocal pending_write
+            embeddings = await self._embed_batch(batch, stats)
+            # Only one write in flight: bounds memory to ~2 batches
+            if pending_write is not None:
+                await pending_write
+            pending_write = asyncio.ensure_future(
+                self._write_batch(collection, batch, embeddings, first_index, tenant_id, document_id, stats)
+            )
         
-        # Generate embeddings
-        embeddings = self.embeddings.embed_documents(documents)
+        try:
+            async for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    await flush(batch, chunk_count)
+                    chunk_count += len(batch)
+                    batch = []
+            if batch:
+                await flush(batch, chunk_count)
+                chunk_count += len(batch)
+            if pending_write is not None:
+                await pending_write
+        except BaseException:
+            if pending_write is not None and not pending_write.done():
+                pending_write.cancel()
+            raise
+        finally:
+            if chunk_count:
+                # Cached answers for this tenant may now be missing sources
+                mark_tenant_changed(tenant_id)
         
-        # Store in ChromaDB
-        collection.add(
+        return chunk_count
+    
+    async def _embed_batch(self, batch: List[Dict[str, Any]], stats: "PipelineStats") -> List[List[float]]:
+        started = time.perf_counter()
+        embeddings = await self.embedding_service.embed_documents([chunk["content"] for chunk in batch])
+        stats.record("embed", len(batch), sum(len(chunk["content"]) for chunk in batch), time.perf_counter() - started)
+        return embeddings
+    
+    async def _write_batch(
+        self,
+        collection,
+        batch: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+        first_index: int,
+        tenant_id: int,
+        document_id: int,
+        stats: "PipelineStats"
+    ):
+        # Prepare data for the vector store
+        documents = [chunk["content"] for chunk in batch]
+        metadatas = [self._chunk_metadata(chunk, document_id) for chunk in batch]
+        ids = [self._chunk_id(document_id, chunk, first_index + i) for i, chunk in enumerate(batch)]
+        
+        started = time.perf_counter()
+        await run_io(
+            collection.add,
             documents=documents,
             embeddings=embeddings,
             metadatas=metadatas,
             ids=ids
         )
+        await run_io(
+            keyword_index.add_chunks,
+            tenant_id,
+            [
+                {"id": chunk_id, "document_id": document_id, "content": content}
+                for chunk_id, content in zip(ids, documents)
+            ],
+            collection
+        )
+        stats.record("store", len(batch), sum(len(d) for d in documents), time.perf_counter() - started)
+    
+    @staticmethod
+    def _chunk_id(document_id: int, chunk: Dict[str, Any], index: int) -> str:
+        """Content-addressed chunk id, so an unchanged chunk keeps its id across versions"""
+        key = chunk.get("key") or f"{content_hash(chunk['content'])}_{index}"
+        return f"doc_{document_id}_{key}"
+    
+    @staticmethod
+    def _chunk_metadata(chunk: Dict[str, Any], document_id: int) -> Dict[str, Any]:
+        # The document's metadata (filename, user_id) is already in the chunk's,
+        # added once when it was chunked
+        return {**chunk["metadata"], "document_id": document_id}
+    
+    async def update_document(
+        self,
+        file_path: str,
+        file_type: str,
+        tenant_id: int,
+        document_id: int,
+        metadata: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
+        """
+        Re-index a new version of an existing document incrementally.
         
-        return len(chunks)
+        The new version is chunked at content-defined boundaries and its chunk
+        ids (content hashes) are diffed against the stored ones: only new chunks
+        are embedded and written and chunks that disappeared are deleted.
+        Unchanged chunks are only rewritten when the document's metadata changed.
+        Running it again with the same file is a no-op, so a retried job needs
+        no cleanup.
+        """
+        stats = PipelineStats()
+        try:
+            collection = await run_io(self.vector_store.get_or_create_collection, tenant_id)
+            stored = await run_io(collection.get, where={"document_id": document_id}, include=["metadatas"])
+            existing = dict(zip(stored["ids"], stored["metadatas"]))
+            
+            seen = set()
+            metadata_updates: Dict[str, Dict[str, Any]] = {}
+            total = 0
+            
+            async def changed_chunks():
+                nonlocal total
+                async for chunk in self.iter_chunks(self.iter_segments(file_path, file_type, stats), metadata, stats):
+                    chunk_id = self._chunk_id(document_id, chunk, total)
+                    total += 1
+                    seen.add(chunk_id)
+                    if chunk_id not in existing:
+                        yield chunk
+                        continue
+                    desired = self._chunk_metadata(chunk, document_id)
+                    # Chunks indexed before positions were dropped still carry chunk_index
+                    current = {key: value for key, value in (existing[chunk_id] or {}).items() if key != "chunk_index"}
+                    if current != desired:
+                        metadata_updates[chunk_id] = desired
+            
+            added = await self._store_chunk_stream(changed_chunks(), tenant_id, document_id, stats)
+            
+            removed = [chunk_id for chunk_id in existing if chunk_id not in seen]
+            if removed:
+                started = time.perf_counter()
+                for start in range(0, len(removed), 5000):
+                    await run_io(collection.delete, ids=removed[start:start + 5000])
+                await run_io(keyword_index.delete_chunks, tenant_id, removed)
+                stats.record("store", len(removed), 0, time.perf_counter() - started)
+            
+            if metadata_updates:
+                ids = list(metadata_updates)
+                for start in range(0, len(ids), 5000):
+                    batch = ids[start:start + 5000]
+                    await run_io(collection.update, ids=batch, metadatas=[metadata_updates[i] for i in batch])
+            
+            if removed or metadata_updates:
+                mark_tenant_changed(tenant_id)
+            
+            return {
+                "status": "success",
+                "chunk_count": total,
+                "chunks_added": added,
+                "chunks_removed": len(removed),
+                "chunks_unchanged": total - added,
+                "text_length": stats.stages["extract"]["chars"],
+                "pipeline": stats.snapshot()
+            }
+            
+        except Exception as e:
+            logger.error(f"Error updating document: {str(e)}")
+            return {
+                "status": "failed",
+                "error": str(e)
+            }
+        finally:
+            self.pipeline_stats.merge(stats)
     
     async def delete_document_chunks(self, tenant_id: int, document_id: int):
         """Delete all chunks for a document"""
-        collection_name = f"tenant_{tenant_id}"
-        
         try:
-            collection = self.chroma_client.get_collection(collection_name)
+            collection = await run_io(self.vector_store.get_collection, tenant_id)
             # Delete chunks with matching document_id
-            collection.delete(where={"document_id": document_id})
+            await run_io(collection.delete, where={"document_id": document_id})
+            await run_io(keyword_index.delete_document, tenant_id, document_id)
+            mark_tenant_changed(tenant_id)
         except Exception as e:
             logger.error(f"Error deleting chunks: {str(e)}")
@@ -0,0 +1,280 @@
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(text: str) -> str:
+    """Case, whitespace and trailing-punctuation insensitive form of a query"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(text.split()).rstrip("?!. ")
+
+def pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+def unpack_vector(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+class SQLiteEmbeddingStore:
+    """
+    On-disk key -> float32 vector store. Least recently used rows are evicted
+    once the store holds more than max_entries rows or max_bytes of data.
+    Row count and size are kept in memory and refreshed at every eviction
+    pass, so stats() neither scans the table nor waits for the store lock.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None
+    ):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Several workers share the file; wait for their writes instead of failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._bytes = self._used_bytes()
+        self._writes_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob, created_at in rows:
+                    if self.ttl_seconds and created_at + self.ttl_seconds < now:
+                        continue
+                    found[key] = unpack_vector(blob)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at, last_used) VALUES (?, ?, ?, ?)",
+                [(key, pack_vector(vector), now, now) for key, vector in items.items()]
+            )
+            # Replaced keys and other workers' writes are corrected by the next recount
+            self._entries += len(items)
+            self._writes_since_evict += len(items)
+            # Evicting on every write would mean a COUNT(*) per insert
+            if self._writes_since_evict >= self._evict_interval():
+                self._evict()
+                self._writes_since_evict = 0
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._used_bytes()
+
+    def stats(self) -> Dict[str, Any]:
+        # Called on the event loop by /stats and /metrics: in-memory values only
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._entries,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+    def _evict_interval(self) -> int:
+        if self.max_entries:
+            return max(self.max_entries // 100, 1)
+        return 1000
+
+    def _used_bytes(self) -> int:
+        """Bytes in use by the database file, excluding pages freed by deletes"""
+        page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self):
+        if self.ttl_seconds:
+            cursor = self._conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries if self.max_entries else 0
+        if self.max_bytes and count:
+            used = self._used_bytes()
+            if used > self.max_bytes:
+                # Rows are roughly the same size; drop enough to get 10% under budget
+                row_bytes = used / count
+                excess = max(excess, int((used - self.max_bytes * 0.9) / row_bytes) + 1)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            self.evictions += excess
+        self._entries = max(count - max(excess, 0), 0)
+        self._bytes = self._used_bytes()
+
+class ChunkEmbeddingCache:
+    """
+    Persistent document-chunk embeddings keyed by embedding model and a hash of
+    the exact chunk text, so re-uploaded documents and shared boilerplate are
+    embedded only once. Bounded by CHUNK_EMBEDDING_CACHE_MAX_MB.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.store = SQLiteEmbeddingStore(
+            str(Path(settings.CACHE_DIR) / "chunk_embeddings.sqlite3"),
+            max_bytes=settings.CHUNK_EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Blocking; call from an executor"""
+        try:
+            return self.store.get_many(keys)
+        except sqlite3.Error as e:
+            logger.warning(f"Chunk embedding cache read failed: {str(e)}")
+            return {}
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Blocking; call from an executor"""
+        try:
+            self.store.put_many(items)
+        except sqlite3.Error as e:
+            logger.warning(f"Chunk embedding cache write failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            return self.store.stats()
+        except sqlite3.Error as e:
+            return {"error": str(e)}
+
+class QueryEmbeddingCache:
+    """
+    Query embeddings keyed by embedding model and normalized query text.
+    A bounded in-memory LRU in front of an optional SQLite tier that survives restarts.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.memory = TTLCache(
+            max_entries=settings.QUERY_EMBEDDING_CACHE_SIZE,
+            ttl_seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS
+        )
+        self.disk: Optional[SQLiteEmbeddingStore] = None
+        self.disk_hits = 0
+        if settings.QUERY_EMBEDDING_CACHE_DISK:
+            try:
+                self.disk = SQLiteEmbeddingStore(
+                    str(Path(settings.CACHE_DIR) / "query_embeddings.sqlite3"),
+                    max_entries=settings.QUERY_EMBEDDING_CACHE_DISK_SIZE,
+                    ttl_seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Query embedding disk cache disabled: {str(e)}")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get_memory(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[key] = vector
+        return found
+
+    def get_disk(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Blocking; call from an executor"""
+        if self.disk is None or not keys:
+            return {}
+        try:
+            found = self.disk.get_many(keys)
+        except sqlite3.Error as e:
+            logger.warning(f"Query embedding disk cache read failed: {str(e)}")
+            return {}
+        for key, vector in found.items():
+            self.memory.set(key, vector)
+        self.disk_hits += len(found)
+        return found
+
+    def put(self, items: Dict[str, List[float]]):
+        for key, vector in items.items():
+            self.memory.set(key, vector)
+
+    def put_disk(self, items: Dict[str, List[float]]):
+        """Blocking; call from an executor"""
+        if self.disk is None:
+            return
+        try:
+            self.disk.put_many(items)
+        except sqlite3.Error as e:
+            logger.warning(f"Query embedding disk cache write failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.disk_hits
+        misses = memory["misses"] - self.disk_hits
+        return {
+            "entries": memory["entries"],
+            "evictions": memory["evictions"],
+            "hits": hits,
+            "misses": misses,
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "disk_enabled": self.disk is not None
+        }
@@ -0,0 +1,230 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import sqlite3
+import threading
+
+from app.core.config import settings
+from app.core.embedding_cache import ChunkEmbeddingCache, QueryEmbeddingCache
+from app.core.executors import run_cpu, run_io
+from app.core.model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingService:
+    """
+    Cross-request micro-batching in front of an embedding model.
+
+    Concurrent embed_query/embed_documents calls are queued and, after waiting at
+    most EMBEDDING_MAX_WAIT_MS for company, run as one dynamic batch. Texts are
+    sorted by length before being cut into model batches so each batch pads to a
+    similar length, and every caller gets back exactly its own vectors.
+    Queries go through embed_documents as well; for the symmetric models used
+    here (MiniLM, text-embedding-3) that yields the same vectors as embed_query.
+    """
+
+    def __init__(self, embeddings, model_name: str, local: bool):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.query_cache = QueryEmbeddingCache(model_name) if settings.QUERY_EMBEDDING_CACHE_SIZE > 0 else None
+        self.chunk_cache: Optional[ChunkEmbeddingCache] = None
+        if settings.CHUNK_EMBEDDING_CACHE_ENABLED:
+            try:
+                self.chunk_cache = ChunkEmbeddingCache(model_name)
+            except sqlite3.Error as e:
+                logger.warning(f"Chunk embedding cache disabled: {str(e)}")
+        self._background: Set[asyncio.Task] = set()
+        # Local models are CPU-bound, OpenAI is a network call
+        self.local = local
+        self._run = run_cpu if local else run_io
+        self.max_batch_size = settings.EMBEDDING_BATCH_SIZE
+        self.max_wait = settings.EMBEDDING_MAX_WAIT_MS / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._texts = 0
+
+    async def embed_query(self, text: str) -> List[float]:
+        return (await self.embed_queries([text]))[0]
+    
+    async def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed search queries, skipping the model for ones seen before"""
+        if self.query_cache is None:
+            return await self._submit(list(texts))
+        
+        keys = [self.query_cache.key(text) for text in texts]
+        found = self.query_cache.get_memory(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.query_cache.disk is not None:
+            found.update(await run_io(self.query_cache.get_disk, missing))
+            missing = [key for key in missing if key not in found]
+        
+        if missing:
+            text_for_key = dict(zip(keys, texts))
+            vectors = await self._submit([text_for_key[key] for key in missing])
+            computed = dict(zip(missing, vectors))
+            self.query_cache.put(computed)
+            found.update(computed)
+            if self.query_cache.disk is not None:
+                # Persisting is off the request path
+                self._in_background(run_io(self.query_cache.put_disk, computed))
+        
+        return [found[key] for key in keys]
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed document chunks, reusing stored vectors for text embedded before"""
+        if not texts:
+            return []
+        if self.chunk_cache is None:
+            return await self._submit(list(texts))
+        
+        keys = [self.chunk_cache.key(text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found = await run_io(self.chunk_cache.get_many, unique_keys)
+        missing = [key for key in unique_keys if key not in found]
+        
+        if missing:
+            text_for_key = dict(zip(keys, texts))
+            vectors = await self._submit([text_for_key[key] for key in missing])
+            computed = dict(zip(missing, vectors))
+            await run_io(self.chunk_cache.put_many, computed)
+            found.update(computed)
+        
+        return [found[key] for key in keys]
+
+    def warm_up(self):
+        """One blocking inference on a local model; remote models need none"""
+        if self.local:
+            self.embeddings.embed_documents(["warm-up"])
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "batches": self._batches,
+                "requests": self._requests,
+                "texts": self._texts,
+                "avg_batch_texts": self._texts / self._batches if self._batches else 0.0,
+                "avg_batch_requests": self._requests / self._batches if self._batches else 0.0,
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+                "chunk_cache": self.chunk_cache.stats() if self.chunk_cache is not None else None
+            }
+
+    async def _submit(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._collector is None or self._collector.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect())
+        future = loop.create_future()
+        self._queue.put_nowait((texts, future))
+        return await future
+
+    async def _collect(self):
+        """Gather queued requests into batches and hand each batch off to the model"""
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self._queue.get()]
+            count = len(requests[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                count += len(request[0])
+            # Don't wait for the model: keep collecting the next batch meanwhile.
+            # The executor bounds how many batches actually run at once.
+            self._in_background(self._run_batch(requests))
+
+    def _in_background(self, coroutine):
+        """Run a task nobody awaits; keeps it referenced until done and logs its failure"""
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Embedding background task failed: {task.exception()!r}")
+
+    async def _run_batch(self, requests: List[Tuple[List[str], asyncio.Future]]):
+        texts = []
+        owners = []
+        for request_index, (request_texts, _) in enumerate(requests):
+            for position, text in enumerate(request_texts):
+                texts.append(text)
+                owners.append((request_index, position))
+
+        with self._lock:
+            self._batches += 1
+            self._requests += len(requests)
+            self._texts += len(texts)
+
+        # Group similar lengths together to cut padding waste
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results: List[List[List[float]]] = [[None] * len(request_texts) for request_texts, _ in requests]
+        try:
+            model_batches = [
+                order[start:start + self.max_batch_size]
+                for start in range(0, len(order), self.max_batch_size)
+            ]
+            vectors = await asyncio.gather(*[
+                self._run(self.embeddings.embed_documents, [texts[i] for i in batch])
+                for batch in model_batches
+            ])
+            for batch, batch_vectors in zip(model_batches, vectors):
+                for i, vector in zip(batch, batch_vectors):
+                    request_index, position = owners[i]
+                    results[request_index][position] = vector
+        except Exception as e:
+            logger.error(f"Embedding batch failed: {str(e)}")
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vectors in zip(requests, results):
+            if not future.done():  # the caller may have been cancelled
+                future.set_result(vectors)
+
+def get_embedding_service() -> EmbeddingService:
+    """Process-wide embedding service shared by ingestion and retrieval"""
+    return registry.get("embeddings")
+
+def _create_embedding_service() -> EmbeddingService:
+    if getattr(settings, 'USE_LOCAL_MODELS', False):
+        try:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+        except ImportError:
+            try:
+                from langchain.embeddings import HuggingFaceEmbeddings
+            except ImportError:
+                raise ImportError("Please install: pip install sentence-transformers")
+        logger.info("Initializing local embedding model...")
+        embeddings = HuggingFaceEmbeddings(
+            model_name=settings.LOCAL_EMBEDDING_MODEL,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': True}
+        )
+        return EmbeddingService(embeddings, settings.LOCAL_EMBEDDING_MODEL, local=True)
+
+    try:
+        from langchain_openai import OpenAIEmbeddings
+    except ImportError:
+        raise ImportError("Please install: pip install langchain-openai")
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        openai_api_key=settings.OPENAI_API_KEY
+    )
+    return EmbeddingService(embeddings, "text-embedding-3-small", local=False)
+
+registry.register("embeddings", _create_embedding_service, warm_up=EmbeddingService.warm_up)
@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable
+import asyncio
+import contextvars
+import logging
+import threading
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class TrackedExecutor:
+    """Thread pool that keeps blocking calls off the event loop and reports its queue depth"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"rag-{name}"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_queued = 0
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking callable in the pool and await its result"""
+        loop = asyncio.get_running_loop()
+        # Carry contextvars (request tracing etc.) into the worker thread
+        ctx = contextvars.copy_context()
+        started = threading.Event()
+
+        def call():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            started.set()
+            try:
+                return ctx.run(func, *args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        except asyncio.CancelledError:
+            # A cancelled call that never started must not stay counted as queued
+            if not started.is_set():
+                with self._lock:
+                    self._queued -= 1
+            raise
+
+    async def iterate(self, factory: Callable[[], Iterable[Any]]) -> AsyncIterator[Any]:
+        """Consume a blocking iterator in the pool, yielding its items on the event loop"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in factory():
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = asyncio.ensure_future(self.run(produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer went away or iteration finished; let the worker wind down
+            stop.set()
+        await producer
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "max_queued": self._max_queued
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+# I/O-bound calls: Chroma queries, Ollama/OpenAI HTTP calls, DB work
+io_executor = TrackedExecutor("io", settings.IO_EXECUTOR_WORKERS)
+
+# CPU-bound model inference: local embeddings, cross-encoder reranking.
+# Kept small so concurrent requests queue instead of thrashing the cores.
+cpu_executor = TrackedExecutor("cpu", settings.CPU_EXECUTOR_WORKERS)
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await io_executor.run(func, *args, **kwargs)
+
+async def run_cpu(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await cpu_executor.run(func, *args, **kwargs)
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    return {
+        "io": io_executor.stats(),
+        "cpu": cpu_executor.stats()
+    }
+
+def shutdown_executors():
+    logger.info("Shutting down executors")
+    io_executor.shutdown(wait=False)
+    cpu_executor.shutdown(wait=False)
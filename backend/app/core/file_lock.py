@@ -0,0 +1,19 @@
+from pathlib import Path
+import fcntl
+
+class FileLock:
+    """Exclusive advisory lock on a file, serializing writers across worker processes"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
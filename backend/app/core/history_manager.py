@@ -0,0 +1,104 @@
+from typing import Any, Dict, List, Optional
+import logging
+import re
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+def _compact(role: str, content: str) -> str:
+    """One summary line for an older message: its first sentence, shortened"""
+    text = " ".join(content.split())
+    text = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(text) > settings.HISTORY_SUMMARY_LINE_CHARS:
+        text = text[:settings.HISTORY_SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "..."
+    return f"{'User' if role == 'user' else 'Assistant'}: {text}"
+
+def _trim_summary(lines: List[str]) -> List[str]:
+    """Drop the oldest lines until the summary fits HISTORY_SUMMARY_MAX_TOKENS"""
+    total = sum(estimate_tokens(line) for line in lines)
+    start = 0
+    while start < len(lines) and total > settings.HISTORY_SUMMARY_MAX_TOKENS:
+        total -= estimate_tokens(lines[start])
+        start += 1
+    return lines[start:]
+
+class HistoryManager:
+    """
+    Bounded conversation history for the RAG prompt.
+
+    Only the last HISTORY_MAX_TURNS user/assistant pairs are read from the
+    database. Messages that have moved out of that window are folded into a
+    rolling summary stored on the Conversation (summary_message_id marks the
+    last message folded in), so each query folds only the few messages that
+    left the window since the previous one. The summary is extractive, one
+    line per message, which keeps an extra LLM call out of every turn. The
+    returned history (summary first, then the newest messages that fit) stays
+    within HISTORY_TOKEN_BUDGET however long the conversation gets.
+    """
+
+    async def load(self, db: AsyncSession, conversation: Conversation) -> List[Dict[str, str]]:
+        """History before the current message; updates the summary in the caller's transaction"""
+        recent = (await db.execute(
+            select(Message.id, Message.role, Message.content)
+            .where(Message.conversation_id == conversation.id)
+            .order_by(Message.id.desc())
+            .limit(settings.HISTORY_MAX_TURNS * 2)
+        )).all()
+        recent.reverse()
+
+        if len(recent) == settings.HISTORY_MAX_TURNS * 2:
+            await self._fold(db, conversation, before_id=recent[0].id)
+
+        return self._fit(conversation.summary, recent)
+
+    async def _fold(self, db: AsyncSession, conversation: Conversation, before_id: int):
+        """Add messages older than the recent window to the conversation summary"""
+        older = (await db.execute(
+            select(Message.id, Message.role, Message.content)
+            .where(
+                Message.conversation_id == conversation.id,
+                Message.id > (conversation.summary_message_id or 0),
+                Message.id < before_id
+            )
+            .order_by(Message.id)
+            .limit(settings.HISTORY_SUMMARY_BATCH)
+        )).all()
+        if not older:
+            return
+        lines = conversation.summary.split("\n") if conversation.summary else []
+        lines.extend(_compact(message.role, message.content) for message in older)
+        conversation.summary = "\n".join(_trim_summary(lines))
+        conversation.summary_message_id = older[-1].id
+        logger.debug(f"Folded {len(older)} messages into the summary of conversation {conversation.id}")
+
+    def _fit(self, summary: Optional[str], recent: List[Any]) -> List[Dict[str, str]]:
+        """Summary plus as many of the newest messages as fit the token budget"""
+        budget = settings.HISTORY_TOKEN_BUDGET
+        history: List[Dict[str, str]] = []
+        if summary:
+            content = f"Summary of the earlier conversation:\n{summary}"
+            budget -= estimate_tokens(content)
+            history.append({"role": "system", "content": content})
+
+        kept: List[Dict[str, str]] = []
+        for message in reversed(recent):
+            cost = estimate_tokens(message.content)
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append({"role": message.role, "content": message.content})
+        kept.reverse()
+        return history + kept
+
+history_manager = HistoryManager()
@@ -0,0 +1,307 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.executors import run_io
+from app.db.database import SessionLocal
+from app.db.models import Document, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+class IngestionQueue:
+    """
+    Database-backed document ingestion queue.
+
+    Jobs live in the ingestion_jobs table, so unfinished work survives a restart:
+    a job is claimed with a lease, the lease is renewed while it runs, and any
+    running job whose lease has expired (crashed or killed worker) is claimed again.
+    Every claim counts as an attempt and failed attempts are retried with
+    exponential backoff, so a file that keeps killing workers eventually fails.
+    """
+
+    def __init__(self, get_document_processor):
+        # Async getter, so the queue can start before the models have loaded
+        self._get_document_processor = get_document_processor
+        self.max_workers = settings.INGESTION_WORKERS
+        self.max_per_tenant = settings.INGESTION_MAX_PER_TENANT
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._stopping = False
+
+    def enqueue(self, db: Session, document: Document, payload: Dict[str, Any]) -> IngestionJob:
+        """Add a job for the document; committed together with the caller's transaction"""
+        job = IngestionJob(
+            document_id=document.id,
+            tenant_id=document.tenant_id,
+            status="pending",
+            max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+            next_attempt_at=datetime.utcnow(),
+            payload=payload
+        )
+        db.add(job)
+        return job
+
+    def notify(self):
+        """Wake the dispatcher instead of waiting for the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        logger.info(f"Ingestion queue started with {self.max_workers} workers")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Stop claiming new jobs and give running ones time to finish"""
+        self._stopping = True
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+
+        in_flight = list(self._running.values())
+        if in_flight:
+            logger.info(f"Draining {len(in_flight)} ingestion jobs")
+            _, pending = await asyncio.wait(
+                in_flight,
+                timeout=timeout if timeout is not None else settings.INGESTION_DRAIN_TIMEOUT_SECONDS
+            )
+            for task in pending:
+                # Left in "running"; the expired lease hands it to the next worker
+                task.cancel()
+            if pending:
+                logger.warning(f"{len(pending)} ingestion jobs did not finish before shutdown")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "running": len(self._running)
+        }
+
+    async def _dispatch_loop(self):
+        while not self._stopping:
+            try:
+                capacity = self.max_workers - len(self._running)
+                if capacity > 0:
+                    jobs = await run_io(self._claim_jobs, capacity)
+                    for job_id in jobs:
+                        task = asyncio.create_task(self._run_job(job_id))
+                        self._running[job_id] = task
+                        task.add_done_callback(lambda _, job_id=job_id: self._on_job_done(job_id))
+            except Exception as e:
+                logger.error(f"Error claiming ingestion jobs: {str(e)}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.INGESTION_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _on_job_done(self, job_id: int):
+        self._running.pop(job_id, None)
+        # A slot is free (and a retry may be due); look for more work
+        self.notify()
+
+    def _claim_jobs(self, limit: int) -> List[int]:
+        """Claim up to `limit` runnable jobs, honouring the per-tenant limit"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            self._fail_abandoned_jobs(db, now)
+            
+            running_per_tenant = dict(
+                db.query(IngestionJob.tenant_id, func.count(IngestionJob.id))
+                .filter(IngestionJob.status == "running", IngestionJob.lease_expires_at >= now)
+                .group_by(IngestionJob.tenant_id)
+                .all()
+            )
+
+            candidates = db.query(IngestionJob.id, IngestionJob.tenant_id).filter(
+                or_(
+                    and_(IngestionJob.status == "pending", IngestionJob.next_attempt_at <= now),
+                    and_(
+                        IngestionJob.status == "running",
+                        IngestionJob.lease_expires_at < now,
+                        IngestionJob.attempts < IngestionJob.max_attempts
+                    )
+                )
+            ).order_by(IngestionJob.id).limit(limit * 10).all()
+
+            claimed = []
+            for job_id, tenant_id in candidates:
+                if len(claimed) >= limit:
+                    break
+                if running_per_tenant.get(tenant_id, 0) >= self.max_per_tenant:
+                    continue
+                # Conditional update so two workers never claim the same job
+                result = db.execute(
+                    update(IngestionJob)
+                    .where(
+                        IngestionJob.id == job_id,
+                        or_(
+                            IngestionJob.status == "pending",
+                            and_(IngestionJob.status == "running", IngestionJob.lease_expires_at < now)
+                        )
+                    )
+                    .values(
+                        status="running",
+                        attempts=IngestionJob.attempts + 1,
+                        started_at=now,
+                        lease_expires_at=now + timedelta(seconds=settings.INGESTION_LEASE_SECONDS)
+                    )
+                )
+                if result.rowcount == 1:
+                    claimed.append(job_id)
+                    running_per_tenant[tenant_id] = running_per_tenant.get(tenant_id, 0) + 1
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _fail_abandoned_jobs(self, db: Session, now: datetime):
+        """Give up on jobs whose worker died on every attempt"""
+        abandoned = db.query(IngestionJob).filter(
+            IngestionJob.status == "running",
+            IngestionJob.lease_expires_at < now,
+            IngestionJob.attempts >= IngestionJob.max_attempts
+        ).all()
+        for job in abandoned:
+            job.status = "failed"
+            job.finished_at = now
+            job.lease_expires_at = None
+            job.last_error = job.last_error or "Worker stopped while processing the document"
+            db.query(Document).filter(Document.id == job.document_id).update({"status": "failed"})
+        if abandoned:
+            logger.warning(f"Marked {len(abandoned)} abandoned ingestion jobs as failed")
+
+    async def _run_job(self, job_id: int):
+        job = await run_io(self._load_job, job_id)
+        if job is None:
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            document_processor = await self._get_document_processor()
+            payload = job["payload"]
+            if payload.get("action") == "update":
+                # Diff-based re-index of a new version; idempotent, so retries need no cleanup
+                process = document_processor.update_document
+            else:
+                process = document_processor.process_document
+                if job["attempts"] > 1:
+                    # Drop whatever an earlier attempt managed to write before retrying
+                    await document_processor.delete_document_chunks(
+                        tenant_id=job["tenant_id"],
+                        document_id=job["document_id"]
+                    )
+            result = await process(
+                file_path=payload["file_path"],
+                file_type=payload["file_type"],
+                tenant_id=job["tenant_id"],
+                document_id=job["document_id"],
+                metadata=payload.get("metadata")
+            )
+            if result["status"] != "success":
+                raise RuntimeError(result.get("error", "processing failed"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            await run_io(self._mark_failed, job_id, str(e))
+        else:
+            document_exists = await run_io(self._mark_completed, job_id, result.get("chunk_count", 0))
+            if not document_exists:
+                # Deleted while we were processing it; don't leave orphaned chunks behind
+                await document_processor.delete_document_chunks(
+                    tenant_id=job["tenant_id"],
+                    document_id=job["document_id"]
+                )
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: int):
+        interval = max(settings.INGESTION_LEASE_SECONDS / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_io(self._renew_lease, job_id)
+            except Exception as e:
+                logger.warning(f"Could not renew lease for ingestion job {job_id}: {str(e)}")
+
+    def _load_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+            if job is None:
+                return None
+            return {
+                "document_id": job.document_id,
+                "tenant_id": job.tenant_id,
+                "attempts": job.attempts,
+                "payload": job.payload or {}
+            }
+        finally:
+            db.close()
+
+    def _renew_lease(self, job_id: int):
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.status == "running")
+                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=settings.INGESTION_LEASE_SECONDS))
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _mark_completed(self, job_id: int, chunk_count: int) -> bool:
+        """Mark the job and its document completed; False if the document is gone"""
+        db = SessionLocal()
+        try:
+            job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+            if job is None:
+                return False
+            job.status = "completed"
+            job.finished_at = datetime.utcnow()
+            job.lease_expires_at = None
+            document = db.query(Document).filter(Document.id == job.document_id).first()
+            if document is not None:
+                document.status = "completed"
+                document.chunk_count = chunk_count
+            db.commit()
+            return document is not None
+        finally:
+            db.close()
+
+    def _mark_failed(self, job_id: int, error: str):
+        db = SessionLocal()
+        try:
+            job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+            if job is None:
+                return
+            job.last_error = error
+            job.lease_expires_at = None
+            if job.attempts < job.max_attempts:
+                backoff = settings.INGESTION_RETRY_BACKOFF_SECONDS * (2 ** (job.attempts - 1))
+                job.status = "pending"
+                job.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+                logger.info(f"Retrying ingestion job {job_id} in {backoff:.0f}s (attempt {job.attempts + 1}/{job.max_attempts})")
+            else:
+                job.status = "failed"
+                job.finished_at = datetime.utcnow()
+                document = db.query(Document).filter(Document.id == job.document_id).first()
+                if document is not None:
+                    document.status = "failed"
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,507 @@
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import math
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Identifier-like tokens ("ERR-4012", "policy_7.2", "AB/1234") are kept whole and
+# also split into their parts, so both exact codes and their pieces match.
+_TOKEN_RE = re.compile(r"\w+(?:[-_./:]\w+)*")
+_SPLIT_RE = re.compile(r"[-_./:]")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its "
+    "of on or that the their there these they this to was were what when where "
+    "which who why will with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.casefold()):
+        token = match.group()
+        if token not in _STOPWORDS:
+            tokens.append(token)
+        if _SPLIT_RE.search(token):
+            tokens.extend(part for part in _SPLIT_RE.split(token) if part and part not in _STOPWORDS)
+    return tokens
+
+def _chunk_record(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    tokens = tokenize(chunk["content"])
+    return {
+        "id": chunk["id"],
+        "document_id": chunk["document_id"],
+        "length": len(tokens),
+        "terms": dict(Counter(tokens))
+    }
+
+def _pack_strings(strings: Iterable[str]) -> np.ndarray:
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+def _unpack_strings(packed: np.ndarray) -> List[str]:
+    text = packed.tobytes().decode("utf-8")
+    return text.split("\n") if text else []
+
+class _Growable:
+    """Append-only numpy array with amortized doubling"""
+
+    def __init__(self, dtype, values: Optional[np.ndarray] = None):
+        values = np.asarray(values if values is not None else [], dtype=dtype)
+        self._data = np.empty(max(len(values) * 2, 1024), dtype=dtype)
+        self._data[:len(values)] = values
+        self.size = len(values)
+
+    def append(self, value):
+        if self.size == len(self._data):
+            data = np.empty(len(self._data) * 2, dtype=self._data.dtype)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size] = value
+        self.size += 1
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self.size]
+
+class TenantKeywordIndex:
+    """
+    BM25 inverted index over one tenant's chunks.
+
+    Postings live in two tiers: an immutable CSR base segment (term -> slice of
+    slot/tf arrays) persisted as .npz, and a small mutable delta holding chunks
+    added since the last merge. Every change is also appended to a JSON-lines
+    log, so an update costs one append and other workers catch up by replaying
+    the log tail. Deleted chunks are tombstoned and physically dropped when the
+    index is compacted into a new base segment.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    COMMON_TERM_RATIO = 1 / 16
+    COMMON_TERM_MIN_POSTINGS = 50_000
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.generation: Optional[str] = None
+        self.log_offset = 0
+        self._reset()
+
+    def _reset(self):
+        # Base segment
+        self.terms: Dict[str, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.base_slots = np.zeros(0, dtype=np.int32)
+        self.base_tfs = np.zeros(0, dtype=np.uint16)
+        # Delta segment: term -> (slots, tfs)
+        self.delta: Dict[str, Tuple[array, array]] = {}
+        self.delta_postings = 0
+        # Per-slot data, shared by both segments
+        self.chunk_ids: List[str] = []
+        self.slot_of: Dict[str, int] = {}
+        self.document_ids = _Growable(np.int64)
+        self.lengths = _Growable(np.float32)
+        self.alive = _Growable(np.bool_)
+        self.live_count = 0
+        self.live_length = 0.0
+
+    # ---- persistence -------------------------------------------------------
+
+    @property
+    def _current_path(self) -> Path:
+        return self.directory / "CURRENT"
+
+    def _base_path(self, generation: str) -> Path:
+        return self.directory / f"base_{generation}.npz"
+
+    def _log_path(self, generation: str) -> Path:
+        return self.directory / f"log_{generation}.jsonl"
+
+    def exists(self) -> bool:
+        return self._current_path.exists()
+
+    def sync(self):
+        """Pick up changes written by other workers since the last sync"""
+        for _ in range(3):
+            try:
+                generation = self._current_path.read_text().strip()
+            except FileNotFoundError:
+                if self.generation is not None:
+                    self.generation = None
+                    self._reset()
+                return
+            try:
+                if generation != self.generation:
+                    self._load(generation)
+                else:
+                    self._replay_log()
+                return
+            except FileNotFoundError:
+                # Compacted by another worker while we were reading; retry
+                continue
+
+    def _load(self, generation: str):
+        self._reset()
+        with np.load(self._base_path(generation), allow_pickle=False) as data:
+            terms = _unpack_strings(data["terms"])
+            self.terms = {term: i for i, term in enumerate(terms)}
+            self.indptr = data["indptr"]
+            self.base_slots = data["slots"]
+            self.base_tfs = data["tfs"]
+            self.chunk_ids = _unpack_strings(data["chunk_ids"])
+            self.document_ids = _Growable(np.int64, data["document_ids"])
+            self.lengths = _Growable(np.float32, data["lengths"])
+        self.alive = _Growable(np.bool_, np.ones(len(self.chunk_ids), dtype=np.bool_))
+        self.slot_of = {chunk_id: slot for slot, chunk_id in enumerate(self.chunk_ids)}
+        self.live_count = len(self.chunk_ids)
+        self.live_length = float(self.lengths.values.sum())
+        self.generation = generation
+        self.log_offset = 0
+        self._replay_log()
+
+    def _replay_log(self):
+        path = self._log_path(self.generation)
+        with open(path, "rb") as f:
+            f.seek(self.log_offset)
+            data = f.read()
+        # Only consume complete records; a writer may be mid-append
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(json.loads(line))
+        self.log_offset += end
+
+    def _append_log(self, record: Dict[str, Any]):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with open(self._log_path(self.generation), "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.log_offset += len(line)
+
+    def write_base(self):
+        """Compact live chunks into a new base segment and start an empty log"""
+        live = np.flatnonzero(self.alive.values)
+        remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+
+        # Flatten both segments into (term row, slot, tf) triples
+        vocab = list(self.terms)
+        row_parts = [np.repeat(np.arange(len(vocab), dtype=np.int64), np.diff(self.indptr))]
+        slot_parts = [self.base_slots]
+        tf_parts = [self.base_tfs]
+        for term, (slots, tfs) in self.delta.items():
+            row = self.terms.get(term)
+            if row is None:
+                row = len(vocab)
+                vocab.append(term)
+            row_parts.append(np.full(len(slots), row, dtype=np.int64))
+            slot_parts.append(np.array(slots, dtype=np.int32))
+            tf_parts.append(np.array(tfs, dtype=np.uint16))
+        rows = np.concatenate(row_parts)
+        slots = remap[np.concatenate(slot_parts)]
+        tfs = np.concatenate(tf_parts)
+
+        keep = slots >= 0
+        rows, slots, tfs = rows[keep], slots[keep], tfs[keep]
+        order = np.lexsort((slots, rows))
+        rows, slots, tfs = rows[order], slots[order], tfs[order]
+        counts = np.bincount(rows, minlength=len(vocab))
+        used = np.flatnonzero(counts)
+        terms = [vocab[row] for row in used]
+        indptr = np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64)
+
+        generation = uuid.uuid4().hex
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f"base_{generation}.tmp.npz"
+        np.savez(
+            tmp_path,
+            terms=_pack_strings(terms),
+            indptr=indptr,
+            slots=slots.astype(np.int32),
+            tfs=tfs,
+            chunk_ids=_pack_strings(self.chunk_ids[slot] for slot in live),
+            document_ids=self.document_ids.values[live],
+            lengths=self.lengths.values[live]
+        )
+        os.replace(tmp_path, self._base_path(generation))
+        self._log_path(generation).touch()
+        current_tmp = self.directory / "CURRENT.tmp"
+        current_tmp.write_text(generation)
+        os.replace(current_tmp, self._current_path)
+
+        old_generation = self.generation
+        self._load(generation)
+        if old_generation:
+            for path in (self._base_path(old_generation), self._log_path(old_generation)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def needs_compaction(self) -> bool:
+        slots = len(self.chunk_ids)
+        dead = slots - self.live_count
+        base_postings = len(self.base_slots)
+        return (
+            dead > settings.KEYWORD_INDEX_COMPACT_RATIO * max(slots, 1)
+        ) or (
+            self.delta_postings > max(settings.KEYWORD_INDEX_COMPACT_RATIO * base_postings, 100_000)
+        )
+
+    # ---- mutation ----------------------------------------------------------
+
+    def add(self, chunks: List[Dict[str, Any]]):
+        """chunks: [{"id", "document_id", "content"}]"""
+        record = {"op": "add", "chunks": [_chunk_record(chunk) for chunk in chunks]}
+        self._append_log(record)
+        self._apply(record)
+
+    def delete_document(self, document_id: int):
+        record = {"op": "delete", "document_id": document_id}
+        self._append_log(record)
+        self._apply(record)
+
+    def delete_chunks(self, chunk_ids: List[str]):
+        record = {"op": "delete_chunks", "ids": chunk_ids}
+        self._append_log(record)
+        self._apply(record)
+
+    def _apply(self, record: Dict[str, Any]):
+        if record["op"] == "add":
+            for chunk in record["chunks"]:
+                self._remove_slot(self.slot_of.get(chunk["id"]))
+                slot = len(self.chunk_ids)
+                self.chunk_ids.append(chunk["id"])
+                self.slot_of[chunk["id"]] = slot
+                self.document_ids.append(chunk["document_id"])
+                self.lengths.append(chunk["length"])
+                self.alive.append(True)
+                self.live_count += 1
+                self.live_length += chunk["length"]
+                for term, tf in chunk["terms"].items():
+                    postings = self.delta.get(term)
+                    if postings is None:
+                        postings = self.delta[term] = (array("i"), array("H"))
+                    postings[0].append(slot)
+                    postings[1].append(min(tf, 65535))
+                    self.delta_postings += 1
+        elif record["op"] == "delete_chunks":
+            for chunk_id in record["ids"]:
+                self._remove_slot(self.slot_of.get(chunk_id))
+        elif record["op"] == "delete":
+            slots = np.flatnonzero(
+                (self.document_ids.values == record["document_id"]) & self.alive.values
+            )
+            for slot in slots:
+                self._remove_slot(int(slot))
+
+    def _remove_slot(self, slot: Optional[int]):
+        if slot is None or not self.alive.values[slot]:
+            return
+        self.alive.values[slot] = False
+        self.live_count -= 1
+        self.live_length -= float(self.lengths.values[slot])
+        self.slot_of.pop(self.chunk_ids[slot], None)
+
+    # ---- search ------------------------------------------------------------
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        parts_slots = []
+        parts_tfs = []
+        row = self.terms.get(term)
+        if row is not None:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            parts_slots.append(self.base_slots[start:end])
+            parts_tfs.append(self.base_tfs[start:end])
+        delta = self.delta.get(term)
+        if delta is not None:
+            parts_slots.append(np.array(delta[0], dtype=np.int32))
+            parts_tfs.append(np.array(delta[1], dtype=np.uint16))
+        if not parts_slots:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        if len(parts_slots) == 1:
+            return parts_slots[0], parts_tfs[0]
+        return np.concatenate(parts_slots), np.concatenate(parts_tfs)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        if self.live_count == 0:
+            return []
+        terms = []
+        total_slots = len(self.chunk_ids)
+        for term in set(tokenize(query)):
+            slots, tfs = self._postings(term)
+            if len(slots):
+                # df and N both count tombstoned chunks until the next compaction,
+                # as Lucene's docFreq and maxDoc do, so idf stays positive
+                df = len(slots)
+                idf = math.log(1 + (total_slots - df + 0.5) / (df + 0.5))
+                terms.append((idf, slots, tfs))
+        if not terms:
+            return []
+
+        # Common-terms handling, in the spirit of Lucene's CommonTermsQuery: terms
+        # found in a large share of chunks only add to the scores of chunks the
+        # rarer query terms matched, so scoring is driven by the short postings
+        # lists instead of a pass over most of the index.
+        cutoff = max(total_slots * self.COMMON_TERM_RATIO, self.COMMON_TERM_MIN_POSTINGS)
+        rare = [term for term in terms if len(term[1]) <= cutoff]
+        common = [term for term in terms if len(term[1]) > cutoff]
+        if rare:
+            candidates, scores = self._accumulate(rare, total_slots)
+            self._probe(candidates, scores, common)
+        else:
+            candidates, scores = self._accumulate(common, total_slots)
+        scores[~self.alive.values[candidates]] = 0.0
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.chunk_ids[candidates[i]], float(scores[i]))
+            for i in top
+            if scores[i] > 0
+        ]
+
+    def _bm25(self, idf: float, tfs: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        avg_length = max(self.live_length / self.live_count, 1.0)
+        tfs = tfs.astype(np.float32)
+        norm = self.K1 * (1 - self.B + self.B * self.lengths.values[slots] / avg_length)
+        return idf * tfs * (self.K1 + 1) / (tfs + norm)
+
+    def _probe(self, candidates: np.ndarray, scores: np.ndarray, terms: List[Tuple[float, np.ndarray, np.ndarray]]):
+        """Add the contributions of long postings lists for the given candidates only"""
+        for idf, slots, tfs in terms:
+            # Postings are sorted by slot, so membership is a binary search
+            positions = np.minimum(np.searchsorted(slots, candidates), len(slots) - 1)
+            found = slots[positions] == candidates
+            scores[found] += self._bm25(idf, tfs[positions[found]], candidates[found])
+
+    def _accumulate(self, terms: List[Tuple[float, np.ndarray, np.ndarray]], total_slots: int):
+        """Sum per-term BM25 contributions; returns (slots, scores)"""
+        slots = np.concatenate([term_slots for _, term_slots, _ in terms])
+        contributions = np.concatenate([
+            self._bm25(idf, tfs, term_slots) for idf, term_slots, tfs in terms
+        ])
+        if len(slots) * 8 < total_slots:
+            # Few postings: aggregate over the touched slots only
+            candidates, inverse = np.unique(slots, return_inverse=True)
+            return candidates, np.bincount(inverse, weights=contributions)
+        return np.arange(total_slots), np.bincount(slots, weights=contributions, minlength=total_slots)
+
+class KeywordIndex:
+    """Per-tenant BM25 indexes stored under KEYWORD_INDEX_DIR"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._indexes: Dict[int, TenantKeywordIndex] = {}
+        self._lock = threading.Lock()
+
+    def _index(self, tenant_id: int) -> TenantKeywordIndex:
+        with self._lock:
+            index = self._indexes.get(tenant_id)
+            if index is None:
+                index = self._indexes[tenant_id] = TenantKeywordIndex(self.root / f"tenant_{tenant_id}")
+            return index
+
+    def _file_lock(self, index: TenantKeywordIndex):
+        """Serializes writers across worker processes"""
+        index.directory.mkdir(parents=True, exist_ok=True)
+        return FileLock(index.directory / "lock")
+
+    def _ensure_built(self, index: TenantKeywordIndex, collection=None):
+        """Create the index, backfilling from the vector store for pre-existing tenants"""
+        if index.exists():
+            return
+        chunks = list(_iter_collection(collection)) if collection is not None else []
+        index._reset()
+        index.generation = None
+        if chunks:
+            logger.info(f"Backfilling keyword index {index.directory.name} with {len(chunks)} chunks")
+            index._apply({"op": "add", "chunks": [_chunk_record(chunk) for chunk in chunks]})
+        index.write_base()
+
+    def add_chunks(self, tenant_id: int, chunks: List[Dict[str, Any]], collection=None):
+        """Blocking; index chunks that were just written to the vector store"""
+        index = self._index(tenant_id)
+        with index.lock, self._file_lock(index):
+            self._ensure_built(index, collection)
+            index.sync()
+            index.add(chunks)
+            if index.needs_compaction():
+                index.write_base()
+
+    def delete_document(self, tenant_id: int, document_id: int):
+        """Blocking; tombstone every chunk of a document"""
+        index = self._index(tenant_id)
+        with index.lock, self._file_lock(index):
+            if not index.exists():
+                return
+            index.sync()
+            index.delete_document(document_id)
+            if index.needs_compaction():
+                index.write_base()
+
+    def delete_chunks(self, tenant_id: int, chunk_ids: List[str]):
+        """Blocking; tombstone individual chunks, e.g. sections removed from a document"""
+        index = self._index(tenant_id)
+        with index.lock, self._file_lock(index):
+            if not index.exists():
+                return
+            index.sync()
+            index.delete_chunks(chunk_ids)
+            if index.needs_compaction():
+                index.write_base()
+
+    def search(self, tenant_id: int, query: str, top_k: int, collection=None) -> List[Tuple[str, float]]:
+        """Blocking; returns [(chunk_id, bm25_score)] best first"""
+        index = self._index(tenant_id)
+        if not index.exists():
+            if collection is None:
+                return []
+            with index.lock, self._file_lock(index):
+                self._ensure_built(index, collection)
+        with index.lock:
+            index.sync()
+            return index.search(query, top_k)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            indexes = dict(self._indexes)
+        return {
+            f"tenant_{tenant_id}": {
+                "chunks": index.live_count,
+                "terms": len(index.terms) + len(index.delta),
+                "delta_postings": index.delta_postings
+            }
+            for tenant_id, index in indexes.items()
+        }
+
+def _iter_collection(collection, page_size: int = 1000):
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page.get("ids") or []
+        if not ids:
+            return
+        for chunk_id, content, metadata in zip(ids, page["documents"], page["metadatas"]):
+            yield {
+                "id": chunk_id,
+                "document_id": (metadata or {}).get("document_id", -1),
+                "content": content or ""
+            }
+        offset += len(ids)
+
+keyword_index = KeywordIndex(settings.KEYWORD_INDEX_DIR)
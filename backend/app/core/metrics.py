@@ -0,0 +1,248 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+import contextvars
+import logging
+import math
+import threading
+import time
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from cache hits and vector searches up to slow local generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            return [("", key, value) for key, value in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, value in self._samples():
+            names = self.label_names
+            if suffix == "_bucket":
+                # Histogram buckets carry the extra "le" label as the last value
+                names = names + ("le",)
+            lines.append(f"{self.name}{suffix}{_format_labels(names, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels):
+        """For totals kept by another component (e.g. cache hit counters), copied at scrape time"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            snapshot = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", key + (_format_value(bound),), cumulative))
+            samples.append(("_sum", key, counts[-2]))
+            samples.append(("_count", key, counts[-1]))
+        return samples
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text format, so /metrics
+    needs neither prometheus_client nor a push gateway. Collectors run just
+    before rendering, to copy counters that other components already keep
+    (cache hits, executor queues) into gauges.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _add(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collect: Callable[[], None]):
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each RAG query and ingestion stage",
+    ["pipeline", "stage"]
+)
+STAGE_IN_FLIGHT = metrics.gauge(
+    "rag_stage_in_flight",
+    "Stages currently running",
+    ["pipeline", "stage"]
+)
+TIME_TO_FIRST_TOKEN = metrics.histogram(
+    "rag_time_to_first_token_seconds",
+    "Time from receiving a streamed chat request to sending its first answer token",
+    ["mode"]
+)
+
+class RequestTrace:
+    """Stage spans of one request, for the X-Debug-Timings breakdown"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.first_token_ms: Optional[float] = None
+
+    def add(self, pipeline: str, stage: str, started: float, seconds: float):
+        self.spans.append({
+            "pipeline": pipeline,
+            "stage": stage,
+            "start_ms": round((started - self.started) * 1000, 1),
+            "duration_ms": round(seconds * 1000, 1)
+        })
+
+    def breakdown(self) -> Dict[str, Any]:
+        breakdown: Dict[str, Any] = {"total_ms": round((time.perf_counter() - self.started) * 1000, 1)}
+        if self.first_token_ms is not None:
+            breakdown["first_token_ms"] = self.first_token_ms
+        breakdown["stages"] = sorted(self.spans, key=lambda span: span["start_ms"])
+        return breakdown
+
+# Copied into tasks and run_io worker threads, so stages anywhere in a request land in its trace
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("rag_request_trace", default=None)
+
+def start_trace() -> RequestTrace:
+    """Collect the stages of the current request (its task and everything it awaits)"""
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+def record_stage(pipeline: str, stage: str, seconds: float):
+    """Record a stage that has already finished"""
+    if settings.METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(pipeline, stage, time.perf_counter() - seconds, seconds)
+
+@contextmanager
+def track_stage(pipeline: str, stage: str) -> Iterator[None]:
+    """Time a block as a pipeline stage and count it as in flight while it runs"""
+    in_flight = settings.METRICS_ENABLED
+    if in_flight:
+        STAGE_IN_FLIGHT.inc(pipeline=pipeline, stage=stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if in_flight:
+            STAGE_IN_FLIGHT.dec(pipeline=pipeline, stage=stage)
+        record_stage(pipeline, stage, time.perf_counter() - started)
+
+def record_first_token(mode: str, seconds: float):
+    """Time to first token of a streamed answer, measured from when the request arrived"""
+    if settings.METRICS_ENABLED:
+        TIME_TO_FIRST_TOKEN.observe(seconds, mode=mode)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.first_token_ms = round(seconds * 1000, 1)
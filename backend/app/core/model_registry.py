@@ -0,0 +1,163 @@
+from typing import Any, Callable, Dict, Iterable, Optional
+import logging
+import os
+import threading
+import time
+
+from app.core.executors import run_io
+
+logger = logging.getLogger(__name__)
+
+def _rss_bytes() -> Optional[int]:
+    """Resident set size of this process, if the platform exposes it"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _tensor_bytes(obj: Any, depth: int = 0, seen: Optional[set] = None) -> int:
+    """Bytes held by the weights of any torch modules reachable from obj"""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen or depth > 4 or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    if hasattr(obj, "state_dict") and hasattr(obj, "named_modules"):
+        # state_dict also covers packed int8 weights, which parameters() skips
+        total = 0
+        for tensor in obj.state_dict().values():
+            if hasattr(tensor, "element_size"):
+                total += tensor.numel() * tensor.element_size()
+        return total
+    if isinstance(obj, (list, tuple)):
+        children = obj
+    elif isinstance(obj, dict):
+        children = obj.values()
+    elif getattr(obj, "__closure__", None):
+        # e.g. a predict function closing over its model
+        children = [cell.cell_contents for cell in obj.__closure__]
+    elif hasattr(obj, "__dict__"):
+        children = vars(obj).values()
+    else:
+        return 0
+    return sum(_tensor_bytes(child, depth + 1, seen) for child in children)
+
+class ModelRegistry:
+    """
+    Process-wide shared instances of models and clients.
+
+    Each name maps to a factory that runs on first get(); every later caller in
+    the process (API routers, ingestion, background jobs) receives the same
+    instance, so a worker holds one copy of each model however many components
+    use it. Loading records the time taken, the growth of the process RSS while
+    loading and, for torch models, the size of their weights. An optional
+    warm_up callable runs one inference right after loading, so the first
+    request doesn't pay for lazy initialization inside the model libraries.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._warm_ups: Dict[str, Optional[Callable[[Any], Any]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._loading: set = set()
+        self._errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, factory: Callable[[], Any], warm_up: Optional[Callable[[Any], Any]] = None):
+        with self._lock:
+            if name in self._instances:
+                raise ValueError(f"Model {name} is already loaded")
+            self._factories[name] = factory
+            self._warm_ups[name] = warm_up
+            self._load_locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._factories:
+                raise ValueError(f"Unknown model: {name}")
+            load_lock = self._load_locks[name]
+        # Per-name lock: a slow model load doesn't block other lookups
+        with load_lock:
+            instance = self._instances.get(name)
+            if instance is not None:
+                return instance
+            logger.info(f"Loading shared model {name}")
+            self._loading.add(name)
+            try:
+                rss_before = _rss_bytes()
+                started = time.perf_counter()
+                instance = self._factories[name]()
+                info = {"load_seconds": round(time.perf_counter() - started, 2)}
+                warm_up = self._warm_ups.get(name)
+                if warm_up is not None:
+                    started = time.perf_counter()
+                    try:
+                        warm_up(instance)
+                    except Exception as e:
+                        logger.warning(f"Warm-up of {name} failed: {str(e)}")
+                    info["warm_up_seconds"] = round(time.perf_counter() - started, 2)
+                rss_after = _rss_bytes()
+                info["rss_delta_mb"] = round((rss_after - rss_before) / 1024 / 1024, 1) \
+                    if rss_before is not None and rss_after is not None else None
+                info["weights_mb"] = round(_tensor_bytes(instance) / 1024 / 1024, 1)
+            except Exception as e:
+                # Recorded for /ready; the next get() tries again
+                self._errors[name] = str(e)
+                raise
+            finally:
+                self._loading.discard(name)
+            self._errors.pop(name, None)
+            self._info[name] = info
+            self._instances[name] = instance
+            logger.info(f"Loaded {name}: {info}")
+            return instance
+
+    async def get_async(self, name: str) -> Any:
+        """get() for request handlers: waits for a model that is still loading off the event loop"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        return await run_io(self.get, name)
+
+    def warm_up(self, names: Iterable[str]):
+        """Load the named models one after another, logging failures; blocking"""
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Could not load {name}: {str(e)}")
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def state(self, name: str) -> str:
+        """One of: ready, loading, failed, not_loaded"""
+        if name in self._instances:
+            return "ready"
+        if name in self._loading:
+            return "loading"
+        if name in self._errors:
+            return "failed"
+        return "not_loaded"
+
+    def stats(self) -> Dict[str, Any]:
+        """Per model: load state, and its load time and memory once loaded"""
+        rss = _rss_bytes()
+        with self._lock:
+            names = list(self._factories)
+        return {
+            "process_rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+            "models": {
+                name: {"state": self.state(name), **self._info.get(name, {}), **(
+                    {"error": self._errors[name]} if name in self._errors else {}
+                )}
+                for name in names
+            }
+        }
+
+registry = ModelRegistry()
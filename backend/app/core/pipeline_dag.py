@@ -0,0 +1,100 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from app.core.metrics import record_stage, track_stage
+
+logger = logging.getLogger(__name__)
+
+class PipelineDAG:
+    """
+    Runs async pipeline stages as a dependency graph.
+
+    Each stage starts as soon as all of its dependencies have finished and is
+    called with their results, in the order the dependencies were listed.
+    Optional stages that fail yield None instead of failing the pipeline.
+    Per-stage start offsets and durations are recorded in `timings`, and
+    observed under the given pipeline name in the stage latency metrics.
+    """
+
+    def __init__(self, pipeline: str = "dag"):
+        self.pipeline = pipeline
+        self._stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...], bool]] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._started: Optional[float] = None
+
+    def stage(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        deps: Iterable[str] = (),
+        optional: bool = False
+    ) -> "PipelineDAG":
+        if name in self._stages:
+            raise ValueError(f"Duplicate pipeline stage: {name}")
+        self._stages[name] = (func, tuple(deps), optional)
+        return self
+
+    def _check(self):
+        visiting, done = set(), set()
+
+        def visit(name: str, path: List[str]):
+            if name not in self._stages:
+                raise ValueError(f"Pipeline stage {path[-1]} depends on unknown stage {name}")
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a cycle: {' -> '.join(path + [name])}")
+            visiting.add(name)
+            for dep in self._stages[name][1]:
+                visit(dep, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self._stages:
+            visit(name, [name])
+
+    async def run(self) -> Dict[str, Any]:
+        """Run every stage; returns {stage name: result}"""
+        self._check()
+        started = self._started = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(name: str) -> Any:
+            func, deps, optional = self._stages[name]
+            inputs = [await tasks[dep] for dep in deps]
+            stage_started = time.perf_counter()
+            try:
+                with track_stage(self.pipeline, name):
+                    return await func(*inputs)
+            except Exception as e:
+                if not optional:
+                    raise
+                logger.warning(f"Optional pipeline stage {name} failed: {str(e)}")
+                return None
+            finally:
+                self.timings[name] = {
+                    "start_ms": round((stage_started - started) * 1000, 1),
+                    "duration_ms": round((time.perf_counter() - stage_started) * 1000, 1)
+                }
+
+        for name in self._stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return dict(zip(tasks, results))
+
+    def record(self, name: str, stage_started: float):
+        """Record the timing of work done after the graph ran, e.g. streamed generation"""
+        started = self._started if self._started is not None else stage_started
+        duration = time.perf_counter() - stage_started
+        self.timings[name] = {
+            "start_ms": round((stage_started - started) * 1000, 1),
+            "duration_ms": round(duration * 1000, 1)
+        }
+        record_stage(self.pipeline, name, duration)
@@ -1,151 +1,230 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from sentence_transformers import CrossEncoder
-import chromadb
-from chromadb.config import Settings as ChromaSettings
 import logging
+import time
 
 from app.core.config import settings
+from app.core.answer_cache import answer_cache
+from app.core.embedding_service import get_embedding_service
+from app.core.executors import run_io
+from app.core.metrics import record_stage, track_stage
+from app.core.model_registry import registry
+from app.core.pipeline_dag import PipelineDAG
+from app.core.reranker import get_reranker
+from app.core.retrieval import fuse_retrievals, search_rankings
+from app.core.tenant_versions import get_tenant_version
+from app.core.vector_store import get_vector_store
 
 logger = logging.getLogger(__name__)
 
+registry.register("openai_llm", lambda: ChatOpenAI(
+    model="gpt-4-turbo-preview",
+    temperature=0.7,
+    openai_api_key=settings.OPENAI_API_KEY
+))
+
 class RAG2Orchestrator:
     """Advanced RAG 2.0 Pipeline with multi-stage retrieval and verification"""
     
     def __init__(self):
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",
-            openai_api_key=settings.OPENAI_API_KEY
-        )
-        self.llm = ChatOpenAI(
-            model="gpt-4-turbo-preview",
-            temperature=0.7,
-            openai_api_key=settings.OPENAI_API_KEY
-        )
-        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        self.embedding_service = get_embedding_service()
+        self.llm = registry.get("openai_llm")
+        self.reranker = get_reranker()
         
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(
-            path=settings.CHROMA_PERSIST_DIR,
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
+        # Vector store: ChromaDB or memory-mapped NumPy segments (VECTOR_STORE_BACKEND)
+        self.vector_store = get_vector_store()
         
     async def process_query(
         self,
         query: str,
         tenant_id: int,
-        conversation_history: Optional[List[Dict]] = None
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None,
+        rag_mode: Optional[str] = None
     ) -> Dict[str, Any]:
         """Main RAG 2.0 pipeline orchestration"""
         try:
-            # Step 1: Query Understanding & Expansion
-            expanded_queries = await self.query_expansion(query, conversation_history)
-            
-            # Step 2: Multi-Stage Retrieval
-            candidate_chunks = await self.hybrid_retrieval(expanded_queries, tenant_id)
-            
-            # Step 3: Cross-Encoder Reranking
-            reranked_chunks = await self.cross_encoder_rerank(query, candidate_chunks)
+            # Repeated or near-duplicate question: serve the cached answer
+            tenant_version = get_tenant_version(tenant_id)
+            with track_stage("accurate", "embed"):
+                query_embedding = await self.embedding_service.embed_query(query)
+            cached = answer_cache.lookup(tenant_id, "accurate", query_embedding, tenant_version)
+            if cached is not None:
+                logger.info("Serving answer from semantic answer cache")
+                return cached
             
-            # Step 4: Contextual Compression
-            compressed_context = await self.context_compression(reranked_chunks)
+            # Steps 1-4: expansion, retrieval, reranking and compression,
+            # run as a dependency graph so independent stages overlap
+            dag = self._accurate_pipeline(query, tenant_id)
             
             # Step 5: Generation with Verification
-            response = await self.generate_with_verification(
-                compressed_context,
-                query,
-                conversation_history
+            dag.stage(
+                "generate",
+                lambda compressed: self.generate_with_verification(compressed, query, conversation_history),
+                deps=["compress"]
             )
+            dag.stage("verify", self.verify_response, deps=["generate", "compress"])
+            results = await dag.run()
+            expanded_queries = self._expanded_queries(query, results)
+            candidate_chunks = results["fuse"]
+            compressed_context = results["compress"]
+            response = results["generate"]
             
             # Step 6: Self-Correction Loop
-            if not await self.verify_response(response, compressed_context):
+            if not results["verify"]:
                 logger.info("Response verification failed, refining query")
                 refined_query = await self.refine_query(query, response)
-                return await self.process_query(refined_query, tenant_id, conversation_history)
+                return await self.process_query(refined_query, tenant_id, conversation_history, conversation_id)
             
-            return {
+            result = {
                 "answer": response["answer"],
                 "sources": response["sources"],
                 "confidence": response["confidence"],
                 "metadata": {
                     "expanded_queries": expanded_queries,
                     "chunks_retrieved": len(candidate_chunks),
-                    "chunks_used": len(compressed_context)
+                    "chunks_used": len(compressed_context),
+                    "stage_timings": dag.timings
                 }
             }
+            answer_cache.store(tenant_id, "accurate", query_embedding, result, tenant_version)
+            return result
             
         except Exception as e:
             logger.error(f"Error in RAG pipeline: {str(e)}")
             raise
     
-    async def query_expansion(
+    async def stream_query(
         self,
         query: str,
-        conversation_history: Optional[List[Dict]] = None
-    ) -> List[str]:
-        """Expand query using multiple techniques"""
-        expanded = [query]
+        tenant_id: int,
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None,
+        rag_mode: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of process_query.
+        Yields a "sources" event once retrieval is done, then one "token" event
+        per LLM chunk, then a "done" event with the full answer and metadata.
+        """
+        tenant_version = get_tenant_version(tenant_id)
+        with track_stage("accurate", "embed"):
+            query_embedding = await self.embedding_service.embed_query(query)
+        cached = answer_cache.lookup(tenant_id, "accurate", query_embedding, tenant_version)
+        if cached is not None:
+            yield {"event": "sources", "data": {"sources": cached["sources"]}}
+            yield {"event": "token", "data": {"content": cached["answer"]}}
+            yield {"event": "done", "data": cached}
+            return
+        
+        dag = self._accurate_pipeline(query, tenant_id)
+        results = await dag.run()
+        compressed_context = results["compress"]
+        sources = self._format_sources(compressed_context)
         
-        # HyDE: Generate hypothetical document
+        yield {"event": "sources", "data": {"sources": sources}}
+        
+        generation_started = time.perf_counter()
+        answer_parts = []
+        async for chunk in self.llm.astream(self._build_generation_prompt(compressed_context, query)):
+            if chunk.content:
+                if not answer_parts:
+                    # Prompt processing until the first token, apart from the whole generation
+                    record_stage("accurate", "first_token", time.perf_counter() - generation_started)
+                answer_parts.append(chunk.content)
+                yield {"event": "token", "data": {"content": chunk.content}}
+        dag.record("generate", generation_started)
+        
+        result = {
+            "answer": "".join(answer_parts),
+            "sources": sources,
+            "confidence": "high",
+            "metadata": {
+                "expanded_queries": self._expanded_queries(query, results),
+                "chunks_retrieved": len(results["fuse"]),
+                "chunks_used": len(compressed_context),
+                "stage_timings": dag.timings
+            }
+        }
+        answer_cache.store(tenant_id, "accurate", query_embedding, result, tenant_version)
+        yield {"event": "done", "data": result}
+    
+    async def _expand_hyde(self, query: str) -> str:
+        """HyDE: Generate hypothetical document"""
         hyde_prompt = ChatPromptTemplate.from_template(
             "Generate a detailed passage that would answer this question: {query}"
         )
         hyde_response = await self.llm.ainvoke(hyde_prompt.format(query=query))
-        expanded.append(hyde_response.content)
-        
-        # Step-back prompting for conceptual queries
+        return hyde_response.content
+    
+    async def _expand_stepback(self, query: str) -> str:
+        """Step-back prompting for conceptual queries"""
         stepback_prompt = ChatPromptTemplate.from_template(
             "What is the broader concept or principle behind this question: {query}"
         )
         stepback_response = await self.llm.ainvoke(stepback_prompt.format(query=query))
-        expanded.append(stepback_response.content)
-        
-        return expanded
+        return stepback_response.content
     
-    async def hybrid_retrieval(
-        self,
-        queries: List[str],
-        tenant_id: int
-    ) -> List[Dict[str, Any]]:
-        """Hybrid search combining vector and keyword search"""
+    def _accurate_pipeline(self, query: str, tenant_id: int) -> PipelineDAG:
+        """
+        Accurate-mode retrieval as a dependency graph. HyDE and step-back run
+        concurrently with retrieval for the raw query, and each expansion is
+        retrieved as soon as it is ready; all rankings are fused before reranking.
+        """
+        dag = PipelineDAG("accurate")
+        dag.stage("collection", lambda: self._get_collection(tenant_id))
+        dag.stage("hyde", lambda: self._expand_hyde(query))
+        dag.stage("stepback", lambda: self._expand_stepback(query))
+        dag.stage(
+            "retrieve_query",
+            lambda collection: self._search_rankings(collection, tenant_id, query),
+            deps=["collection"]
+        )
+        dag.stage(
+            "retrieve_hyde",
+            lambda collection, hyde: self._search_rankings(collection, tenant_id, hyde),
+            deps=["collection", "hyde"]
+        )
+        dag.stage(
+            "retrieve_stepback",
+            lambda collection, stepback: self._search_rankings(collection, tenant_id, stepback),
+            deps=["collection", "stepback"]
+        )
+        dag.stage(
+            "fuse",
+            lambda collection, *retrievals: self._fuse(collection, retrievals),
+            deps=["collection", "retrieve_query", "retrieve_hyde", "retrieve_stepback"]
+        )
+        dag.stage("rerank", lambda candidates: self.cross_encoder_rerank(query, candidates), deps=["fuse"])
+        dag.stage("compress", self.context_compression, deps=["rerank"])
+        return dag
+    
+    @staticmethod
+    def _expanded_queries(query: str, results: Dict[str, Any]) -> List[str]:
+        return [query] + [results[stage] for stage in ("hyde", "stepback") if results[stage]]
+    
+    async def _get_collection(self, tenant_id: int):
         collection_name = f"tenant_{tenant_id}"
-        
         try:
-            collection = self.chroma_client.get_collection(collection_name)
+            return await run_io(self.vector_store.get_collection, tenant_id)
         except:
             logger.warning(f"Collection {collection_name} not found")
+            return None
+    
+    async def _search_rankings(self, collection, tenant_id: int, text: Optional[str]):
+        if collection is None or not text:
+            return [], {}
+        with track_stage("accurate", "embed"):
+            query_embedding = await self.embedding_service.embed_query(text)
+        with track_stage("accurate", "vector_search"):
+            return await search_rankings(collection, tenant_id, text, query_embedding, settings.TOP_K_RETRIEVAL)
+    
+    async def _fuse(self, collection, retrievals) -> List[Dict[str, Any]]:
+        if collection is None:
             return []
-        
-        all_results = []
-        
-        for query in queries:
-            # Vector search
-            query_embedding = self.embeddings.embed_query(query)
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=settings.TOP_K_RETRIEVAL
-            )
-            
-            if results['documents']:
-                for i, doc in enumerate(results['documents'][0]):
-                    all_results.append({
-                        'content': doc,
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'score': results['distances'][0][i] if results['distances'] else 0
-                    })
-        
-        # Deduplicate
-        seen = set()
-        unique_results = []
-        for result in all_results:
-            content_hash = hash(result['content'])
-            if content_hash not in seen:
-                seen.add(content_hash)
-                unique_results.append(result)
-        
-        return unique_results[:settings.TOP_K_RETRIEVAL]
+        return await fuse_retrievals(collection, list(retrievals), settings.TOP_K_RETRIEVAL)
     
     async def cross_encoder_rerank(
         self,
@@ -156,8 +235,7 @@ class RAG2Orchestrator:
         if not candidates:
             return []
         
-        pairs = [[query, c['content']] for c in candidates]
-        scores = self.reranker.predict(pairs)
+        scores = await self.reranker.score(query, candidates)
         
         for i, candidate in enumerate(candidates):
             candidate['rerank_score'] = float(scores[i])
@@ -182,6 +260,15 @@ class RAG2Orchestrator:
     ) -> Dict[str, Any]:
         """Generate response with source verification"""
         
+        response = await self.llm.ainvoke(self._build_generation_prompt(context, query))
+        
+        return {
+            "answer": response.content,
+            "sources": self._format_sources(context),
+            "confidence": "high"  # Implement confidence scoring
+        }
+    
+    def _build_generation_prompt(self, context: List[Dict[str, Any]], query: str) -> str:
         context_text = "\n\n".join([
             f"Source {i+1}:\n{chunk['content']}"
             for i, chunk in enumerate(context)
@@ -203,21 +290,19 @@ Provide a detailed answer with:
 
 Answer:""")
         
-        response = await self.llm.ainvoke(
-            prompt.format(context=context_text, query=query)
-        )
-        
-        return {
-            "answer": response.content,
-            "sources": [
-                {
-                    "content": chunk['content'][:200] + "...",
-                    "metadata": chunk.get('metadata', {})
-                }
-                for chunk in context
-            ],
-            "confidence": "high"  # Implement confidence scoring
-        }
+        return prompt.format(context=context_text, query=query)
+    
+    def _format_sources(self, context: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # chunk_id and score let chat.py store sources as compact references
+        return [
+            {
+                "chunk_id": chunk.get('id'),
+                "score": chunk.get('rerank_score', chunk.get('score')),
+                "content": chunk['content'][:200] + "...",
+                "metadata": chunk.get('metadata', {})
+            }
+            for chunk in context
+        ]
     
     async def verify_response(
         self,
@@ -1,4 +1,4 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 try:
     from langchain.text_splitter import RecursiveCharacterTextSplitter
 except ImportError:
@@ -9,25 +9,35 @@ try:
 except ImportError:
     from langchain.llms import Ollama
 
-try:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-except ImportError:
-    from langchain.embeddings import HuggingFaceEmbeddings
-
 try:
     from langchain.prompts import ChatPromptTemplate
 except ImportError:
     from langchain_core.prompts import ChatPromptTemplate
 
-from sentence_transformers import CrossEncoder
-import chromadb
-from chromadb.config import Settings as ChromaSettings
 import logging
+import time
 
 from app.core.config import settings
+from app.core.answer_cache import answer_cache
+from app.core.context_cache import context_cache
+from app.core.embedding_service import get_embedding_service
+from app.core.executors import io_executor, run_io
+from app.core.metrics import record_stage, track_stage
+from app.core.model_registry import registry
+from app.core.pipeline_dag import PipelineDAG
+from app.core.reranker import get_reranker
+from app.core.retrieval import fuse_retrievals, hybrid_search, search_rankings
+from app.core.tenant_versions import get_tenant_version
+from app.core.vector_store import get_vector_store
 
 logger = logging.getLogger(__name__)
 
+registry.register("ollama_llm", lambda: Ollama(
+    model="llama3.1:8b",  # or "mistral:7b"
+    base_url="http://localhost:11434",
+    temperature=0.7
+))
+
 class RAG2OrchestratorLocal:
     """
     Local RAG 2.0 Pipeline - No Cloud Dependencies
@@ -36,34 +46,21 @@ class RAG2OrchestratorLocal:
     """
     
     def __init__(self):
-        # Local embeddings (runs on your machine)
-        logger.info("Initializing local embedding model...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Local embeddings (runs on your machine), shared with document ingestion
+        # so concurrent queries and uploads are batched together
+        self.embedding_service = get_embedding_service()
         
         # Local LLM via Ollama
-        logger.info("Initializing local LLM (Ollama)...")
-        self.llm = Ollama(
-            model="llama3.1:8b",  # or "mistral:7b"
-            base_url="http://localhost:11434",
-            temperature=0.7
-        )
+        self.llm = registry.get("ollama_llm")
         
         # Local reranker
-        logger.info("Initializing reranker...")
-        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        self.reranker = get_reranker()
         
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(
-            path=settings.CHROMA_PERSIST_DIR,
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
+        # Vector store: ChromaDB or memory-mapped NumPy segments (VECTOR_STORE_BACKEND)
+        self.vector_store = get_vector_store()
         
         # Conversation context cache for faster follow-up questions
-        self.context_cache = {}  # {conversation_id: {chunks, timestamp}}
+        self.context_cache = context_cache
         
         logger.info("✅ Local RAG 2.0 pipeline initialized successfully")
     
@@ -72,43 +69,53 @@ class RAG2OrchestratorLocal:
         query: str,
         tenant_id: int,
         conversation_history: Optional[List[Dict]] = None,
-        conversation_id: Optional[int] = None
+        conversation_id: Optional[int] = None,
+        rag_mode: Optional[str] = None
     ) -> Dict[str, Any]:
         """Main RAG 2.0 pipeline orchestration - fully local"""
         try:
-            logger.info(f"Processing query: {query[:50]}... (mode: {settings.RAG_MODE})")
-            
-            # Fast Mode: Skip expensive operations for 5-15 second responses
-            if settings.RAG_MODE == "fast":
-                return await self.process_query_fast(query, tenant_id, conversation_history, conversation_id)
-            
-            # Accurate Mode: Full RAG 2.0 pipeline
-            # Step 1: Query Understanding & Expansion
-            expanded_queries = await self.query_expansion(query, conversation_history)
+            mode = rag_mode or settings.RAG_MODE
+            logger.info(f"Processing query: {query[:50]}... (mode: {mode})")
             
-            # Step 2: Multi-Stage Retrieval
-            candidate_chunks = await self.hybrid_retrieval(expanded_queries, tenant_id)
+            # Repeated or near-duplicate question: serve the cached answer
+            tenant_version = get_tenant_version(tenant_id)
+            with track_stage(mode, "embed"):
+                query_embedding = await self.embedding_service.embed_query(query)
+            cached = answer_cache.lookup(tenant_id, mode, query_embedding, tenant_version)
+            if cached is not None:
+                logger.info("Serving answer from semantic answer cache")
+                return cached
             
-            # Step 3: Cross-Encoder Reranking
-            reranked_chunks = await self.cross_encoder_rerank(query, candidate_chunks)
+            # Fast Mode: Skip expensive operations for 5-15 second responses
+            if mode == "fast":
+                response = await self.process_query_fast(query, tenant_id, conversation_history, conversation_id)
+                answer_cache.store(tenant_id, mode, query_embedding, response, tenant_version)
+                return response
             
-            # Step 4: Contextual Compression
-            compressed_context = await self.context_compression(reranked_chunks)
+            # Accurate Mode: Full RAG 2.0 pipeline as a dependency graph
+            # Steps 1-4: expansion, retrieval, reranking and compression
+            dag = self._accurate_pipeline(query, tenant_id)
             
             # Step 5: Generation with Verification
-            response = await self.generate_with_verification(
-                compressed_context,
-                query,
-                conversation_history
+            dag.stage(
+                "generate",
+                lambda compressed: self.generate_with_verification(compressed, query, conversation_history),
+                deps=["compress"]
             )
+            dag.stage("verify", self.verify_response, deps=["generate", "compress"])
+            results = await dag.run()
+            expanded_queries = self._expanded_queries(query, results)
+            candidate_chunks = results["fuse"]
+            compressed_context = results["compress"]
+            response = results["generate"]
             
             # Step 6: Self-Correction Loop
-            if not await self.verify_response(response, compressed_context):
+            if not results["verify"]:
                 logger.info("Response verification failed, refining query")
                 refined_query = await self.refine_query(query, response)
-                return await self.process_query(refined_query, tenant_id, conversation_history)
+                return await self.process_query(refined_query, tenant_id, conversation_history, conversation_id, mode)
             
-            return {
+            result = {
                 "answer": response["answer"],
                 "sources": response["sources"],
                 "confidence": response["confidence"],
@@ -117,9 +124,12 @@ class RAG2OrchestratorLocal:
                     "chunks_retrieved": len(candidate_chunks),
                     "chunks_used": len(compressed_context),
                     "model": "local-llama3.1-8b",
-                    "mode": "accurate"
+                    "mode": "accurate",
+                    "stage_timings": dag.timings
                 }
             }
+            answer_cache.store(tenant_id, mode, query_embedding, result, tenant_version)
+            return result
             
         except Exception as e:
             logger.error(f"Error in RAG pipeline: {str(e)}")
@@ -134,158 +144,256 @@ class RAG2OrchestratorLocal:
     ) -> Dict[str, Any]:
         """Fast mode: Direct retrieval + generation (5-15 seconds) with context caching"""
         try:
-            # Check cache for recent context (reuse for follow-up questions)
-            cache_key = f"{tenant_id}_{conversation_id}" if conversation_id else None
-            cached_context = None
-            
-            if cache_key and cache_key in self.context_cache:
-                cache_entry = self.context_cache[cache_key]
-                # Use cache if less than 5 minutes old
-                import time
-                if time.time() - cache_entry['timestamp'] < 300:
-                    cached_context = cache_entry['chunks']
-                    logger.info("Using cached context for faster response")
+            retrieval = await self._retrieve_fast(query, tenant_id, conversation_id)
+            if retrieval is None:
+                return self._no_documents_response()
             
-            # Get collection for tenant
-            collection_name = f"tenant_{tenant_id}"
-            try:
-                collection = self.chroma_client.get_collection(collection_name)
-            except:
-                logger.warning(f"Collection {collection_name} not found")
-                return {
-                    "answer": "I don't have any documents to search through yet. Please upload some documents first.",
-                    "sources": [],
-                    "confidence": 0.0,
-                    "metadata": {"mode": "fast", "error": "no_documents"}
-                }
-            
-            # Use cached context or retrieve new
-            if cached_context:
-                results = {'documents': [cached_context], 'metadatas': [[{'cached': True}] * len(cached_context)]}
-            else:
-                # Simple vector search (no expansion, no reranking)
-                query_embedding = self.embeddings.embed_query(query)
-                results = collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=settings.RERANK_TOP_K
-                )
-                
-                # Cache the results
-                if cache_key and results['documents'] and len(results['documents'][0]) > 0:
-                    import time
-                    self.context_cache[cache_key] = {
-                        'chunks': results['documents'][0],
-                        'timestamp': time.time()
-                    }
-            
-            # Build context from top results
-            context_parts = []
-            sources = []
-            
-            if results['documents'] and len(results['documents'][0]) > 0:
-                for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
-                    context_parts.append(f"[Source {i+1}]: {doc}")
-                    sources.append({
-                        "content": doc[:200] + "..." if len(doc) > 200 else doc,
-                        "metadata": metadata
-                    })
-            
-            context = "\n\n".join(context_parts)
-            
-            # Simple prompt without verification
-            prompt = f"""Based on the following context, answer the question concisely and accurately.
-
-Context:
-{context}
-
-Question: {query}
-
-Answer:"""
+            prompt, sources = retrieval
             
             # Generate answer
-            answer = self.llm.invoke(prompt)
+            with track_stage("fast", "generate"):
+                answer = await run_io(self.llm.invoke, prompt)
             
             return {
                 "answer": answer,
                 "sources": sources,
                 "confidence": 0.85,
-                "metadata": {
-                    "chunks_retrieved": len(sources),
-                    "chunks_used": len(sources),
-                    "model": "local-llama3.1-8b",
-                    "mode": "fast"
-                }
+                "metadata": self._fast_metadata(sources)
             }
             
         except Exception as e:
             logger.error(f"Error in fast query: {str(e)}")
             raise
     
-    async def query_expansion(
+    async def stream_query(
         self,
         query: str,
-        conversation_history: Optional[List[Dict]] = None
-    ) -> List[str]:
-        """Expand query using local LLM"""
-        expanded = [query]
+        tenant_id: int,
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None,
+        rag_mode: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of process_query.
+        Yields a "sources" event once retrieval is done, then one "token" event
+        per LLM chunk, then a "done" event with the full answer and metadata.
+        """
+        mode = rag_mode or settings.RAG_MODE
         
-        try:
-            # HyDE: Generate hypothetical document
-            hyde_prompt = f"Generate a detailed passage that would answer this question: {query}"
-            hyde_response = self.llm.invoke(hyde_prompt)
-            expanded.append(hyde_response)
-            
-            # Step-back prompting
-            stepback_prompt = f"What is the broader concept or principle behind this question: {query}"
-            stepback_response = self.llm.invoke(stepback_prompt)
-            expanded.append(stepback_response)
-        except Exception as e:
-            logger.warning(f"Query expansion failed: {e}, using original query only")
+        tenant_version = get_tenant_version(tenant_id)
+        with track_stage(mode, "embed"):
+            query_embedding = await self.embedding_service.embed_query(query)
+        cached = answer_cache.lookup(tenant_id, mode, query_embedding, tenant_version)
+        if cached is not None:
+            yield {"event": "sources", "data": {"sources": cached["sources"]}}
+            yield {"event": "token", "data": {"content": cached["answer"]}}
+            yield {"event": "done", "data": cached}
+            return
+        
+        if mode == "fast":
+            retrieval = await self._retrieve_fast(query, tenant_id, conversation_id)
+            if retrieval is None:
+                response = self._no_documents_response()
+                yield {"event": "sources", "data": {"sources": []}}
+                yield {"event": "token", "data": {"content": response["answer"]}}
+                yield {"event": "done", "data": response}
+                return
+            prompt, sources = retrieval
+            confidence = 0.85
+            metadata = self._fast_metadata(sources)
+        else:
+            dag = self._accurate_pipeline(query, tenant_id)
+            results = await dag.run()
+            compressed_context = results["compress"]
+            prompt = self._build_generation_prompt(compressed_context, query)
+            sources = self._format_sources(compressed_context)
+            confidence = "high"
+            metadata = {
+                "expanded_queries": self._expanded_queries(query, results),
+                "chunks_retrieved": len(results["fuse"]),
+                "chunks_used": len(compressed_context),
+                "model": "local-llama3.1-8b",
+                "mode": "accurate",
+                "stage_timings": dag.timings
+            }
+        
+        yield {"event": "sources", "data": {"sources": sources}}
+        
+        generation_started = time.perf_counter()
+        answer_parts = []
+        async for token in self._astream_llm(prompt):
+            if not answer_parts:
+                # Prompt processing until the first token, apart from the whole generation
+                record_stage(mode, "first_token", time.perf_counter() - generation_started)
+            answer_parts.append(token)
+            yield {"event": "token", "data": {"content": token}}
+        if mode != "fast":
+            dag.record("generate", generation_started)
+        else:
+            record_stage(mode, "generate", time.perf_counter() - generation_started)
         
-        return expanded
+        result = {
+            "answer": "".join(answer_parts),
+            "sources": sources,
+            "confidence": confidence,
+            "metadata": metadata
+        }
+        answer_cache.store(tenant_id, mode, query_embedding, result, tenant_version)
+        yield {"event": "done", "data": result}
     
-    async def hybrid_retrieval(
+    async def _retrieve_fast(
         self,
-        queries: List[str],
-        tenant_id: int
-    ) -> List[Dict[str, Any]]:
-        """Hybrid search using local embeddings"""
+        query: str,
+        tenant_id: int,
+        conversation_id: Optional[int] = None
+    ) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """Fast-mode retrieval. Returns (prompt, sources), or None if the tenant has no documents"""
+        # Get collection for tenant
         collection_name = f"tenant_{tenant_id}"
-        
         try:
-            collection = self.chroma_client.get_collection(collection_name)
+            collection = await run_io(self.vector_store.get_collection, tenant_id)
         except:
             logger.warning(f"Collection {collection_name} not found")
-            return []
+            return None
         
-        all_results = []
+        with track_stage("fast", "embed"):
+            query_embedding = await self.embedding_service.embed_query(query)
+        tenant_version = get_tenant_version(tenant_id)
         
-        for query in queries:
-            # Generate embedding locally
-            query_embedding = self.embeddings.embed_query(query)
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=settings.TOP_K_RETRIEVAL
-            )
+        # Reuse the conversation's recent context if this is a related follow-up
+        cached_context = None
+        if conversation_id:
+            cached_context = self.context_cache.get(tenant_id, conversation_id, query_embedding, tenant_version)
+        
+        if cached_context:
+            logger.info("Using cached context for faster response")
+            results = cached_context
+        else:
+            # Single hybrid search (no expansion, no reranking)
+            with track_stage("fast", "vector_search"):
+                results = await hybrid_search(collection, tenant_id, query, query_embedding, settings.RERANK_TOP_K)
             
-            if results['documents']:
-                for i, doc in enumerate(results['documents'][0]):
-                    all_results.append({
-                        'content': doc,
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'score': results['distances'][0][i] if results['distances'] else 0
-                    })
+            if conversation_id and results:
+                self.context_cache.set(tenant_id, conversation_id, query_embedding, results, tenant_version)
+        
+        # Build context from top results
+        context_parts = []
+        sources = []
+        
+        for i, result in enumerate(results):
+            doc = result['content']
+            context_parts.append(f"[Source {i+1}]: {doc}")
+            # chunk_id and score let chat.py store sources as compact references
+            sources.append({
+                "chunk_id": result.get('id'),
+                "score": result.get('score'),
+                "content": doc[:200] + "..." if len(doc) > 200 else doc,
+                "metadata": result.get('metadata', {})
+            })
         
-        # Deduplicate
-        seen = set()
-        unique_results = []
-        for result in all_results:
-            content_hash = hash(result['content'])
-            if content_hash not in seen:
-                seen.add(content_hash)
-                unique_results.append(result)
+        context = "\n\n".join(context_parts)
+        
+        # Simple prompt without verification
+        prompt = f"""Based on the following context, answer the question concisely and accurately.
+
+Context:
+{context}
+
+Question: {query}
+
+Answer:"""
         
-        return unique_results[:settings.TOP_K_RETRIEVAL]
+        return prompt, sources
+    
+    def _no_documents_response(self) -> Dict[str, Any]:
+        return {
+            "answer": "I don't have any documents to search through yet. Please upload some documents first.",
+            "sources": [],
+            "confidence": 0.0,
+            "metadata": {"mode": "fast", "error": "no_documents"}
+        }
+    
+    def _fast_metadata(self, sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "chunks_retrieved": len(sources),
+            "chunks_used": len(sources),
+            "model": "local-llama3.1-8b",
+            "mode": "fast"
+        }
+    
+    async def _astream_llm(self, prompt: str) -> AsyncIterator[str]:
+        """Stream Ollama tokens from a worker thread without blocking the event loop"""
+        async for token in io_executor.iterate(lambda: self.llm.stream(prompt)):
+            yield token
+    
+    async def _expand_hyde(self, query: str) -> str:
+        """HyDE: Generate hypothetical document"""
+        hyde_prompt = f"Generate a detailed passage that would answer this question: {query}"
+        return await run_io(self.llm.invoke, hyde_prompt)
+    
+    async def _expand_stepback(self, query: str) -> str:
+        """Step-back prompting"""
+        stepback_prompt = f"What is the broader concept or principle behind this question: {query}"
+        return await run_io(self.llm.invoke, stepback_prompt)
+    
+    def _accurate_pipeline(self, query: str, tenant_id: int) -> PipelineDAG:
+        """
+        Accurate-mode retrieval as a dependency graph. HyDE and step-back run
+        concurrently with retrieval for the raw query, and each expansion is
+        retrieved as soon as it is ready; all rankings are fused before reranking.
+        """
+        dag = PipelineDAG("accurate")
+        dag.stage("collection", lambda: self._get_collection(tenant_id))
+        dag.stage("hyde", lambda: self._expand_hyde(query), optional=True)
+        dag.stage("stepback", lambda: self._expand_stepback(query), optional=True)
+        dag.stage(
+            "retrieve_query",
+            lambda collection: self._search_rankings(collection, tenant_id, query),
+            deps=["collection"]
+        )
+        dag.stage(
+            "retrieve_hyde",
+            lambda collection, hyde: self._search_rankings(collection, tenant_id, hyde),
+            deps=["collection", "hyde"]
+        )
+        dag.stage(
+            "retrieve_stepback",
+            lambda collection, stepback: self._search_rankings(collection, tenant_id, stepback),
+            deps=["collection", "stepback"]
+        )
+        dag.stage(
+            "fuse",
+            lambda collection, *retrievals: self._fuse(collection, retrievals),
+            deps=["collection", "retrieve_query", "retrieve_hyde", "retrieve_stepback"]
+        )
+        dag.stage("rerank", lambda candidates: self.cross_encoder_rerank(query, candidates), deps=["fuse"])
+        dag.stage("compress", self.context_compression, deps=["rerank"])
+        return dag
+    
+    @staticmethod
+    def _expanded_queries(query: str, results: Dict[str, Any]) -> List[str]:
+        return [query] + [results[stage] for stage in ("hyde", "stepback") if results[stage]]
+    
+    async def _get_collection(self, tenant_id: int):
+        collection_name = f"tenant_{tenant_id}"
+        try:
+            return await run_io(self.vector_store.get_collection, tenant_id)
+        except:
+            logger.warning(f"Collection {collection_name} not found")
+            return None
+    
+    async def _search_rankings(self, collection, tenant_id: int, text: Optional[str]):
+        if collection is None or not text:
+            return [], {}
+        with track_stage("accurate", "embed"):
+            query_embedding = await self.embedding_service.embed_query(text)
+        with track_stage("accurate", "vector_search"):
+            return await search_rankings(collection, tenant_id, text, query_embedding, settings.TOP_K_RETRIEVAL)
+    
+    async def _fuse(self, collection, retrievals) -> List[Dict[str, Any]]:
+        if collection is None:
+            return []
+        return await fuse_retrievals(collection, list(retrievals), settings.TOP_K_RETRIEVAL)
     
     async def cross_encoder_rerank(
         self,
@@ -296,8 +404,7 @@ Answer:"""
         if not candidates:
             return []
         
-        pairs = [[query, c['content']] for c in candidates]
-        scores = self.reranker.predict(pairs)
+        scores = await self.reranker.score(query, candidates)
         
         for i, candidate in enumerate(candidates):
             candidate['rerank_score'] = float(scores[i])
@@ -320,12 +427,31 @@ Answer:"""
     ) -> Dict[str, Any]:
         """Generate response using local LLM"""
         
+        prompt = self._build_generation_prompt(context, query)
+        
+        try:
+            response_text = await run_io(self.llm.invoke, prompt)
+            
+            return {
+                "answer": response_text,
+                "sources": self._format_sources(context),
+                "confidence": "high"
+            }
+        except Exception as e:
+            logger.error(f"Generation failed: {e}")
+            return {
+                "answer": "I apologize, but I encountered an error generating the response.",
+                "sources": [],
+                "confidence": "low"
+            }
+    
+    def _build_generation_prompt(self, context: List[Dict[str, Any]], query: str) -> str:
         context_text = "\n\n".join([
             f"Source {i+1}:\n{chunk['content']}"
             for i, chunk in enumerate(context)
         ])
         
-        prompt = f"""You are an expert AI assistant. Answer the question based on the provided context.
+        return f"""You are an expert AI assistant. Answer the question based on the provided context.
 Be precise, cite sources, and indicate confidence level.
 
 Context:
@@ -339,28 +465,18 @@ Provide a detailed answer with:
 3. Confidence level (high/medium/low)
 
 Answer:"""
-        
-        try:
-            response_text = self.llm.invoke(prompt)
-            
-            return {
-                "answer": response_text,
-                "sources": [
-                    {
-                        "content": chunk['content'][:200] + "...",
-                        "metadata": chunk.get('metadata', {})
-                    }
-                    for chunk in context
-                ],
-                "confidence": "high"
-            }
-        except Exception as e:
-            logger.error(f"Generation failed: {e}")
-            return {
-                "answer": "I apologize, but I encountered an error generating the response.",
-                "sources": [],
-                "confidence": "low"
+    
+    def _format_sources(self, context: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # chunk_id and score let chat.py store sources as compact references
+        return [
+            {
+                "chunk_id": chunk.get('id'),
+                "score": chunk.get('rerank_score', chunk.get('score')),
+                "content": chunk['content'][:200] + "...",
+                "metadata": chunk.get('metadata', {})
             }
+            for chunk in context
+        ]
     
     async def verify_response(
         self,
@@ -376,7 +492,7 @@ Answer:"""
         """Refine query if verification fails"""
         try:
             prompt = f"Rephrase this query to be more specific: {original_query}"
-            refined = self.llm.invoke(prompt)
+            refined = await run_io(self.llm.invoke, prompt)
             return refined
         except:
             return original_query
@@ -0,0 +1,213 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import logging
+import threading
+import time
+
+import numpy as np
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.executors import run_cpu
+from app.core.model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+# Pairs scored by every backend at load time and compared with fp32 PyTorch
+_CHECK_PAIRS = [
+    ("How many vacation days do employees get?", "Full-time employees accrue 25 days of paid vacation per year."),
+    ("How many vacation days do employees get?", "The cafeteria is open from 8am to 3pm on weekdays."),
+    ("What is the VPN setup process?", "Install the client, sign in with SSO and select the nearest gateway."),
+    ("What is the VPN setup process?", "Quarterly revenue grew 12% compared with the previous year."),
+    ("Who approves travel expenses?", "Travel expenses above $500 must be approved by the department head."),
+    ("Who approves travel expenses?", "Passwords must be rotated every 90 days and may not be reused."),
+    ("When is the security training due?", "All staff must complete security awareness training by March 31."),
+    ("When is the security training due?", "Parking permits are issued by the facilities team on request."),
+]
+
+def _sigmoid(logits: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-logits))
+
+def _load_torch(model_name: str) -> Callable[[List[Tuple[str, str]]], np.ndarray]:
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name)
+    return lambda pairs: model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+def _load_quantized(model_name: str) -> Callable[[List[Tuple[str, str]]], np.ndarray]:
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name, device="cpu")
+    # int8 weights for every Linear layer, activations quantized on the fly
+    model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return lambda pairs: model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+def _load_onnx(model_name: str) -> Callable[[List[Tuple[str, str]]], np.ndarray]:
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise RuntimeError("RERANKER_BACKEND=onnx requires optimum[onnxruntime]")
+
+    model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def predict(pairs: List[Tuple[str, str]]) -> np.ndarray:
+        features = tokenizer(
+            [query for query, _ in pairs],
+            [text for _, text in pairs],
+            padding=True,
+            truncation="longest_first",
+            max_length=512,
+            return_tensors="np"
+        )
+        logits = np.asarray(model(**features).logits, dtype=np.float32)
+        # Same activation CrossEncoder applies to single-label models
+        return _sigmoid(logits[:, 0])
+
+    return predict
+
+_LOADERS = {
+    "torch": _load_torch,
+    "quantized": _load_quantized,
+    "onnx": _load_onnx,
+}
+
+class Reranker:
+    """
+    Cross-encoder scoring with a selectable execution backend.
+
+    RERANKER_BACKEND picks fp32 PyTorch ("torch"), int8 dynamically quantized
+    PyTorch ("quantized") or ONNX Runtime ("onnx"). A non-torch backend is
+    checked against fp32 PyTorch scores on a fixed set of pairs when it loads
+    and falls back to PyTorch if any score differs by more than
+    RERANKER_MAX_SCORE_DIFF. Pairs are sorted by length before being cut into
+    batches so each batch pads to a similar length, and scores are cached per
+    (query, chunk) so repeated queries skip inference.
+    """
+
+    def __init__(self, model_name: str, backend: str):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown reranker backend: {backend} (expected one of {', '.join(BACKENDS)})")
+        self.model_name = model_name
+        self.batch_size = settings.RERANKER_BATCH_SIZE
+        self.verification: Optional[Dict[str, Any]] = None
+        self.backend, self._predict = self._load(backend)
+        self._cache = TTLCache(
+            max_entries=settings.RERANKER_SCORE_CACHE_SIZE,
+            ttl_seconds=settings.RERANKER_SCORE_CACHE_TTL_SECONDS
+        ) if settings.RERANKER_SCORE_CACHE_SIZE > 0 else None
+        self._lock = threading.Lock()
+        self.pairs_scored = 0
+        self.batches = 0
+        self.inference_seconds = 0.0
+
+    def _load(self, backend: str) -> Tuple[str, Callable[[List[Tuple[str, str]]], np.ndarray]]:
+        logger.info(f"Loading reranker {self.model_name} ({backend})")
+        predict = _LOADERS[backend](self.model_name)
+        if backend == "torch" or not settings.RERANKER_VERIFY:
+            return backend, predict
+
+        reference = _load_torch(self.model_name)
+        self.verification = compare_scores(reference, predict, _CHECK_PAIRS)
+        self.verification["backend"] = backend
+        if self.verification["max_abs_diff"] > settings.RERANKER_MAX_SCORE_DIFF:
+            logger.warning(
+                f"Reranker backend {backend} differs from PyTorch by "
+                f"{self.verification['max_abs_diff']:.4f}, falling back to torch"
+            )
+            self.verification["accepted"] = False
+            return "torch", reference
+        self.verification["accepted"] = True
+        logger.info(f"Reranker backend {backend} verified (max score diff {self.verification['max_abs_diff']:.4f})")
+        return backend, predict
+
+    def predict(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """Score (query, text) pairs, batching them by length; blocking"""
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        if not pairs:
+            return scores
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        started = time.perf_counter()
+        batches = 0
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            scores[indices] = self._predict([pairs[i] for i in indices])
+            batches += 1
+        with self._lock:
+            self.pairs_scored += len(pairs)
+            self.batches += batches
+            self.inference_seconds += time.perf_counter() - started
+        return scores
+
+    async def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        """Relevance score of each candidate chunk for the query"""
+        keys = [self._key(query, candidate) for candidate in candidates]
+        scores: List[Optional[float]] = [
+            self._cache.get(key) if self._cache is not None else None
+            for key in keys
+        ]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            predicted = await run_cpu(self.predict, [(query, candidates[i]['content']) for i in missing])
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                if self._cache is not None:
+                    self._cache.set(keys[i], scores[i])
+        return scores
+
+    @staticmethod
+    def _key(query: str, candidate: Dict[str, Any]) -> Tuple[str, str, str]:
+        # The content hash keeps a reused chunk id from returning a stale score
+        digest = hashlib.sha256(candidate['content'].encode("utf-8")).hexdigest()[:16]
+        return query, str(candidate.get('id', '')), digest
+
+    def warm_up(self):
+        self._predict([("warm-up", "warm-up")])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "model": self.model_name,
+                "backend": self.backend,
+                "pairs_scored": self.pairs_scored,
+                "batches": self.batches,
+                "avg_ms_per_pair": self.inference_seconds * 1000 / self.pairs_scored if self.pairs_scored else 0.0
+            }
+        if self._cache is not None:
+            stats["score_cache"] = self._cache.stats()
+        if self.verification is not None:
+            stats["verification"] = self.verification
+        return stats
+
+def compare_scores(
+    reference: Callable[[List[Tuple[str, str]]], np.ndarray],
+    candidate: Callable[[List[Tuple[str, str]]], np.ndarray],
+    pairs: List[Tuple[str, str]]
+) -> Dict[str, Any]:
+    """Score differences of a backend against a reference backend on the same pairs"""
+    expected = np.asarray(reference(pairs), dtype=np.float32)
+    actual = np.asarray(candidate(pairs), dtype=np.float32)
+    return {
+        "pairs": len(pairs),
+        "max_abs_diff": float(np.max(np.abs(expected - actual))),
+        "mean_abs_diff": float(np.mean(np.abs(expected - actual))),
+        "same_order": bool(np.array_equal(np.argsort(-expected), np.argsort(-actual)))
+    }
+
+def get_reranker() -> Reranker:
+    """Process-wide reranker shared by both orchestrators"""
+    return registry.get("reranker")
+
+def reranker_stats() -> Optional[Dict[str, Any]]:
+    """Stats of the reranker if it has been loaded"""
+    return get_reranker().stats() if registry.is_loaded("reranker") else None
+
+registry.register(
+    "reranker",
+    lambda: Reranker(settings.RERANKER_MODEL, settings.RERANKER_BACKEND),
+    warm_up=Reranker.warm_up
+)
@@ -0,0 +1,112 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.executors import run_io
+from app.core.keyword_index import keyword_index
+
+logger = logging.getLogger(__name__)
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: Optional[int] = None) -> Dict[str, float]:
+    """Fuse ranked id lists: score(id) = sum over lists of 1 / (k + rank)"""
+    k = k if k is not None else settings.RRF_K
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
+
+async def hybrid_search(
+    collection,
+    tenant_id: int,
+    query: str,
+    query_embedding: List[float],
+    n_results: int
+) -> List[Dict[str, Any]]:
+    """
+    Vector search and BM25 keyword search for one query, run concurrently and
+    merged by reciprocal rank fusion. Returns [{id, content, metadata, score}]
+    best first, deduplicated by chunk id, where score is the fused RRF score.
+    """
+    rankings, chunks = await search_rankings(collection, tenant_id, query, query_embedding, n_results)
+    return await fuse_rankings(collection, rankings, chunks, n_results)
+
+async def search_rankings(
+    collection,
+    tenant_id: int,
+    query: str,
+    query_embedding: List[float],
+    n_results: int
+) -> Tuple[List[List[str]], Dict[str, Dict[str, Any]]]:
+    """
+    Unfused first half of hybrid_search: returns the vector and keyword rankings
+    (lists of chunk ids) and the chunks the vector search returned.
+    """
+    vector_search = run_io(
+        collection.query,
+        query_embeddings=[query_embedding],
+        n_results=n_results
+    )
+    rankings: List[List[str]] = []
+    if not settings.HYBRID_SEARCH_ENABLED:
+        vector_results = await vector_search
+    else:
+        vector_results, keyword_hits = await asyncio.gather(
+            vector_search,
+            run_io(keyword_index.search, tenant_id, query, n_results, collection),
+            return_exceptions=True
+        )
+        if isinstance(vector_results, BaseException):
+            raise vector_results
+        if isinstance(keyword_hits, BaseException):
+            logger.warning(f"Keyword search failed, using vector results only: {str(keyword_hits)}")
+        else:
+            rankings.append([chunk_id for chunk_id, _ in keyword_hits])
+
+    chunks: Dict[str, Dict[str, Any]] = {}
+    ids = (vector_results.get("ids") or [[]])[0]
+    for i, chunk_id in enumerate(ids):
+        chunks[chunk_id] = {
+            "id": chunk_id,
+            "content": vector_results["documents"][0][i],
+            "metadata": vector_results["metadatas"][0][i] if vector_results.get("metadatas") else {}
+        }
+    return [ids] + rankings, chunks
+
+async def fuse_retrievals(
+    collection,
+    retrievals: List[Tuple[List[List[str]], Dict[str, Dict[str, Any]]]],
+    n_results: int
+) -> List[Dict[str, Any]]:
+    """Fuse several search_rankings results, e.g. ones that ran as separate pipeline stages"""
+    rankings: List[List[str]] = []
+    chunks: Dict[str, Dict[str, Any]] = {}
+    for retrieval_rankings, retrieval_chunks in retrievals:
+        rankings.extend(retrieval_rankings)
+        chunks.update(retrieval_chunks)
+    return await fuse_rankings(collection, rankings, chunks, n_results)
+
+async def fuse_rankings(
+    collection,
+    rankings: List[List[str]],
+    chunks: Dict[str, Dict[str, Any]],
+    n_results: int
+) -> List[Dict[str, Any]]:
+    """Second half of hybrid_search: RRF-merge rankings and load the top chunks"""
+    fused = reciprocal_rank_fusion(rankings)
+    top_ids = list(fused)[:n_results]
+
+    # Chunks found only by keyword search still need their text
+    missing = [chunk_id for chunk_id in top_ids if chunk_id not in chunks]
+    if missing:
+        fetched = await run_io(collection.get, ids=missing, include=["documents", "metadatas"])
+        chunks = dict(chunks)
+        for chunk_id, content, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+            chunks[chunk_id] = {"id": chunk_id, "content": content, "metadata": metadata or {}}
+
+    return [
+        {**chunks[chunk_id], "score": fused[chunk_id]}
+        for chunk_id in top_ids
+        if chunk_id in chunks  # deleted between index lookup and fetch
+    ]
@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Optional
+import logging
+
+from app.core.executors import run_io
+from app.core.vector_store import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CHARS = 200
+
+def chunk_id_for(metadata: Dict[str, Any]) -> Optional[str]:
+    """
+    Vector store id of the chunk a source's metadata describes, for sources
+    built without one (message rows stored before sources carried their ids).
+    Content-defined chunks are named by content hash and occurrence; occurrence
+    0 has the same text as any other occurrence. Older chunks were named by
+    position.
+    """
+    document_id = metadata.get("document_id")
+    if document_id is None:
+        return None
+    if metadata.get("content_hash"):
+        return f"doc_{document_id}_{metadata['content_hash']}_0"
+    if metadata.get("chunk_index") is not None:
+        return f"doc_{document_id}_chunk_{metadata['chunk_index']}"
+    return None
+
+def compact_sources(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    What an assistant Message stores for its sources: chunk id, document id and
+    score. The chunk text and metadata stay in the vector store and are looked
+    up by resolve_sources when the message is read.
+    """
+    refs = []
+    for source in sources:
+        metadata = source.get("metadata") or {}
+        chunk_id = source.get("chunk_id") or chunk_id_for(metadata)
+        if chunk_id is None:
+            # Nothing to resolve it from later, keep it as it is
+            refs.append(source)
+            continue
+        score = source.get("score")
+        refs.append({
+            "chunk_id": chunk_id,
+            "document_id": metadata.get("document_id"),
+            "score": round(float(score), 4) if score is not None else None
+        })
+    return refs
+
+async def resolve_sources(sources_per_message: List[List[Dict[str, Any]]], tenant_id: int) -> List[List[Dict[str, Any]]]:
+    """
+    Expand stored references into sources with a content preview and the chunk
+    metadata, for a whole page of messages with one vector store lookup.
+    Chunks that no longer exist (document deleted or re-indexed) keep content None.
+    """
+    chunk_ids = list({
+        source["chunk_id"]
+        for sources in sources_per_message
+        for source in sources or []
+        if "chunk_id" in source and "content" not in source
+    })
+    chunks: Dict[str, Dict[str, Any]] = {}
+    if chunk_ids:
+        try:
+            collection = await run_io(get_vector_store().get_collection, tenant_id)
+            found = await run_io(collection.get, ids=chunk_ids, include=["documents", "metadatas"])
+            for chunk_id, content, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                chunks[chunk_id] = {
+                    "content": content[:PREVIEW_CHARS] + "..." if len(content) > PREVIEW_CHARS else content,
+                    "metadata": metadata or {}
+                }
+        except Exception as e:
+            logger.warning(f"Could not resolve message sources for tenant {tenant_id}: {str(e)}")
+
+    resolved = []
+    for sources in sources_per_message:
+        expanded = []
+        for source in sources or []:
+            if "chunk_id" not in source or "content" in source:
+                expanded.append(source)
+                continue
+            chunk = chunks.get(source["chunk_id"], {})
+            expanded.append({
+                **source,
+                "content": chunk.get("content"),
+                "metadata": chunk.get("metadata") or {"document_id": source.get("document_id")}
+            })
+        resolved.append(expanded)
+    return resolved
@@ -0,0 +1,40 @@
+from pathlib import Path
+import logging
+import os
+import time
+import uuid
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Every change to a tenant's documents writes a new version token to a small file
+# under CACHE_DIR. Caches remember the token they were filled under and drop
+# their entries once it changes. Going through the filesystem rather than an
+# in-process counter means an upload handled by one uvicorn worker also
+# invalidates the caches of every other worker on the node.
+
+def _version_path(tenant_id: int) -> Path:
+    return Path(settings.CACHE_DIR) / "tenant_versions" / f"tenant_{tenant_id}"
+
+def get_tenant_version(tenant_id: int) -> str:
+    try:
+        return _version_path(tenant_id).read_text()
+    except FileNotFoundError:
+        return ""
+    except OSError as e:
+        logger.warning(f"Could not read version for tenant {tenant_id}: {str(e)}")
+        return ""
+
+def mark_tenant_changed(tenant_id: int) -> str:
+    """Record that a tenant's documents changed; returns the new version token"""
+    path = _version_path(tenant_id)
+    version = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(version)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Could not bump version for tenant {tenant_id}: {str(e)}")
+    return version
@@ -0,0 +1,210 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Callable, List, Optional
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class ExtractionError(Exception):
+    """A file could not be extracted (timeout, memory limit, crashed worker)"""
+
+def _init_worker(memory_limit_mb: int):
+    if resource is not None and memory_limit_mb > 0:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def pdf_page_count(file_path: str) -> int:
+    import PyPDF2
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Extract pages [start, end) of a PDF, one string per page"""
+    import PyPDF2
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def extract_docx(file_path: str) -> List[str]:
+    from docx import Document as DocxDocument
+    doc = DocxDocument(file_path)
+    return [paragraph.text for paragraph in doc.paragraphs]
+
+def extract_pptx(file_path: str) -> List[str]:
+    """One string per slide"""
+    from pptx import Presentation
+    prs = Presentation(file_path)
+    slides = []
+    for slide in prs.slides:
+        slides.append("".join(shape.text + "\n" for shape in slide.shapes if hasattr(shape, "text")))
+    return slides
+
+def extract_excel(file_path: str) -> List[str]:
+    """One string per sheet"""
+    import openpyxl
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheets = []
+        for sheet in wb.worksheets:
+            lines = [f"Sheet: {sheet.title}"]
+            for row in sheet.iter_rows(values_only=True):
+                lines.append(" | ".join([str(cell) if cell else "" for cell in row]))
+            sheets.append("\n".join(lines) + "\n")
+        return sheets
+    finally:
+        wb.close()
+
+def extract_html(file_path: str) -> List[str]:
+    from bs4 import BeautifulSoup
+    with open(file_path, 'r', encoding='utf-8') as file:
+        soup = BeautifulSoup(file.read(), 'html.parser')
+        return [soup.get_text(separator='\n')]
+
+class ExtractionPool:
+    """
+    Process pool for document parsing.
+    
+    Parsers run in spawned worker processes so a slow or pathological file cannot
+    block or take down the API process: each file has a hard timeout (the pool is
+    torn down and rebuilt when it is exceeded) and each worker runs under an
+    address space limit. PDFs are split into page ranges extracted in parallel
+    and streamed back in page order.
+    Worker functions are module-level so they pickle, and import their parser
+    lazily so spawning a worker stays cheap.
+    """
+
+    def __init__(self):
+        self.max_workers = settings.EXTRACTION_WORKERS
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the API process has model and executor threads running
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(settings.EXTRACTION_MEMORY_LIMIT_MB,)
+                )
+            return self._pool
+
+    def _restart_pool(self, generation: int):
+        """Kill the workers (a stuck parser never returns on its own) and start over lazily"""
+        with self._lock:
+            if generation != self._generation or self._pool is None:
+                return  # someone else already restarted it
+            pool = self._pool
+            self._pool = None
+            self._generation += 1
+        # ProcessPoolExecutor has no public way to kill running workers
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def iter_segments(self, file_path: str, file_type: str) -> AsyncIterator[str]:
+        """
+        Yield a file's segments in document order as they are extracted.
+        The timeout budget only counts time spent waiting on the workers, not
+        time the consumer spends between segments.
+        """
+        timeout = settings.EXTRACTION_TIMEOUT_SECONDS
+        budget = [timeout]
+        for attempt in range(2):
+            generation = self._generation
+            yielded = False
+            try:
+                async for segment in self._iter(file_path, file_type, budget):
+                    yielded = True
+                    yield segment
+                return
+            except asyncio.TimeoutError:
+                self._restart_pool(generation)
+                raise ExtractionError(f"Extraction timed out after {timeout:.0f}s")
+            except MemoryError:
+                raise ExtractionError(
+                    f"Extraction exceeded the {settings.EXTRACTION_MEMORY_LIMIT_MB} MB memory limit"
+                )
+            except BrokenProcessPool:
+                if generation != self._generation and attempt == 0 and not yielded:
+                    # Collateral damage from another file's timeout; try once more
+                    continue
+                self._restart_pool(generation)
+                raise ExtractionError("Extraction worker crashed")
+
+    async def _iter(self, file_path: str, file_type: str, budget: List[float]) -> AsyncIterator[str]:
+        if file_type == "pdf":
+            async for page in self._iter_pdf(file_path, budget):
+                yield page
+            return
+        elif file_type in ["docx", "doc"]:
+            func = extract_docx
+        elif file_type in ["pptx", "ppt"]:
+            func = extract_pptx
+        elif file_type in ["xlsx", "xls"]:
+            func = extract_excel
+        elif file_type == "html":
+            func = extract_html
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        for segment in await self._await(self._submit(func, file_path), budget):
+            yield segment
+
+    async def _iter_pdf(self, file_path: str, budget: List[float]) -> AsyncIterator[str]:
+        page_count = await self._await(self._submit(pdf_page_count, file_path), budget)
+        step = max(settings.PDF_PAGES_PER_TASK, 1)
+        ranges = iter([(start, min(start + step, page_count)) for start in range(0, page_count, step)])
+        
+        # Keep a bounded window of ranges in flight so extraction runs ahead of
+        # the consumer without buffering the whole document
+        window = max(self.max_workers * 2, 1)
+        in_flight = deque()
+        try:
+            for start, end in itertools.islice(ranges, window):
+                in_flight.append(self._submit(extract_pdf_pages, file_path, start, end))
+            while in_flight:
+                pages = await self._await(in_flight.popleft(), budget)
+                for start, end in itertools.islice(ranges, 1):
+                    in_flight.append(self._submit(extract_pdf_pages, file_path, start, end))
+                for page in pages:
+                    yield page
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _submit(self, func: Callable, *args) -> Future:
+        return self._get_pool().submit(func, *args)
+
+    async def _await(self, future: Future, budget: List[float]):
+        """Wait for a worker result, charging the wait against the file's timeout budget"""
+        started = time.monotonic()
+        try:
+            if budget[0] <= 0:
+                raise asyncio.TimeoutError()
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=budget[0])
+        finally:
+            budget[0] -= time.monotonic() - started
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+extraction_pool = ExtractionPool()
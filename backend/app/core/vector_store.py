@@ -0,0 +1,803 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.file_lock import FileLock
+from app.core.model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per matrix multiply when scanning a segment
+SCAN_BLOCK_ROWS = 65536
+# Rows sampled to train IVF centroids
+IVF_TRAIN_ROWS_PER_LIST = 64
+IVF_ITERATIONS = 10
+
+DTYPES = ("float32", "float16", "int8")
+
+class VectorStore:
+    """Per-tenant collections of chunk embeddings, text and metadata"""
+
+    max_batch_size: Optional[int] = None
+
+    def get_collection(self, tenant_id: int):
+        """Existing collection of a tenant; raises ValueError if it has none"""
+        raise NotImplementedError
+
+    def get_or_create_collection(self, tenant_id: int):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    @staticmethod
+    def collection_name(tenant_id: int) -> str:
+        return f"tenant_{tenant_id}"
+
+class ChromaVectorStore(VectorStore):
+    """Collections in a persistent ChromaDB client"""
+
+    def __init__(self, path: str):
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
+        self.client = chromadb.PersistentClient(
+            path=path,
+            settings=ChromaSettings(anonymized_telemetry=False)
+        )
+        self.max_batch_size = getattr(self.client, "max_batch_size", None)
+
+    def get_collection(self, tenant_id: int):
+        return self.client.get_collection(self.collection_name(tenant_id))
+
+    def get_or_create_collection(self, tenant_id: int):
+        return self.client.get_or_create_collection(
+            name=self.collection_name(tenant_id),
+            metadata={"tenant_id": tenant_id}
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "chroma"}
+
+class NumpyVectorStore(VectorStore):
+    """
+    Collections stored as memory-mapped NumPy segments, one directory per tenant.
+
+    Collections are opened on first use and their files are memory-mapped, so
+    a worker only pages in the tenants it actually serves. See NumpyCollection.
+    """
+
+    def __init__(self, root: str, dtype: str = "float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown vector dtype: {dtype} (expected one of {', '.join(DTYPES)})")
+        self.root = Path(root)
+        self.dtype = dtype
+        self._collections: Dict[int, "NumpyCollection"] = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, tenant_id: int) -> "NumpyCollection":
+        collection = self._open(tenant_id)
+        if not collection.exists():
+            raise ValueError(f"Collection {self.collection_name(tenant_id)} does not exist.")
+        return collection
+
+    def get_or_create_collection(self, tenant_id: int) -> "NumpyCollection":
+        collection = self._open(tenant_id)
+        collection.create()
+        return collection
+
+    def _open(self, tenant_id: int) -> "NumpyCollection":
+        with self._lock:
+            collection = self._collections.get(tenant_id)
+            if collection is None:
+                collection = self._collections[tenant_id] = NumpyCollection(
+                    self.root / self.collection_name(tenant_id),
+                    self.dtype
+                )
+            return collection
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            collections = dict(self._collections)
+        return {
+            "backend": "numpy",
+            "dtype": self.dtype,
+            "collections": {
+                self.collection_name(tenant_id): collection.stats()
+                for tenant_id, collection in collections.items()
+                if collection.exists()
+            }
+        }
+
+class _Segment:
+    """
+    One immutable batch of rows on disk:
+
+    vectors.npy    embeddings in the store dtype (float32, float16 or int8)
+    scales.npy     per-row scale of int8 vectors
+    exact.npy      float32 copy used to rescore candidates of compressed vectors
+    norms.npy      squared L2 norm of each float32 vector
+    ids.json       chunk ids
+    documents.bin  chunk texts, UTF-8, concatenated; offsets.npy has row boundaries
+    metadata.json  metadata as columns: {"columns": {key: [value or null per row]}}
+    ivf_*.npy      inverted file (centroids, rows ordered by list, list offsets)
+
+    Every file is loaded lazily and arrays are memory-mapped.
+    """
+
+    def __init__(self, path: Path, rows: int):
+        self.path = path
+        self.rows = rows
+        self._lock = threading.RLock()  # loaders may load other files
+        self._loaded: Dict[str, Any] = {}
+
+    def _get(self, name: str, loader):
+        value = self._loaded.get(name)
+        if value is None:
+            with self._lock:
+                value = self._loaded.get(name)
+                if value is None:
+                    value = self._loaded[name] = loader()
+        return value
+
+    def _array(self, name: str) -> np.ndarray:
+        return self._get(name, lambda: np.load(self.path / f"{name}.npy", mmap_mode="r"))
+
+    def _json(self, name: str) -> Any:
+        def load():
+            with open(self.path / f"{name}.json", encoding="utf-8") as f:
+                return json.load(f)
+        return self._get(name, load)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._array("vectors")
+
+    @property
+    def exact(self) -> np.ndarray:
+        """float32 vectors; the stored vectors themselves when those are float32"""
+        if self.vectors.dtype == np.float32:
+            return self.vectors
+        return self._array("exact")
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return self._array("scales") if self.vectors.dtype == np.int8 else None
+
+    @property
+    def norms(self) -> np.ndarray:
+        return self._array("norms")
+
+    @property
+    def ids(self) -> List[str]:
+        return self._json("ids")
+
+    @property
+    def row_of(self) -> Dict[str, int]:
+        return self._get("row_of", lambda: {chunk_id: row for row, chunk_id in enumerate(self.ids)})
+
+    @property
+    def columns(self) -> Dict[str, List[Any]]:
+        return self._json("metadata")["columns"]
+
+    @property
+    def ivf(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        def load():
+            if not (self.path / "ivf_centroids.npy").exists():
+                return False
+            return (
+                np.load(self.path / "ivf_centroids.npy"),
+                np.load(self.path / "ivf_rows.npy", mmap_mode="r"),
+                np.load(self.path / "ivf_offsets.npy")
+            )
+        return self._get("ivf", load) or None
+
+    def document(self, row: int) -> str:
+        offsets = self._array("offsets")
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        if start == end:
+            return ""
+        blob = self._get("documents", lambda: np.memmap(self.path / "documents.bin", dtype=np.uint8, mode="r"))
+        return bytes(blob[start:end]).decode("utf-8")
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return {key: values[row] for key, values in self.columns.items() if values[row] is not None}
+
+    def approximate_scores(self, queries: np.ndarray, rows: Optional[np.ndarray], start: int = 0, end: int = 0) -> np.ndarray:
+        """
+        2·q·x - |x|² for each query and row (higher is closer), from the stored
+        vectors: squared L2 distance is |q|² minus this. Scores either the given
+        rows or the slice start:end.
+        """
+        if rows is None:
+            vectors, norms = self.vectors[start:end], self.norms[start:end]
+            scales = self.scales[start:end] if self.scales is not None else None
+        else:
+            vectors, norms = self.vectors[rows], self.norms[rows]
+            scales = self.scales[rows] if self.scales is not None else None
+        dots = np.asarray(vectors, dtype=np.float32) @ queries.T
+        if scales is not None:
+            dots *= scales[:, None]
+        return 2 * dots - norms[:, None]
+
+    def exact_distances(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(self.exact[rows], dtype=np.float32)
+        return float(query @ query) + self.norms[rows] - 2 * (vectors @ query)
+
+    def candidates(self, queries: np.ndarray, count: int, deleted: Optional[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Per query, up to `count` (rows, approximate scores) from the IVF lists or a full scan"""
+        ivf = self.ivf
+        if ivf is not None:
+            return [self._probe(query, count, deleted, ivf) for query in queries]
+
+        best_rows = [np.empty(0, dtype=np.int64) for _ in queries]
+        best_scores = [np.empty(0, dtype=np.float32) for _ in queries]
+        for start in range(0, self.rows, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, self.rows)
+            scores = self.approximate_scores(queries, None, start, end)
+            if deleted is not None:
+                scores[deleted[start:end]] = -np.inf
+            rows = np.arange(start, end)
+            for q in range(len(queries)):
+                top = _top(scores[:, q], count)
+                best_rows[q], best_scores[q] = _merge_top(
+                    best_rows[q], best_scores[q], rows[top], scores[top, q], count
+                )
+        return list(zip(best_rows, best_scores))
+
+    def _probe(self, query: np.ndarray, count: int, deleted: Optional[np.ndarray], ivf) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, ordered_rows, offsets = ivf
+        nprobe = min(settings.VECTOR_STORE_IVF_NPROBE, len(centroids))
+        centroid_scores = 2 * (centroids @ query) - np.einsum("ij,ij->i", centroids, centroids)
+        lists = _top(centroid_scores, nprobe)
+        rows = np.concatenate([ordered_rows[offsets[l]:offsets[l + 1]] for l in lists]).astype(np.int64)
+        if deleted is not None:
+            rows = rows[~deleted[rows]]
+        rows.sort()  # sequential reads from the memory map
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        scores = self.approximate_scores(query[None, :], rows)[:, 0]
+        top = _top(scores, count)
+        return rows[top], scores[top]
+
+def _top(scores: np.ndarray, count: int) -> np.ndarray:
+    """Indices of the `count` highest finite scores, unordered"""
+    if count < len(scores):
+        top = np.argpartition(-scores, count - 1)[:count]
+    else:
+        top = np.arange(len(scores))
+    return top[np.isfinite(scores[top])]
+
+def _merge_top(rows_a, scores_a, rows_b, scores_b, count):
+    rows = np.concatenate([rows_a, rows_b])
+    scores = np.concatenate([scores_a, scores_b])
+    top = _top(scores, count)
+    return rows[top], scores[top]
+
+def _conditions(where: Optional[Dict[str, Any]]) -> List[Tuple[str, Any]]:
+    """Chroma-style equality filter ({key: value} or {key: {"$eq": value}}) as (key, value) pairs"""
+    conditions = []
+    for key, value in (where or {}).items():
+        if isinstance(value, dict):
+            if set(value) != {"$eq"}:
+                raise ValueError(f"Unsupported where operator for {key}: {', '.join(value)}")
+            value = value["$eq"]
+        conditions.append((key, value))
+    return conditions
+
+def _locate(snapshot, ids: Sequence[str]) -> Dict[str, Tuple[_Segment, int]]:
+    """chunk id -> (segment, row) of the live row holding it"""
+    located: Dict[str, Tuple[_Segment, int]] = {}
+    pending = set(ids)
+    # Newest first: an updated row's previous copy is deleted anyway
+    for segment, deleted in reversed(snapshot):
+        if not pending:
+            break
+        row_of = segment.row_of
+        for chunk_id in list(pending):
+            row = row_of.get(chunk_id)
+            if row is not None and (deleted is None or not deleted[row]):
+                located[chunk_id] = (segment, row)
+                pending.discard(chunk_id)
+    return located
+
+class NumpyCollection:
+    """
+    A tenant's chunks as an append-only list of segments plus deletion masks.
+
+    Each add writes a new segment; delete and update record deleted rows in a
+    mask per segment (update re-adds the row with its new metadata). MANIFEST
+    names the live segments and masks and is replaced atomically, so readers
+    in any worker process pick up a consistent view on their next call, and
+    writers serialize through a file lock. Small segments are merged once there
+    are more than VECTOR_STORE_MAX_SEGMENTS, and everything is rewritten when
+    deleted rows pass VECTOR_STORE_COMPACT_RATIO.
+
+    Search is an exact vectorized scan of each segment, except for segments of
+    at least VECTOR_STORE_IVF_MIN_ROWS rows, which get an IVF index (k-means
+    lists, VECTOR_STORE_IVF_NPROBE of which are scanned per query). float16 and
+    int8 vectors are scored approximately, and the best
+    n_results * VECTOR_STORE_RESCORE_FACTOR are rescored with float32 copies.
+    Distances are squared L2, as in Chroma's default space.
+
+    The API is the subset of chromadb's Collection the pipeline uses.
+    """
+
+    def __init__(self, directory: Path, dtype: str):
+        self.directory = directory
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._manifest_stat: Optional[Tuple[int, int]] = None
+        self._manifest: Dict[str, Any] = {}
+        self._segments: Dict[str, _Segment] = {}
+        self._deleted: Dict[str, Optional[np.ndarray]] = {}
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.directory / "MANIFEST"
+
+    def exists(self) -> bool:
+        return self._manifest_path.exists()
+
+    def create(self):
+        if self.exists():
+            return
+        with self._write_lock():
+            if not self.exists():
+                self._commit({"dim": None, "next_segment": 0, "segments": []})
+
+    # Reading
+
+    def _refresh(self):
+        """Reload the manifest if another writer replaced it"""
+        try:
+            stat = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            raise ValueError(f"Collection {self.directory.name} does not exist.")
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key == self._manifest_stat:
+            return
+        with self._lock:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            previous_masks = {entry["name"]: entry.get("deleted") for entry in self._manifest.get("segments", [])}
+            segments, deleted = {}, {}
+            for entry in manifest["segments"]:
+                name = entry["name"]
+                segments[name] = self._segments.get(name) or _Segment(self.directory / name, entry["rows"])
+                mask_name = entry.get("deleted")
+                if name in previous_masks and previous_masks[name] == mask_name:
+                    deleted[name] = self._deleted[name]
+                else:
+                    deleted[name] = np.load(self.directory / name / mask_name) if mask_name else None
+            self._manifest, self._segments, self._deleted = manifest, segments, deleted
+            self._manifest_stat = key
+
+    def _snapshot(self) -> List[Tuple[_Segment, Optional[np.ndarray]]]:
+        self._refresh()
+        with self._lock:
+            return [(self._segments[entry["name"]], self._deleted[entry["name"]]) for entry in self._manifest["segments"]]
+
+    def _reading(self, read, *args):
+        try:
+            return read(self._snapshot(), *args)
+        except FileNotFoundError:
+            # Another process compacted away a segment this snapshot still named
+            self._manifest_stat = None
+            return read(self._snapshot(), *args)
+
+    def count(self) -> int:
+        return sum(
+            segment.rows - (int(deleted.sum()) if deleted is not None else 0)
+            for segment, deleted in self._snapshot()
+        )
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 10,
+        include: Sequence[str] = ("documents", "metadatas", "distances")
+    ) -> Dict[str, Any]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        return self._reading(self._query, queries, n_results, include)
+
+    def _query(self, snapshot, queries: np.ndarray, n_results: int, include: Sequence[str]) -> Dict[str, Any]:
+        rescore = self.dtype != "float32"
+        count = n_results * settings.VECTOR_STORE_RESCORE_FACTOR if rescore else n_results
+
+        # Per query: (distance, segment index, row) of the best rows of every segment
+        found: List[List[Tuple[float, int, int]]] = [[] for _ in queries]
+        for s, (segment, deleted) in enumerate(snapshot):
+            if segment.rows == 0:
+                continue
+            self._check_dim(queries.shape[1])
+            for q, (rows, scores) in enumerate(segment.candidates(queries, count, deleted)):
+                if rescore and len(rows):
+                    distances = segment.exact_distances(queries[q], rows)
+                else:
+                    distances = float(queries[q] @ queries[q]) - scores
+                found[q].extend(zip(distances.tolist(), [s] * len(rows), rows.tolist()))
+
+        results: Dict[str, Any] = {"ids": [], "documents": None, "metadatas": None, "distances": None}
+        for key in ("documents", "metadatas", "distances"):
+            if key in include:
+                results[key] = []
+        for hits in found:
+            hits = sorted(hits)[:n_results]
+            results["ids"].append([snapshot[s][0].ids[row] for _, s, row in hits])
+            if results["documents"] is not None:
+                results["documents"].append([snapshot[s][0].document(row) for _, s, row in hits])
+            if results["metadatas"] is not None:
+                results["metadatas"].append([snapshot[s][0].metadata(row) for _, s, row in hits])
+            if results["distances"] is not None:
+                results["distances"].append([max(distance, 0.0) for distance, _, _ in hits])
+        return results
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Sequence[str] = ("metadatas", "documents")
+    ) -> Dict[str, Any]:
+        return self._reading(self._get, ids, where, limit, offset or 0, include)
+
+    def _get(self, snapshot, ids, where, limit: Optional[int], offset: int, include: Sequence[str]) -> Dict[str, Any]:
+        rows = self._select(snapshot, ids, where, limit, offset)
+        results: Dict[str, Any] = {
+            "ids": [segment.ids[row] for segment, row in rows],
+            "documents": None,
+            "metadatas": None,
+            "embeddings": None
+        }
+        if "documents" in include:
+            results["documents"] = [segment.document(row) for segment, row in rows]
+        if "metadatas" in include:
+            results["metadatas"] = [segment.metadata(row) for segment, row in rows]
+        if "embeddings" in include:
+            results["embeddings"] = [segment.exact[row].tolist() for segment, row in rows]
+        return results
+
+    def _select(
+        self,
+        snapshot,
+        ids: Optional[Sequence[str]],
+        where: Optional[Dict[str, Any]],
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> List[Tuple[_Segment, int]]:
+        """(segment, row) of live rows matching the ids and metadata equality filter"""
+        conditions = _conditions(where)
+        if ids is not None:
+            located = _locate(snapshot, ids)
+            rows = [located[chunk_id] for chunk_id in dict.fromkeys(ids) if chunk_id in located]
+            rows = [
+                (segment, row) for segment, row in rows
+                if all(key in segment.columns and segment.columns[key][row] == value for key, value in conditions)
+            ]
+            return rows[offset:offset + limit] if limit is not None else rows[offset:]
+
+        rows = []
+        for segment, deleted in snapshot:
+            if limit is not None and len(rows) >= limit:
+                break
+            mask = np.ones(segment.rows, dtype=bool) if deleted is None else ~deleted
+            for key, value in conditions:
+                column = segment.columns.get(key)
+                if column is None:
+                    mask[:] = False
+                    break
+                mask &= np.fromiter((item == value for item in column), dtype=bool, count=segment.rows)
+            matches = np.flatnonzero(mask)
+            if offset >= len(matches):
+                offset -= len(matches)
+                continue
+            matches = matches[offset:]
+            offset = 0
+            if limit is not None:
+                matches = matches[:limit - len(rows)]
+            rows.extend((segment, int(row)) for row in matches)
+        return rows
+
+    # Writing
+
+    def add(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        documents: Optional[Sequence[str]] = None,
+        metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None
+    ):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        documents = list(documents) if documents is not None else [""] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        with self._write_lock():
+            existing = _locate(self._snapshot(), ids)
+            # Same as Chroma: adding an existing id leaves the stored row alone
+            keep = list({chunk_id: i for i, chunk_id in enumerate(ids) if chunk_id not in existing}.values())
+            if len(keep) < len(ids):
+                logger.warning(f"Skipping {len(ids) - len(keep)} existing ids in {self.directory.name}")
+            if not keep:
+                return
+            self._check_dim(vectors.shape[1])
+            manifest = self._copy_manifest()
+            manifest["dim"] = int(vectors.shape[1])
+            manifest["segments"].append(self._write_segment(
+                manifest,
+                [ids[i] for i in keep],
+                vectors[keep],
+                [documents[i] or "" for i in keep],
+                [metadatas[i] for i in keep]
+            ))
+            self._commit(self._maybe_compact(manifest))
+
+    def update(
+        self,
+        ids: Sequence[str],
+        metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+        documents: Optional[Sequence[str]] = None
+    ):
+        """Replace the metadata and/or text of existing rows; unknown ids are ignored"""
+        with self._write_lock():
+            located = _locate(self._snapshot(), ids)
+            found = [i for i, chunk_id in enumerate(ids) if chunk_id in located]
+            if not found:
+                return
+            rows = [located[ids[i]] for i in found]
+            manifest = self._copy_manifest()
+            manifest["segments"].append(self._write_segment(
+                manifest,
+                [ids[i] for i in found],
+                np.stack([np.asarray(segment.exact[row], dtype=np.float32) for segment, row in rows]),
+                [documents[i] if documents is not None else segment.document(row) for i, (segment, row) in zip(found, rows)],
+                [metadatas[i] if metadatas is not None else segment.metadata(row) for i, (segment, row) in zip(found, rows)]
+            ))
+            self._mark_deleted(manifest, rows)
+            self._commit(self._maybe_compact(manifest))
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None):
+        if ids is None and not where:
+            return
+        with self._write_lock():
+            rows = self._select(self._snapshot(), ids, where)
+            if not rows:
+                return
+            manifest = self._copy_manifest()
+            self._mark_deleted(manifest, rows)
+            self._commit(self._maybe_compact(manifest))
+
+    def _check_dim(self, dim: int):
+        expected = self._manifest.get("dim")
+        if expected is not None and expected != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimensionality {expected}")
+
+    def _copy_manifest(self) -> Dict[str, Any]:
+        return json.loads(json.dumps(self._manifest))
+
+    def _mark_deleted(self, manifest: Dict[str, Any], rows: List[Tuple[_Segment, int]]):
+        by_segment: Dict[str, List[int]] = {}
+        for segment, row in rows:
+            by_segment.setdefault(segment.path.name, []).append(row)
+        for entry in manifest["segments"]:
+            segment_rows = by_segment.get(entry["name"])
+            if not segment_rows:
+                continue
+            previous = self._deleted.get(entry["name"])
+            mask = previous.copy() if previous is not None else np.zeros(entry["rows"], dtype=bool)
+            mask[segment_rows] = True
+            mask_name = f"deleted_{uuid.uuid4().hex[:12]}.npy"
+            np.save(self.directory / entry["name"] / mask_name, mask)
+            entry["deleted"] = mask_name
+            entry["deleted_rows"] = int(mask.sum())
+
+    def _write_segment(
+        self,
+        manifest: Dict[str, Any],
+        ids: List[str],
+        vectors: np.ndarray,
+        documents: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        build_ivf: bool = False
+    ) -> Dict[str, Any]:
+        name = f"segment_{manifest['next_segment']:06d}"
+        manifest["next_segment"] += 1
+        path = self.directory / name
+        if path.exists():
+            shutil.rmtree(path)  # left over from a writer that died before committing
+        path.mkdir(parents=True)
+
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        np.save(path / "norms.npy", np.einsum("ij,ij->i", vectors, vectors).astype(np.float32))
+        if self.dtype == "float32":
+            np.save(path / "vectors.npy", vectors)
+        else:
+            np.save(path / "exact.npy", vectors)
+            if self.dtype == "float16":
+                np.save(path / "vectors.npy", vectors.astype(np.float16))
+            else:
+                scales = np.abs(vectors).max(axis=1) / 127
+                scales[scales == 0] = 1.0
+                np.save(path / "scales.npy", scales.astype(np.float32))
+                np.save(path / "vectors.npy", np.round(vectors / scales[:, None]).astype(np.int8))
+
+        encoded = [document.encode("utf-8") for document in documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(document) for document in encoded], out=offsets[1:])
+        np.save(path / "offsets.npy", offsets)
+        with open(path / "documents.bin", "wb") as f:
+            f.write(b"".join(encoded))
+
+        keys = list(dict.fromkeys(key for metadata in metadatas for key in (metadata or {})))
+        columns = {key: [(metadata or {}).get(key) for metadata in metadatas] for key in keys}
+        with open(path / "metadata.json", "w", encoding="utf-8") as f:
+            json.dump({"columns": columns}, f)
+        with open(path / "ids.json", "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+
+        if build_ivf and len(ids) >= settings.VECTOR_STORE_IVF_MIN_ROWS:
+            centroids, ordered_rows, list_offsets = _build_ivf(vectors)
+            np.save(path / "ivf_centroids.npy", centroids)
+            np.save(path / "ivf_rows.npy", ordered_rows)
+            np.save(path / "ivf_offsets.npy", list_offsets)
+        return {"name": name, "rows": len(ids), "deleted": None, "deleted_rows": 0}
+
+    def _maybe_compact(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge segments when there are too many or too many rows are deleted"""
+        segments = manifest["segments"]
+        total = sum(entry["rows"] for entry in segments)
+        deleted = sum(entry.get("deleted_rows", 0) for entry in segments)
+        if total and deleted / total > settings.VECTOR_STORE_COMPACT_RATIO:
+            return self._merge(manifest, segments)
+        if len(segments) <= settings.VECTOR_STORE_MAX_SEGMENTS:
+            return manifest
+        # Merge everything after the largest segment; fold that in too once the
+        # tail has grown comparable to it, which keeps rewrites amortized
+        base = max(range(len(segments)), key=lambda i: segments[i]["rows"])
+        tail = segments[:base] + segments[base + 1:]
+        if sum(entry["rows"] for entry in tail) * 2 >= segments[base]["rows"]:
+            return self._merge(manifest, segments)
+        return self._merge(manifest, tail)
+
+    def _merge(self, manifest: Dict[str, Any], entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ids: List[str] = []
+        vectors: List[np.ndarray] = []
+        documents: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        for entry in entries:
+            segment = self._segment(entry)
+            mask_name = entry.get("deleted")
+            live = np.arange(entry["rows"])
+            if mask_name:
+                live = np.flatnonzero(~np.load(segment.path / mask_name))
+            if not len(live):
+                continue
+            ids.extend(segment.ids[row] for row in live)
+            vectors.append(np.asarray(segment.exact[live], dtype=np.float32))
+            documents.extend(segment.document(row) for row in live)
+            metadatas.extend(segment.metadata(row) for row in live)
+
+        merged_names = {entry["name"] for entry in entries}
+        remaining = [entry for entry in manifest["segments"] if entry["name"] not in merged_names]
+        if ids:
+            dim = manifest["dim"] or vectors[0].shape[1]
+            merged = self._write_segment(manifest, ids, np.concatenate(vectors).reshape(-1, dim), documents, metadatas, build_ivf=True)
+            remaining.insert(0, merged)
+        manifest["segments"] = remaining
+        logger.info(f"Compacted {len(entries)} segments of {self.directory.name} into {len(ids)} rows")
+        return manifest
+
+    def _segment(self, entry: Dict[str, Any]) -> _Segment:
+        segment = self._segments.get(entry["name"])
+        return segment if segment is not None else _Segment(self.directory / entry["name"], entry["rows"])
+
+    def _commit(self, manifest: Dict[str, Any]):
+        """Atomically publish a manifest and remove files it no longer references"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f"MANIFEST.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path)
+        self._manifest_stat = None
+        self._refresh()
+
+        # Readers that mapped a removed file keep it until they drop the mapping
+        live = {entry["name"]: entry.get("deleted") for entry in manifest["segments"]}
+        for path in self.directory.iterdir():
+            if not path.is_dir():
+                continue
+            if path.name not in live:
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            for mask in path.glob("deleted_*.npy"):
+                if mask.name != live[path.name]:
+                    mask.unlink(missing_ok=True)
+
+    def _write_lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return _CollectionWriteLock(self._lock, FileLock(self.directory / "lock"))
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot()
+        return {
+            "segments": len(snapshot),
+            "rows": sum(segment.rows for segment, _ in snapshot),
+            "deleted_rows": sum(int(deleted.sum()) for _, deleted in snapshot if deleted is not None),
+            "ivf_segments": sum(1 for segment, _ in snapshot if segment.ivf is not None)
+        }
+
+class _CollectionWriteLock:
+    """Thread lock plus cross-process file lock"""
+
+    def __init__(self, thread_lock, file_lock: FileLock):
+        self.thread_lock = thread_lock
+        self.file_lock = file_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            self.file_lock.__enter__()
+        except BaseException:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.file_lock.__exit__(*exc)
+        finally:
+            self.thread_lock.release()
+
+def _build_ivf(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """k-means lists over the vectors: (centroids, rows ordered by list, list offsets)"""
+    n = len(vectors)
+    lists = max(int(np.sqrt(n)), 1)
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(n, size=min(n, lists * IVF_TRAIN_ROWS_PER_LIST), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+    for _ in range(IVF_ITERATIONS):
+        assignment = _assign(sample, centroids)
+        order = np.argsort(assignment, kind="stable")
+        used, starts = np.unique(assignment[order], return_index=True)
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        counts = np.diff(np.append(starts, len(order)))
+        centroids[used] = sums / counts[:, None]
+    assignment = np.concatenate([
+        _assign(vectors[start:start + SCAN_BLOCK_ROWS], centroids)
+        for start in range(0, n, SCAN_BLOCK_ROWS)
+    ])
+    ordered_rows = np.argsort(assignment, kind="stable").astype(np.int64)
+    offsets = np.searchsorted(assignment[ordered_rows], np.arange(lists + 1)).astype(np.int64)
+    return centroids.astype(np.float32), ordered_rows, offsets
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    scores = vectors @ centroids.T
+    scores *= 2
+    scores -= np.einsum("ij,ij->i", centroids, centroids)
+    return scores.argmax(axis=1)
+
+def get_vector_store() -> VectorStore:
+    """Process-wide vector store selected by VECTOR_STORE_BACKEND"""
+    return registry.get("vector_store")
+
+def _create_vector_store() -> VectorStore:
+    backend = settings.VECTOR_STORE_BACKEND
+    if backend == "chroma":
+        return ChromaVectorStore(settings.CHROMA_PERSIST_DIR)
+    if backend == "numpy":
+        return NumpyVectorStore(settings.VECTOR_STORE_DIR, settings.VECTOR_STORE_DTYPE)
+    raise ValueError(f"Unknown vector store backend: {backend} (expected chroma or numpy)")
+
+registry.register("vector_store", _create_vector_store)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.database import Base
@@ -36,10 +36,16 @@ class Tenant(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Keyset pagination of a user's conversations by last activity
+        Index("ix_conversations_user_id_updated_at_id", "user_id", "updated_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     title = Column(String, default="New Conversation")
+    summary = Column(Text)  # compacted older turns, see app/core/history_manager.py
+    summary_message_id = Column(Integer)  # last message folded into the summary
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -48,6 +54,10 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Latest messages of a conversation without scanning all of them
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
@@ -77,11 +87,31 @@ class Document(Base):
     user = relationship("User", back_populates="documents")
     tenant = relationship("Tenant", back_populates="documents")
 
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    tenant_id = Column(Integer, nullable=False, index=True)
+    status = Column(String, default="pending", index=True)  # pending, running, completed, failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    lease_expires_at = Column(DateTime)  # a running job whose lease expired is picked up again
+    last_error = Column(Text)
+    payload = Column(JSON, default={})  # file_path, file_type, metadata
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    
+    document = relationship("Document")
+
 class Analytics(Base):
     __tablename__ = "analytics"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    tenant_id = Column(Integer, index=True)
     query = Column(Text)
     response_time = Column(Float)
     tokens_used = Column(Integer)
@@ -89,3 +119,22 @@ class Analytics(Base):
     satisfaction_score = Column(Float)
     analytics_metadata = Column(JSON, default={})  # Renamed from 'metadata' to avoid SQLAlchemy conflict
     created_at = Column(DateTime, default=datetime.utcnow)
+
+# Per-user totals for one hour or one day, kept up to date by app/core/analytics_recorder.py
+class AnalyticsRollup(Base):
+    __tablename__ = "analytics_rollups"
+    __table_args__ = (
+        UniqueConstraint("period", "user_id", "period_start", name="uq_analytics_rollups_period_user_start"),
+        Index("ix_analytics_rollups_tenant_period_start", "tenant_id", "period", "period_start"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    period = Column(String, nullable=False)  # hour, day
+    period_start = Column(DateTime, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    tenant_id = Column(Integer)
+    queries = Column(Integer, default=0)
+    tokens_used = Column(Integer, default=0)
+    cost = Column(Float, default=0.0)
+    response_time_sum = Column(Float, default=0.0)
+    response_time_count = Column(Integer, default=0)  # queries with a recorded response time
@@ -1,23 +1,48 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 from app.core.config import settings
 from app.api.v1 import auth, chat, documents, analytics
 from app.db.database import engine, Base
+from app.core.executors import executor_stats, run_io, shutdown_executors
+from app.core.text_extraction import extraction_pool
+from app.core.analytics_recorder import analytics_recorder
+from app.core.answer_cache import answer_cache
+from app.core.context_cache import context_cache
+from app.core.keyword_index import keyword_index
+from app.core.metrics import metrics
+from app.core.reranker import reranker_stats
+from app.core.model_registry import registry
+# Registers the shared embedding service and vector store (loaded lazily)
+from app.core import embedding_service, vector_store  # noqa: F401
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Loaded in the background after startup; /ready answers 503 until all are loaded
+WARM_UP_MODELS = ["embeddings", "vector_store", "reranker", "rag_orchestrator", "document_processor"]
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Enterprise RAG 2.0 Application")
     Base.metadata.create_all(bind=engine)
+    # Serve auth and document listing right away; models load behind /ready
+    warm_up = asyncio.ensure_future(run_io(registry.warm_up, WARM_UP_MODELS))
+    await documents.ingestion_queue.start()
+    await analytics_recorder.start()
     yield
     # Shutdown
     logger.info("Shutting down application")
+    warm_up.cancel()
+    await documents.ingestion_queue.stop()
+    await analytics_recorder.stop()
+    extraction_pool.shutdown()
+    shutdown_executors()
 
 app = FastAPI(
     title="Enterprise RAG 2.0 API",
@@ -52,3 +77,77 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once every model has loaded, 503 while loading or after a failure"""
+    components = {name: registry.state(name) for name in WARM_UP_MODELS}
+    ready = all(state == "ready" for state in components.values())
+    if ready:
+        status = "ready"
+    elif "failed" in components.values():
+        status = "failed"
+    else:
+        status = "loading"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": status, "components": components}
+    )
+
+def _stats_if_loaded(name: str, stats):
+    # /stats must not trigger (and wait for) a model load
+    return stats(registry.get(name)) if registry.is_loaded(name) else None
+
+@app.get("/stats")
+async def stats():
+    return {
+        "executors": executor_stats(),
+        "ingestion": documents.ingestion_queue.stats(),
+        "ingestion_pipeline": _stats_if_loaded("document_processor", lambda processor: processor.pipeline_stats.snapshot()),
+        "embeddings": _stats_if_loaded("embeddings", lambda service: service.stats()),
+        "analytics": analytics_recorder.stats(),
+        "answer_cache": answer_cache.stats(),
+        "context_cache": context_cache.stats(),
+        "keyword_index": keyword_index.stats(),
+        "reranker": reranker_stats(),
+        "vector_store": _stats_if_loaded("vector_store", lambda store: store.stats()),
+        "models": registry.stats()
+    }
+
+CACHE_HITS = metrics.counter("rag_cache_hits_total", "Cache lookups that found an entry", ["cache"])
+CACHE_MISSES = metrics.counter("rag_cache_misses_total", "Cache lookups that found nothing usable", ["cache"])
+CACHE_HIT_RATIO = metrics.gauge("rag_cache_hit_ratio", "Hits / lookups since startup", ["cache"])
+EXECUTOR_TASKS = metrics.gauge("rag_executor_tasks", "Blocking calls queued for or running in a worker thread", ["executor", "state"])
+INGESTION_RUNNING = metrics.gauge("rag_ingestion_jobs_running", "Documents being ingested")
+
+def _cache_stats():
+    embeddings = _stats_if_loaded("embeddings", lambda service: service.stats()) or {}
+    reranker = reranker_stats() or {}
+    return {
+        "answer": answer_cache.stats(),
+        "context": context_cache.stats(),
+        "query_embedding": embeddings.get("query_cache"),
+        "chunk_embedding": embeddings.get("chunk_cache"),
+        "rerank_score": reranker.get("score_cache")
+    }
+
+def _collect_metrics():
+    """Copy the counters the caches, executors and ingestion queue keep into /metrics"""
+    for cache, cache_stats in _cache_stats().items():
+        # Disabled, not loaded yet, or failing (e.g. {"error": ...}) caches are left out
+        if not cache_stats or "hits" not in cache_stats:
+            continue
+        CACHE_HITS.set(cache_stats["hits"], cache=cache)
+        CACHE_MISSES.set(cache_stats["misses"], cache=cache)
+        CACHE_HIT_RATIO.set(cache_stats["hit_ratio"], cache=cache)
+    for executor, executor_state in executor_stats().items():
+        EXECUTOR_TASKS.set(executor_state["queued"], executor=executor, state="queued")
+        EXECUTOR_TASKS.set(executor_state["active"], executor=executor, state="active")
+    INGESTION_RUNNING.set(documents.ingestion_queue.stats()["running"])
+
+metrics.add_collector(_collect_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latency histograms, in-flight gauges and cache hit ratios in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the reranker backends against fp32 PyTorch.
+
+Usage: python benchmark_reranker.py [backend ...]   (default: torch quantized onnx)
+"""
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv('backend/.env')
+sys.path.insert(0, 'backend')
+
+from app.core.config import settings
+from app.core.reranker import BACKENDS, _LOADERS, _CHECK_PAIRS, compare_scores
+
+REPEATS = 5
+CANDIDATES = 10  # pairs per query, as in accurate mode (TOP_K_RETRIEVAL)
+
+# Candidate chunks of varying length, like retrieved CHUNK_SIZE chunks
+pairs = []
+for query, text in _CHECK_PAIRS:
+    for i in range(CANDIDATES // 2):
+        pairs.append((query, " ".join([text] * (1 + i * 2))))
+
+def time_backend(predict):
+    predict(pairs[:CANDIDATES])  # warm-up
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        for start in range(0, len(pairs), settings.RERANKER_BATCH_SIZE):
+            predict(pairs[start:start + settings.RERANKER_BATCH_SIZE])
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+backends = sys.argv[1:] or list(BACKENDS)
+print(f"Reranker benchmark: {settings.RERANKER_MODEL}, {len(pairs)} pairs, best of {REPEATS}")
+print("")
+
+reference = _LOADERS["torch"](settings.RERANKER_MODEL)
+baseline = time_backend(reference)
+
+for backend in backends:
+    try:
+        predict = reference if backend == "torch" else _LOADERS[backend](settings.RERANKER_MODEL)
+    except Exception as e:
+        print(f"✗ {backend}: {str(e)}")
+        continue
+    elapsed = baseline if backend == "torch" else time_backend(predict)
+    check = compare_scores(reference, predict, pairs)
+    print(f"✓ {backend:<10} {elapsed * 1000:8.1f} ms  {elapsed * 1000 / len(pairs):6.2f} ms/pair  "
+          f"speedup {baseline / elapsed:4.2f}x  max diff {check['max_abs_diff']:.4f}  "
+          f"same order {'yes' if check['same_order'] else 'no'}")
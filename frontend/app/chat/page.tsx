@@ -9,7 +9,7 @@ import ReactMarkdown from 'react-markdown';
 
 export default function Chat() {
   const router = useRouter();
-  const { user, setUser, token, setToken, currentConversation, setCurrentConversation, conversations, setConversations, logout } = useStore();
+  const { user, setUser, token, setToken, currentConversation, setCurrentConversation, conversations, conversationsCursor, setConversations, logout } = useStore();
   const [message, setMessage] = useState('');
   const [loading, setLoading] = useState(false);
   const [sidebarOpen, setSidebarOpen] = useState(true);
@@ -17,6 +17,7 @@ export default function Chat() {
   const [ragMode, setRagMode] = useState<'fast' | 'accurate'>('fast');
   const [streamingText, setStreamingText] = useState('');
   const [isStreaming, setIsStreaming] = useState(false);
+  const [streamingSources, setStreamingSources] = useState<any[]>([]);
   const [copiedMessageId, setCopiedMessageId] = useState<number | null>(null);
   const [showSettingsModal, setShowSettingsModal] = useState(false);
   const [settingsTab, setSettingsTab] = useState<'general' | 'profile' | 'about'>('general');
@@ -64,7 +65,7 @@ export default function Chat() {
   const loadConversations = async () => {
     try {
       const response = await chat.getConversations();
-      setConversations(response.data);
+      setConversations(response.data.items, response.data.next_cursor);
     } catch (error: any) {
       if (error.response?.status === 401) {
         // Token expired, already handled in loadUserAndConversations
@@ -74,6 +75,30 @@ export default function Chat() {
     }
   };
 
+  const loadMoreConversations = async () => {
+    if (!conversationsCursor) return;
+    try {
+      const response = await chat.getConversations(conversationsCursor);
+      setConversations([...conversations, ...response.data.items], response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading conversations:', error);
+    }
+  };
+
+  const loadEarlierMessages = async () => {
+    if (!currentConversation?.messages_cursor) return;
+    try {
+      const response = await chat.getMessages(currentConversation.id, currentConversation.messages_cursor);
+      setCurrentConversation({
+        ...currentConversation,
+        messages: [...response.data.items, ...currentConversation.messages],
+        messages_cursor: response.data.next_cursor
+      });
+    } catch (error) {
+      console.error('Error loading messages:', error);
+    }
+  };
+
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
     if (!message.trim() || loading) return;
@@ -155,49 +180,61 @@ export default function Chat() {
         return;
       }
 
-      // Step 3: Send message to backend
-      const response = await chat.sendMessage(userMessage, currentConversation?.id, ragMode);
+      // Step 3: Stream the response from the backend; sources arrive first, then the answer tokens
+      let answer = '';
+      let finished = false;
+      let streamError: string | null = null;
+      let newConversationId = 0;
+      await chat.streamMessage(userMessage, (event, data) => {
+        if (event === 'sources') {
+          setLoading(false);
+          setIsStreaming(true);
+          setStreamingSources(data.sources || []);
+        } else if (event === 'token') {
+          setLoading(false);
+          setIsStreaming(true);
+          answer += data.content;
+          setStreamingText(answer);
+        } else if (event === 'done') {
+          finished = true;
+          newConversationId = data.conversation_id;
+        } else if (event === 'error') {
+          streamError = data.detail;
+        }
+      }, currentConversation?.id || undefined, ragMode);
+
+      if (!finished) {
+        throw new Error(streamError || 'The response ended before it was complete');
+      }
 
-      // Step 4: Get the full conversation with the new response
+      // Step 4: Get the saved messages; for an existing conversation only the
+      // messages added since the last sync are fetched
       let convResponse;
-      if (!currentConversation || currentConversation.id === 0) {
-        convResponse = await chat.getConversation(response.data.conversation_id);
+      if (!currentConversation || currentConversation.id === 0 || !currentConversation.sync_cursor) {
+        convResponse = await chat.getConversation(newConversationId);
         loadConversations();
       } else {
-        convResponse = await chat.getConversation(currentConversation.id);
-      }
-
-      setLoading(false);
-
-      // Step 5: Find the assistant's response
-      const assistantMessage = convResponse.data.messages[convResponse.data.messages.length - 1];
-
-      if (assistantMessage && assistantMessage.role === 'assistant') {
-        // Step 6: Stream the response with typing effect
-        setIsStreaming(true);
-        setStreamingText('');
-
-        const fullText = assistantMessage.content;
-        let currentIndex = 0;
-
-        const typingInterval = setInterval(() => {
-          if (currentIndex < fullText.length) {
-            setStreamingText(fullText.substring(0, currentIndex + 1));
-            currentIndex++;
-          } else {
-            clearInterval(typingInterval);
-            setIsStreaming(false);
-            setStreamingText('');
-            setCurrentConversation(convResponse.data);
+        const sinceResponse = await chat.getMessagesSince(currentConversation.id, currentConversation.sync_cursor);
+        convResponse = {
+          data: {
+            ...currentConversation,
+            messages: [...currentConversation.messages, ...sinceResponse.data.items],
+            sync_cursor: sinceResponse.data.cursor
           }
-        }, 20); // 20ms per character for smooth typing
-      } else {
-        setCurrentConversation(convResponse.data);
+        };
       }
-    } catch (error) {
+
+      setIsStreaming(false);
+      setStreamingText('');
+      setStreamingSources([]);
+      setCurrentConversation(convResponse.data);
+    } catch (error: any) {
       console.error('Error sending message:', error);
       setLoading(false);
-      alert('Error sending message. Please try logging in.');
+      setIsStreaming(false);
+      setStreamingText('');
+      setStreamingSources([]);
+      alert(error?.message || 'Error sending message. Please try logging in.');
     }
   };
 
@@ -369,6 +406,11 @@ export default function Chat() {
                     }`}
                 >
                   {conv.title}
+                  {conv.last_message_preview && (
+                    <span className={`block text-xs truncate ${darkMode ? 'text-gray-500' : 'text-gray-400'}`}>
+                      {conv.last_message_preview}
+                    </span>
+                  )}
                 </button>
                 {longPressConvId === conv.id && (
                   <div className="absolute inset-0 flex items-center justify-center gap-2 bg-black/50 rounded-lg backdrop-blur-sm z-10 px-2">
@@ -389,6 +431,14 @@ export default function Chat() {
                 )}
               </div>
             ))}
+            {conversationsCursor && (
+              <button
+                onClick={loadMoreConversations}
+                className={`w-full px-3 py-2 rounded-lg text-xs ${darkMode ? 'text-gray-500 hover:bg-[#232323] hover:text-white' : 'text-gray-500 hover:bg-gray-200 hover:text-gray-900'}`}
+              >
+                Load more
+              </button>
+            )}
           </div>
 
           <div className={`mt-auto border-t pt-4 space-y-1 flex-shrink-0 ${darkMode ? 'border-[#2a2a2a]' : 'border-gray-200'}`}>
@@ -493,6 +543,16 @@ export default function Chat() {
           ) : (
             // Messages list
             <div className="max-w-4xl mx-auto px-4 py-6 space-y-6">
+              {currentConversation.messages_cursor && (
+                <div className="flex justify-center">
+                  <button
+                    onClick={loadEarlierMessages}
+                    className={`px-3 py-1.5 rounded-lg text-xs ${darkMode ? 'text-gray-400 hover:bg-[#232323]' : 'text-gray-600 hover:bg-gray-100'}`}
+                  >
+                    Load earlier messages
+                  </button>
+                </div>
+              )}
               {currentConversation.messages.map((msg) => (
                 <div key={msg.id} className="space-y-2">
                   {msg.role === 'user' ? (
@@ -516,7 +576,7 @@ export default function Chat() {
                             <p className="text-xs font-semibold mb-2">Sources:</p>
                             {msg.sources.map((source, idx) => (
                               <div key={idx} className={`text-xs mb-1 ${darkMode ? 'text-gray-400' : 'text-gray-600'}`}>
-                                {source.content}
+                                {source.content || source.metadata?.filename || 'Source no longer available'}
                               </div>
                             ))}
                           </div>
@@ -577,7 +637,7 @@ export default function Chat() {
                 </div>
               )}
 
-              {isStreaming && streamingText && (
+              {isStreaming && (streamingText || streamingSources.length > 0) && (
                 <div className="flex justify-start">
                   <div className={`max-w-[80%] rounded-2xl px-4 py-3 ${darkMode ? 'bg-[#232323] text-gray-100' : 'bg-gray-100 text-gray-900'
                     }`}>
@@ -586,6 +646,17 @@ export default function Chat() {
                       {streamingText}
                     </ReactMarkdown>
                     <span className="inline-block w-1 h-4 bg-blue-600 animate-pulse ml-1"></span>
+
+                    {streamingSources.length > 0 && (
+                      <div className={`mt-3 pt-3 border-t ${darkMode ? 'border-[#333333]' : 'border-gray-200'}`}>
+                        <p className="text-xs font-semibold mb-2">Sources:</p>
+                        {streamingSources.map((source, idx) => (
+                          <div key={idx} className={`text-xs mb-1 ${darkMode ? 'text-gray-400' : 'text-gray-600'}`}>
+                            {source.content || source.metadata?.filename || 'Source no longer available'}
+                          </div>
+                        ))}
+                      </div>
+                    )}
                   </div>
                 </div>
               )}
@@ -32,8 +32,53 @@ export const auth = {
 export const chat = {
   sendMessage: (content: string, conversationId?: number, ragMode?: 'fast' | 'accurate') =>
     api.post('/api/v1/chat/message', { content, conversation_id: conversationId, rag_mode: ragMode }),
-  getConversations: () => api.get('/api/v1/chat/conversations'),
+  // Streams Server-Sent Events: "sources", "token" (repeated), then "done" or "error"
+  streamMessage: async (
+    content: string,
+    onEvent: (event: string, data: any) => void,
+    conversationId?: number,
+    ragMode?: 'fast' | 'accurate'
+  ) => {
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${API_URL}/api/v1/chat/message/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify({ content, conversation_id: conversationId, rag_mode: ragMode }),
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Stream request failed with status ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const frames = buffer.split('\n\n');
+      buffer = frames.pop() || '';
+      for (const frame of frames) {
+        const eventLine = frame.split('\n').find((line) => line.startsWith('event: '));
+        const dataLine = frame.split('\n').find((line) => line.startsWith('data: '));
+        if (eventLine && dataLine) {
+          onEvent(eventLine.slice(7), JSON.parse(dataLine.slice(6)));
+        }
+      }
+    }
+  },
+  // Pages of conversation summaries; pass next_cursor from the previous page to get the next
+  getConversations: (cursor?: string | null) =>
+    api.get('/api/v1/chat/conversations', { params: cursor ? { cursor } : {} }),
+  // The conversation with its latest messages; older ones come from getMessages(id, messages_cursor)
   getConversation: (id: number) => api.get(`/api/v1/chat/conversations/${id}`),
+  getMessages: (id: number, cursor: string) =>
+    api.get(`/api/v1/chat/conversations/${id}/messages`, { params: { cursor } }),
+  // Only messages added after the cursor (the conversation's sync_cursor or the previous call's cursor)
+  getMessagesSince: (id: number, cursor: string) =>
+    api.get(`/api/v1/chat/conversations/${id}/messages/since`, { params: { cursor } }),
   deleteConversation: (id: number) => api.delete(`/api/v1/chat/conversations/${id}`),
 };
 
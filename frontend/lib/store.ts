@@ -19,19 +19,31 @@ interface Conversation {
   id: number;
   title: string;
   messages: Message[];
+  messages_cursor?: string | null;
+  sync_cursor?: string | null;
   created_at: string;
   updated_at: string;
 }
 
+interface ConversationSummary {
+  id: number;
+  title: string;
+  created_at: string;
+  updated_at: string;
+  message_count: number;
+  last_message_preview?: string | null;
+}
+
 interface AppState {
   user: User | null;
   token: string | null;
   currentConversation: Conversation | null;
-  conversations: Conversation[];
+  conversations: ConversationSummary[];
+  conversationsCursor: string | null;
   setUser: (user: User | null) => void;
   setToken: (token: string | null) => void;
   setCurrentConversation: (conversation: Conversation | null) => void;
-  setConversations: (conversations: Conversation[]) => void;
+  setConversations: (conversations: ConversationSummary[], cursor?: string | null) => void;
   logout: () => void;
 }
 
@@ -40,6 +52,7 @@ export const useStore = create<AppState>((set) => ({
   token: null,
   currentConversation: null,
   conversations: [],
+  conversationsCursor: null,
   setUser: (user) => set({ user }),
   setToken: (token) => {
     if (token) {
@@ -50,9 +63,9 @@ export const useStore = create<AppState>((set) => ({
     set({ token });
   },
   setCurrentConversation: (conversation) => set({ currentConversation: conversation }),
-  setConversations: (conversations) => set({ conversations }),
+  setConversations: (conversations, cursor = null) => set({ conversations, conversationsCursor: cursor }),
   logout: () => {
     localStorage.removeItem('token');
-    set({ user: null, token: null, currentConversation: null, conversations: [] });
+    set({ user: null, token: null, currentConversation: null, conversations: [], conversationsCursor: null });
   },
 }));
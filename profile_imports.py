@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Report how long importing the backend takes, per module and per package.
+
+Usage: python profile_imports.py [module] [top_n]   (default: app.main 25)
+"""
+import os
+import subprocess
+import sys
+
+module = sys.argv[1] if len(sys.argv) > 1 else "app.main"
+top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+
+# -X importtime writes one line per imported module to stderr:
+# "import time: self [us] | cumulative | imported package"
+result = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+    cwd="backend",
+    env={**os.environ, "PYTHONPATH": "."},
+    capture_output=True,
+    text=True
+)
+
+timings = []
+for line in result.stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+        continue
+    self_us, cumulative_us, name = line[len("import time:"):].split("|")
+    timings.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+
+if result.returncode != 0:
+    print(f"✗ import {module} failed:")
+    print("\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:")))
+    sys.exit(1)
+
+total = sum(self_us for _, self_us, _, _ in timings)
+print(f"import {module}: {total / 1e6:.2f}s, {len(timings)} modules")
+print("")
+
+print(f"Slowest modules (cumulative, including what they import):")
+for name, _, cumulative_us, _ in sorted(timings, key=lambda t: t[2], reverse=True)[:top_n]:
+    print(f"  {cumulative_us / 1000:9.1f} ms  {name}")
+print("")
+
+packages = {}
+for name, self_us, _, _ in timings:
+    package = name.split(".")[0]
+    packages[package] = packages.get(package, 0) + self_us
+print(f"Time per top-level package (own import time of all its modules):")
+for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top_n]:
+    print(f"  {self_us / 1000:9.1f} ms  {package}")